@@ -5,89 +5,150 @@ Logique métier pour charger, traiter et valider les annotations
 import json
 import os
 import unicodedata
-from typing import List, Dict, Any, Optional, Tuple
+from typing import List, Dict, Any, Optional, Tuple, Iterator
+
+from prompts.columnar import open_columnar
+from prompts.compressed_io import open_text
+
+from .corpus_index import CorpusIndex, find_index, open_index
+from .validation import validate_batch
 
 
 class AnnotationManager:
     def __init__(self, data_file: str):
         self.data_file = data_file
+        self._index = None
         
     def load_annotations(self) -> List[Dict[str, Any]]:
         """Charge les annotations depuis le fichier JSONL"""
         print(f"DEBUG: Chargement des annotations depuis: {self.data_file}")
         print(f"DEBUG: Fichier existe: {os.path.exists(self.data_file)}")
         
-        items = []
+        items = list(self.iter_annotations())
+        
+        print(f"DEBUG: Nombre total d'annotations chargées: {len(items)}")
+        return items
+
+    def iter_annotations(self, build_cache: bool = True) -> Iterator[Dict[str, Any]]:
+        """Parcourt les annotations du fichier JSONL une par une (normalisées)
+
+        build_cache=False : le cache colonnaire n'est utilisé que s'il est déjà à jour
+        (pas de construction complète avant le premier document).
+        """
         if not os.path.exists(self.data_file):
             print(f"DEBUG: Fichier non trouvé: {self.data_file}")
-            return items
-            
-        with open(self.data_file, 'r', encoding='utf-8') as f:
+            return
+
+        # Cache colonnaire voisin (.cols) : pas de json.loads par ligne une fois construit
+        corpus = open_columnar(self.data_file, build=build_cache)
+        if corpus is not None:
+            try:
+                for annotation in corpus:
+                    yield self.prepare_annotation(annotation)
+            finally:
+                corpus.close()
+            return
+
+        with open_text(self.data_file) as f:
             for line_num, line in enumerate(f, 1):
                 line = line.strip()
                 if not line:
                     continue
                 try:
                     annotation = json.loads(line)
-
-                    # Assurer la présence du champ scopes
-                    if 'scopes' not in annotation:
-                        annotation['scopes'] = []
-                    
-                    # Si scopes est vide MAIS qu'il y a un champ scope (ancien format), migrer
-                    if not annotation['scopes'] and 'scope' in annotation and annotation['scope']:
-                        # On suppose scope = string, on crée un dictionnaire
-                        annotation['scopes'].append({'scope': annotation['scope'], 'positions': None})
-
-                    text = annotation.get('text', '')
-                    # Calculer les positions pour chaque scope si elles n'existent pas
-                    print(f"DEBUG load_annotations: Traitement annotation ID {annotation.get('id', 'N/A')}")
-                    print(f"DEBUG load_annotations: Nombre de scopes = {len(annotation['scopes'])}")
-                    
-                    for i, scope in enumerate(annotation['scopes']):
-                        scope_text = scope.get('scope', '')
-                        existing_positions = scope.get('positions')
-                        print(f"DEBUG load_annotations: Scope {i+1}: '{scope_text}'")
-                        print(f"DEBUG load_annotations: Positions existantes: {existing_positions}")
-                        
-                        if not scope.get('positions') or not isinstance(scope['positions'], list) or len(scope['positions']) == 0:
-                            print(f"DEBUG load_annotations: Calcul nécessaire pour scope '{scope_text}'")
-                            pos_list = self._find_scope_position(text, scope_text)
-                            if pos_list:
-                                scope['positions'] = pos_list
-                                print(f"DEBUG load_annotations: ✅ Positions multiples calculées et assignées: {scope['positions']}")
-                            else:
-                                print(f"DEBUG load_annotations: ❌ Impossible de calculer les positions")
-                        else:
-                            print(f"DEBUG load_annotations: Positions déjà présentes, pas de calcul")
-                    
-                    print("DEBUG load_annotations: " + "="*50)
-
-                    items.append(annotation)
                 except json.JSONDecodeError as e:
                     print(f"Erreur ligne {line_num}: {e}")
                     continue
+                yield self.prepare_annotation(annotation)
+    
+    def open_index(self, cache_dir: str) -> CorpusIndex:
+        """Index mmap partagé du fichier courant (construit une fois, puis réutilisé)"""
+        index = self._index
+        if index is not None and index.is_fresh(self.data_file):
+            return index
+        self._index = open_index(self.data_file, cache_dir, self.iter_annotations, self.stats_from_totals)
+        return self._index
+
+    def cached_index(self, cache_dir: str) -> Optional[CorpusIndex]:
+        """Index à jour s'il est déjà construit (None sinon : aucune construction ici)"""
+        index = self._index
+        if index is not None and index.is_fresh(self.data_file):
+            return index
+        index = find_index(self.data_file, cache_dir)
+        if index is not None:
+            self._index = index
+        return index
+
+    def memory_bytes(self) -> int:
+        """Mémoire propre au processus pour le corpus chargé (les pages mappées de l'index sont partagées)"""
+        index = self._index
+        return index.memory_bytes() if index is not None else 0
+
+    def mapped_bytes(self) -> int:
+        """Octets mappés de l'index (cache de pages commun à tous les workers)"""
+        index = self._index
+        return index.nbytes if index is not None else 0
 
+    def iter_serialized(self) -> Iterator[bytes]:
+        """Documents normalisés sérialisés un par un (même format compact que l'index)"""
+        for annotation in self.iter_annotations(build_cache=False):
+            yield json.dumps(annotation, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def prepare_annotation(self, annotation: Dict[str, Any]) -> Dict[str, Any]:
+        """Normalise une annotation chargée (champ scopes, migration, positions des portées)"""
+        # Assurer la présence du champ scopes
+        if 'scopes' not in annotation:
+            annotation['scopes'] = []
         
-        print(f"DEBUG: Nombre total d'annotations chargées: {len(items)}")
-        return items
-    
+        # Si scopes est vide MAIS qu'il y a un champ scope (ancien format), migrer
+        if not annotation['scopes'] and 'scope' in annotation and annotation['scope']:
+            # On suppose scope = string, on crée un dictionnaire
+            annotation['scopes'].append({'scope': annotation['scope'], 'positions': None})
+
+        text = annotation.get('text', '')
+        # Calculer les positions pour chaque scope si elles n'existent pas
+        print(f"DEBUG load_annotations: Traitement annotation ID {annotation.get('id', 'N/A')}")
+        print(f"DEBUG load_annotations: Nombre de scopes = {len(annotation['scopes'])}")
+        
+        for i, scope in enumerate(annotation['scopes']):
+            scope_text = scope.get('scope', '')
+            existing_positions = scope.get('positions')
+            print(f"DEBUG load_annotations: Scope {i+1}: '{scope_text}'")
+            print(f"DEBUG load_annotations: Positions existantes: {existing_positions}")
+            
+            if not scope.get('positions') or not isinstance(scope['positions'], list) or len(scope['positions']) == 0:
+                print(f"DEBUG load_annotations: Calcul nécessaire pour scope '{scope_text}'")
+                pos_list = self._find_scope_position(text, scope_text)
+                if pos_list:
+                    scope['positions'] = pos_list
+                    print(f"DEBUG load_annotations: ✅ Positions multiples calculées et assignées: {scope['positions']}")
+                else:
+                    print(f"DEBUG load_annotations: ❌ Impossible de calculer les positions")
+            else:
+                print(f"DEBUG load_annotations: Positions déjà présentes, pas de calcul")
+        
+        print("DEBUG load_annotations: " + "="*50)
+        return annotation
+
     def validate_annotation(self, annotation: Dict[str, Any]) -> bool:
-        """Valide la structure d'une annotation"""
-        required_fields = ['id', 'text', 'cues']
-        return all(field in annotation for field in required_fields)
+        """Valide une annotation (champs, positions, chevauchements ; voir api.validation)"""
+        return validate_batch([annotation])[0]['valid']
     
     def get_annotation_stats(self, annotations: List[Dict[str, Any]]) -> Dict[str, int]:
         """Statistiques sur les annotations"""
         total_cues = sum(len(ann.get('cues', [])) for ann in annotations)
         total_scopes = sum(len(ann.get('scopes', [])) for ann in annotations)
-        
+        return self.stats_from_totals(len(annotations), total_cues, total_scopes)
+
+    @staticmethod
+    def stats_from_totals(total_documents: int, total_cues: int, total_scopes: int) -> Dict[str, Any]:
+        """Statistiques à partir de totaux (calculés en streaming par l'index)"""
         return {
-            'total_documents': len(annotations),
+            'total_documents': total_documents,
             'total_cues': total_cues,
             'total_scopes': total_scopes,
-            'avg_cues_per_doc': total_cues / len(annotations) if annotations else 0,
-            'avg_scopes_per_doc': total_scopes / len(annotations) if annotations else 0
+            'avg_cues_per_doc': total_cues / total_documents if total_documents else 0,
+            'avg_scopes_per_doc': total_scopes / total_documents if total_documents else 0
         }
 
     def _normalize(self, s: str) -> str:
@@ -0,0 +1,280 @@
+"""
+Backends de stockage des annotations validées
+- JsonlBackend : fichier JSONL en ajout seul (comportement historique)
+- SqliteBackend : base SQLite embarquée (WAL), indexée par id de document et
+  validated_at, avec upsert et une transaction par lot écrit
+"""
+import argparse
+import json
+import os
+import sqlite3
+import threading
+from typing import List, Dict, Any, Optional, Iterator, Iterable
+
+from prompts.compressed_io import CODECS, codec_from_name, compress_bytes, open_text, wrap_reader
+
+
+class JsonlBackend:
+    """Stockage historique : une ligne JSON par validation, en ajout seul
+
+    Avec une extension compressée (`.jsonl.gz`, `.jsonl.zst`...), chaque lot est
+    ajouté comme une trame complète : le fichier reste lisible d'un seul tenant.
+    """
+    name = 'jsonl'
+    extension = '.jsonl'
+
+    def __init__(self, path: str, compress_level: Optional[int] = None):
+        self.path = path
+        self.codec = codec_from_name(path)
+        self.compress_level = compress_level
+        self._count_cache = None  # (taille, mtime_ns, nombre de lignes)
+
+    def write(self, records: List[Dict[str, Any]], sync: bool = False) -> None:
+        """Ajouter des enregistrements (déjà ordonnés) en fin de fichier"""
+        payload = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+        if self.codec:
+            data = compress_bytes(payload.encode('utf-8'), self.codec, self.compress_level)
+            with open(self.path, 'ab') as f:
+                f.write(data)
+                if sync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            return
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(payload)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+
+    def iter_records(self) -> Iterator[Dict[str, Any]]:
+        """Parcourir les enregistrements dans l'ordre d'écriture"""
+        if not os.path.exists(self.path):
+            return
+        with open_text(self.path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+    def count(self) -> int:
+        """Nombre de lignes non vides (doublons compris), recompté sur la seule partie ajoutée"""
+        if not os.path.exists(self.path):
+            return 0
+        st = os.stat(self.path)
+        cached = self._count_cache
+        if cached and cached[0] == st.st_size and cached[1] == st.st_mtime_ns:
+            return cached[2]
+        offset, total = 0, 0
+        if cached and cached[0] < st.st_size:
+            offset, total = cached[0], cached[2]  # Fichier en ajout seul : compter la fin
+        with open(self.path, 'rb') as f:
+            f.seek(offset)  # Fichier compressé : `offset` est une frontière de trame
+            stream = wrap_reader(f, self.codec) if self.codec else f
+            total += sum(1 for line in stream if line.strip())
+        self._count_cache = (st.st_size, st.st_mtime_ns, total)
+        return total
+
+    def get_latest(self, doc_id: Any) -> Optional[Dict[str, Any]]:
+        """Dernière version validée d'un document (parcours complet)"""
+        latest = None
+        for record in self.iter_records():
+            if record.get('id') == doc_id:
+                latest = record
+        return latest
+
+    def export_jsonl(self, output_path: str, compress_level: Optional[int] = None) -> int:
+        """Exporter le contenu au format JSONL (compressé selon l'extension de sortie)"""
+        count = 0
+        with open_text(output_path, 'w', level=compress_level) as out:
+            for record in self.iter_records():
+                out.write(json.dumps(record, ensure_ascii=False) + '\n')
+                count += 1
+        return count
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def close(self) -> None:
+        pass
+
+
+class SqliteBackend:
+    """Stockage indexé : une ligne par document, dernière validation gagnante"""
+    name = 'sqlite'
+    extension = '.sqlite3'
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS annotations (
+            doc_key TEXT PRIMARY KEY,
+            validated_at TEXT NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_annotations_validated_at
+            ON annotations (validated_at);
+    """
+
+    UPSERT = """
+        INSERT INTO annotations (doc_key, validated_at, data) VALUES (?, ?, ?)
+        ON CONFLICT(doc_key) DO UPDATE SET
+            validated_at = excluded.validated_at,
+            data = excluded.data
+    """
+
+    def __init__(self, path: str, batch_size: int = 1000):
+        self.path = path
+        self.batch_size = batch_size
+        self._local = threading.local()  # Une connexion par thread (WAL = lecteurs concurrents)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=FULL')  # Un commit = un lot durable
+            conn.executescript(self.SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _doc_key(doc_id: Any) -> str:
+        # json.dumps distingue 1 et "1"
+        return json.dumps(doc_id, ensure_ascii=False)
+
+    def write(self, records: List[Dict[str, Any]], sync: bool = False) -> None:
+        """Upsert des enregistrements en une seule transaction (tout le lot ou rien)"""
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            for i in range(0, len(records), self.batch_size):
+                rows = [
+                    (self._doc_key(r.get('id')), r.get('validated_at', ''), json.dumps(r, ensure_ascii=False))
+                    for r in records[i:i + self.batch_size]
+                ]
+                conn.executemany(self.UPSERT, rows)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def iter_records(self) -> Iterator[Dict[str, Any]]:
+        """Parcourir les enregistrements par ordre de validation (index validated_at)"""
+        if not os.path.exists(self.path):
+            return
+        cursor = self._connect().execute('SELECT data FROM annotations ORDER BY validated_at, rowid')
+        while True:
+            rows = cursor.fetchmany(self.batch_size)
+            if not rows:
+                break
+            for (data,) in rows:
+                yield json.loads(data)
+
+    def count(self) -> int:
+        """Nombre de documents distincts validés"""
+        if not os.path.exists(self.path):
+            return 0
+        return self._connect().execute('SELECT COUNT(*) FROM annotations').fetchone()[0]
+
+    def get_latest(self, doc_id: Any) -> Optional[Dict[str, Any]]:
+        """Dernière version validée d'un document (lookup par clé primaire)"""
+        if not os.path.exists(self.path):
+            return None
+        row = self._connect().execute(
+            'SELECT data FROM annotations WHERE doc_key = ?', (self._doc_key(doc_id),)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def export_jsonl(self, output_path: str, compress_level: Optional[int] = None) -> int:
+        """Export JSONL en streaming ; l'ordre des champs est celui de l'écriture"""
+        count = 0
+        if not os.path.exists(self.path):
+            open_text(output_path, 'w', level=compress_level).close()
+            return count
+        cursor = self._connect().execute('SELECT data FROM annotations ORDER BY validated_at, rowid')
+        with open_text(output_path, 'w', level=compress_level) as out:
+            while True:
+                rows = cursor.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                for (data,) in rows:
+                    out.write(data + '\n')
+                count += len(rows)
+        return count
+
+    def import_records(self, records: Iterable[Dict[str, Any]]) -> int:
+        """Importer un flux d'enregistrements (ex. ancien fichier JSONL) par lots"""
+        count = 0
+        batch = []
+        for record in records:
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                self.write(batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            self.write(batch)
+            count += len(batch)
+        return count
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    def close(self) -> None:
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+BACKENDS = {
+    JsonlBackend.name: JsonlBackend,
+    SqliteBackend.name: SqliteBackend,
+}
+
+
+def make_backend(name: str, validated_dir: str, basename: str = 'annotations_validated',
+                 compression: Optional[str] = None, compress_level: Optional[int] = None):
+    """Construire un backend à partir de son nom ('jsonl' ou 'sqlite')"""
+    if name not in BACKENDS:
+        raise ValueError(f"Backend de stockage inconnu: {name} (attendu: {', '.join(BACKENDS)})")
+    cls = BACKENDS[name]
+    path = os.path.join(validated_dir, basename + cls.extension)
+    if not compression:
+        return cls(path)
+    if cls is not JsonlBackend:
+        raise ValueError("La compression n'est disponible que pour le backend jsonl")
+    if compression not in CODECS:
+        raise ValueError(f"Codec inconnu: {compression} (attendu: {', '.join(CODECS)})")
+    return JsonlBackend(path + CODECS[compression][0], compress_level)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Migration et export des annotations validées")
+    sub = ap.add_subparsers(dest='command', required=True)
+
+    p_import = sub.add_parser('import', help="Importer un JSONL dans la base SQLite (upsert)")
+    p_import.add_argument('--jsonl', required=True, help="Fichier JSONL source")
+    p_import.add_argument('--db', required=True, help="Base SQLite cible")
+
+    p_export = sub.add_parser('export', help="Exporter la base SQLite en JSONL")
+    p_export.add_argument('--db', required=True, help="Base SQLite source")
+    p_export.add_argument('--output', required=True, help="Fichier JSONL de sortie (.jsonl.gz, .jsonl.zst... pour compresser)")
+    p_export.add_argument('--level', type=int, help="Niveau de compression de la sortie")
+
+    args = ap.parse_args()
+    if args.command == 'import':
+        count = SqliteBackend(args.db).import_records(JsonlBackend(args.jsonl).iter_records())
+        print(f"{count} enregistrement(s) importé(s) dans {args.db}")
+    else:
+        count = SqliteBackend(args.db).export_jsonl(args.output, args.level)
+        print(f"{count} enregistrement(s) exporté(s) vers {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+"""
+Sauvegardes incrémentales par journal
+- snapshot_<horodatage>.jsonl : état complet (base) à un instant donné
+- journal_<horodatage>.jsonl  : segments en ajout seul, uniquement les
+  enregistrements écrits depuis la dernière base
+La compaction fusionne base + journaux en une nouvelle base, la rétention
+supprime les bases (et leurs journaux) les plus anciennes, et la restauration
+reconstruit l'état à n'importe quel instant couvert par les bases conservées.
+"""
+import argparse
+import json
+import os
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Iterator, Iterable, Tuple
+
+SNAPSHOT_PREFIX = 'snapshot_'
+JOURNAL_PREFIX = 'journal_'
+STAMP_FORMAT = '%Y%m%d_%H%M%S_%f'
+
+
+def _stamp(moment: Optional[datetime] = None) -> str:
+    return (moment or datetime.now()).strftime(STAMP_FORMAT)
+
+
+def _parse_stamp(filename: str) -> Optional[datetime]:
+    stem = os.path.splitext(filename)[0]
+    for prefix in (SNAPSHOT_PREFIX, JOURNAL_PREFIX):
+        if stem.startswith(prefix):
+            try:
+                return datetime.strptime(stem[len(prefix):], STAMP_FORMAT)
+            except ValueError:
+                return None
+    return None
+
+
+def _iter_jsonl(path: str) -> Iterator[Dict[str, Any]]:
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def _count_lines(path: str) -> int:
+    with open(path, 'r', encoding='utf-8') as f:
+        return sum(1 for line in f if line.strip())
+
+
+class JournalBackup:
+    def __init__(self, backup_dir: str, segment_max_records: int = 10000,
+                 compact_after_records: int = 100000, keep_snapshots: int = 3):
+        self.backup_dir = backup_dir
+        self.segment_max_records = segment_max_records      # Rotation d'un segment de journal
+        self.compact_after_records = compact_after_records  # Compaction en nouvelle base
+        self.keep_snapshots = keep_snapshots                # Rétention : nombre de bases conservées
+        self._base = None  # Dernière base connue : le segment courant lui est postérieur
+        self._segment_path = None
+        self._segment_records = 0
+        self._records_since_base = None
+
+    # ------------------------------------------------------------------
+    # Inventaire
+    # ------------------------------------------------------------------
+    def _list(self, prefix: str) -> List[str]:
+        if not os.path.exists(self.backup_dir):
+            return []
+        names = [f for f in os.listdir(self.backup_dir)
+                 if f.startswith(prefix) and f.endswith('.jsonl') and _parse_stamp(f)]
+        names.sort()  # Horodatage triable lexicographiquement
+        return names
+
+    def snapshots(self) -> List[str]:
+        return self._list(SNAPSHOT_PREFIX)
+
+    def journals(self, after: Optional[str] = None) -> List[str]:
+        """Segments de journal, éventuellement postérieurs à une base donnée"""
+        names = self._list(JOURNAL_PREFIX)
+        if after:
+            after_stamp = after[len(SNAPSHOT_PREFIX):]
+            names = [n for n in names if n[len(JOURNAL_PREFIX):] > after_stamp]
+        return names
+
+    def has_base(self) -> bool:
+        return bool(self.snapshots())
+
+    def _load_state(self) -> None:
+        """Retrouver le segment courant et le volume écrit depuis la dernière base"""
+        snapshots = self.snapshots()
+        base = snapshots[-1] if snapshots else None
+        journals = self.journals(after=base)
+        self._base = base
+        self._records_since_base = sum(_count_lines(os.path.join(self.backup_dir, j)) for j in journals)
+        if journals:
+            self._segment_path = os.path.join(self.backup_dir, journals[-1])
+            self._segment_records = _count_lines(self._segment_path)
+        else:
+            self._segment_path = None
+            self._segment_records = 0
+
+    def _refresh(self) -> None:
+        """Recharger l'état si un autre processus a créé une base ou un segment
+
+        Après une base créée ailleurs, le segment courant lui est antérieur : les
+        enregistrements ajoutés ne seraient plus relus (journals(after=base)). Le
+        rechargement ne garde qu'un segment postérieur à la nouvelle base, sinon
+        le prochain ajout ouvre un nouveau segment.
+        """
+        if self._records_since_base is None:
+            self._load_state()
+            return
+        snapshots = self.snapshots()
+        latest_base = snapshots[-1] if snapshots else None
+        journals = self.journals()
+        latest_journal = os.path.join(self.backup_dir, journals[-1]) if journals else None
+        if latest_base != self._base or latest_journal != self._segment_path:
+            self._load_state()
+
+    # ------------------------------------------------------------------
+    # Écriture
+    # ------------------------------------------------------------------
+    def create_base(self, records: Iterable[Dict[str, Any]]) -> str:
+        """Écrire une nouvelle base complète (écriture atomique)"""
+        os.makedirs(self.backup_dir, exist_ok=True)
+        path = os.path.join(self.backup_dir, f'{SNAPSHOT_PREFIX}{_stamp()}.jsonl')
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as out:
+            for record in records:
+                out.write(json.dumps(record, ensure_ascii=False) + '\n')
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp_path, path)
+        # Les nouveaux enregistrements iront dans un nouveau segment
+        self._base = os.path.basename(path)
+        self._segment_path = None
+        self._segment_records = 0
+        self._records_since_base = 0
+        return path
+
+    def append(self, records: List[Dict[str, Any]]) -> Optional[str]:
+        """Journaliser les enregistrements qui viennent d'être écrits"""
+        if not records:
+            return None
+        self._refresh()
+        os.makedirs(self.backup_dir, exist_ok=True)
+        if self._segment_path is None or self._segment_records >= self.segment_max_records:
+            self._segment_path = os.path.join(self.backup_dir, f'{JOURNAL_PREFIX}{_stamp()}.jsonl')
+            self._segment_records = 0
+        with open(self._segment_path, 'a', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._segment_records += len(records)
+        self._records_since_base += len(records)
+        return self._segment_path
+
+    def needs_compaction(self) -> bool:
+        self._refresh()  # Compaction faite par un autre processus : compteur remis à zéro
+        return self._records_since_base >= self.compact_after_records
+
+    def _merged_records(self) -> Iterator[Dict[str, Any]]:
+        """Base courante suivie de ses journaux, dans l'ordre d'écriture"""
+        snapshots = self.snapshots()
+        base = snapshots[-1] if snapshots else None
+        if base:
+            yield from _iter_jsonl(os.path.join(self.backup_dir, base))
+        for journal in self.journals(after=base):
+            yield from _iter_jsonl(os.path.join(self.backup_dir, journal))
+
+    def compact(self, source: Optional[Iterable[Dict[str, Any]]] = None) -> str:
+        """Fusionner base + journaux (ou une source fournie) en une nouvelle base"""
+        records = source if source is not None else self._merged_records()
+        path = self.create_base(records)
+        self.apply_retention()
+        return path
+
+    def apply_retention(self) -> List[str]:
+        """Supprimer les bases excédentaires et les journaux qu'elles couvraient"""
+        snapshots = self.snapshots()
+        if len(snapshots) <= self.keep_snapshots:
+            return []
+        oldest_kept = snapshots[-self.keep_snapshots]
+        oldest_stamp = oldest_kept[len(SNAPSHOT_PREFIX):]
+        removed = snapshots[:-self.keep_snapshots]
+        removed += [j for j in self.journals() if j[len(JOURNAL_PREFIX):] < oldest_stamp]
+        for name in removed:
+            try:
+                os.remove(os.path.join(self.backup_dir, name))
+            except OSError as e:
+                print(f"Erreur suppression backup {name}: {e}")
+        return removed
+
+    # ------------------------------------------------------------------
+    # Restauration
+    # ------------------------------------------------------------------
+    def iter_state_at(self, at: Optional[datetime] = None) -> Iterator[Dict[str, Any]]:
+        """Rejouer la base la plus récente antérieure à `at` puis ses journaux"""
+        at = at or datetime.now()
+        snapshots = [s for s in self.snapshots() if _parse_stamp(s) <= at]
+        if not snapshots:
+            raise ValueError(f"Aucune base antérieure à {at.isoformat()}")
+        base = snapshots[-1]
+        yield from _iter_jsonl(os.path.join(self.backup_dir, base))
+        limit = at.isoformat()
+        for journal in self.journals(after=base):
+            if _parse_stamp(journal) > at:
+                break
+            for record in _iter_jsonl(os.path.join(self.backup_dir, journal)):
+                # Plusieurs processus peuvent entrelacer leurs lots : filtrer sans s'arrêter
+                if record.get('validated_at', '') <= limit:
+                    yield record
+
+    def restore(self, output_path: str, at: Optional[datetime] = None) -> int:
+        """Reconstruire l'état à l'instant `at` dans un fichier JSONL"""
+        count = 0
+        tmp_path = output_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as out:
+            for record in self.iter_state_at(at):
+                out.write(json.dumps(record, ensure_ascii=False) + '\n')
+                count += 1
+        os.replace(tmp_path, output_path)
+        return count
+
+    def describe(self) -> List[Tuple[str, int]]:
+        """(nom, nombre d'enregistrements) de chaque base et segment"""
+        names = sorted(self.snapshots() + self.journals(), key=lambda n: (_parse_stamp(n), n))
+        return [(n, _count_lines(os.path.join(self.backup_dir, n))) for n in names]
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Sauvegardes incrémentales des annotations validées")
+    ap.add_argument('--backup-dir', default=os.path.join('data', 'validated', 'backups'))
+    sub = ap.add_subparsers(dest='command', required=True)
+
+    sub.add_parser('list', help="Lister les bases et segments de journal")
+    sub.add_parser('compact', help="Fusionner la base courante et ses journaux")
+
+    p_restore = sub.add_parser('restore', help="Reconstruire l'état à un instant donné")
+    p_restore.add_argument('--at', help="Instant ISO (ex. 2025-09-05T19:20:00), défaut : maintenant")
+    p_restore.add_argument('--output', required=True, help="Fichier JSONL de sortie")
+
+    args = ap.parse_args()
+    backup = JournalBackup(args.backup_dir)
+    if args.command == 'list':
+        for name, count in backup.describe():
+            print(f"{name}\t{count}")
+    elif args.command == 'compact':
+        print(f"Nouvelle base: {backup.compact()}")
+    else:
+        at = datetime.fromisoformat(args.at) if args.at else None
+        count = backup.restore(args.output, at)
+        print(f"{count} enregistrement(s) restauré(s) vers {args.output}")
+
+
+if __name__ == '__main__':
+    main()
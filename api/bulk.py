@@ -0,0 +1,139 @@
+"""
+Sauvegarde groupée par différences (/api/save/bulk)
+Le navigateur met en file les documents validés et les envoie par lots, en ne
+transmettant que les champs modifiés par rapport au document chargé :
+    {"batch": "...", "file": "corpus.jsonl",
+     "documents": [{"id": 12, "position": 11, "changes": {"scopes": [...]}}]}
+Chaque document est reconstruit à partir du document source du corpus (retrouvé
+par sa position dans le fichier, puis par id), les champs reçus remplacent les
+siens, et le lot entier est validé d'un coup. Les documents valides sont écrits
+en un seul commit : une transaction SQLite ou un ajout JSONL, un fsync, un
+segment de journal.
+Un lot rejoué (réponse perdue puis nouvel essai du navigateur) est reconnu par
+son identifiant et reçoit la réponse d'origine sans réécriture. La mémoire des
+lots est propre au worker : rejoué sur un autre worker, le lot réécrit les
+mêmes documents, ce qui ne change que validated_at.
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from prompts.metrics import REGISTRY
+
+from .validation import REQUIRED_FIELDS, validate_batch
+
+BULK_MAX_DOCUMENTS = 1000
+PROTECTED_FIELDS = ('id', 'validated_at')  # Jamais modifiables par différence
+
+BULK_DOCUMENTS = REGISTRY.counter('annotator_save_bulk_documents_total',
+                                  'Documents reçus par /api/save/bulk', ['result'])
+
+
+def _rejection(index: int, doc_id: Any, code: str, message: str) -> Dict[str, Any]:
+    return {'index': index, 'id': doc_id, 'valid': False,
+            'errors': [{'code': code, 'message': message}], 'warnings': []}
+
+
+class BulkSaver:
+    def __init__(self, storage, remember: int = 256):
+        self.storage = storage
+        self.remember = remember
+        self._replies: "OrderedDict[str, Tuple[Dict[str, Any], int]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _replay(self, batch_id: Optional[str]) -> Optional[Tuple[Dict[str, Any], int]]:
+        if not batch_id:
+            return None
+        with self._lock:
+            reply = self._replies.get(batch_id)
+            if reply is not None:
+                self._replies.move_to_end(batch_id)
+            return reply
+
+    def _remember(self, batch_id: Optional[str], reply: Tuple[Dict[str, Any], int]) -> None:
+        if not batch_id:
+            return
+        with self._lock:
+            self._replies[batch_id] = reply
+            while len(self._replies) > self.remember:
+                self._replies.popitem(last=False)
+
+    def apply(self, payload: Any, source: Callable[[Any, Optional[int]], Optional[Dict[str, Any]]],
+              strict: bool = False) -> Tuple[Dict[str, Any], int]:
+        """Appliquer un lot de différences ; `source(id, position)` rend le document d'origine
+
+        Retourne (corps de la réponse, code HTTP).
+        """
+        if not isinstance(payload, dict) or not isinstance(payload.get('documents'), list):
+            return {'status': 'error', 'message': 'Champ documents (liste) requis'}, 400
+        entries = payload['documents']
+        if len(entries) > BULK_MAX_DOCUMENTS:
+            return {'status': 'error', 'message': f'Au plus {BULK_MAX_DOCUMENTS} documents par lot'}, 413
+        batch_id = payload.get('batch') if isinstance(payload.get('batch'), str) else None
+        replay = self._replay(batch_id)
+        if replay is not None:
+            BULK_DOCUMENTS.inc(len(entries), labels=('replayed',))
+            print(f"DEBUG: lot {batch_id} déjà appliqué, réponse d'origine renvoyée")
+            return replay
+
+        # Reconstruction : document source + champs modifiés
+        rejected: List[Dict[str, Any]] = []
+        merged: List[Dict[str, Any]] = []
+        positions: List[int] = []  # Indice dans le lot de chaque document reconstruit
+        for i, entry in enumerate(entries):
+            doc_id = entry.get('id') if isinstance(entry, dict) else None
+            changes = entry.get('changes', {}) if isinstance(entry, dict) else None
+            if doc_id is None or not isinstance(changes, dict):
+                rejected.append(_rejection(i, doc_id, 'malformed', 'Entrée sans id ou sans objet changes'))
+                continue
+            protected = [field for field in PROTECTED_FIELDS if field in changes]
+            if protected:
+                rejected.append(_rejection(i, doc_id, 'malformed', f"Champ(s) non modifiable(s): {', '.join(protected)}"))
+                continue
+            base = source(doc_id, entry.get('position'))
+            if base is None and not all(field in changes for field in REQUIRED_FIELDS if field != 'id'):
+                rejected.append(_rejection(i, doc_id, 'unknown_document', f'Document {doc_id!r} absent du corpus'))
+                continue
+            document = dict(base or {'id': doc_id})
+            document.update(changes)
+            merged.append(document)
+            positions.append(i)
+
+        # Validation du lot entier (indices ramenés à ceux du lot reçu)
+        valid: List[Dict[str, Any]] = []
+        warnings: List[Dict[str, Any]] = []
+        for document, i, report in zip(merged, positions, validate_batch(merged, strict=strict)):
+            report['index'] = i
+            if report['valid']:
+                valid.append(document)
+                if report['warnings']:
+                    warnings.append(report)
+            else:
+                rejected.append(report)
+        rejected.sort(key=lambda report: report['index'])
+        for report in rejected:
+            print(f"Annotation invalide ignorée: {report['id']} ({report['errors'][0]['message']})")
+
+        if rejected:
+            BULK_DOCUMENTS.inc(len(rejected), labels=('rejected',))
+        if not valid:
+            reply = {'status': 'error', 'message': 'Aucune annotation valide', 'batch': batch_id,
+                     'rejected': rejected}, 400
+            self._remember(batch_id, reply)
+            return reply
+
+        # Un seul commit pour tout le lot ; en cas d'échec rien n'est mémorisé : le navigateur réessaie
+        if not self.storage.save_annotations(valid):
+            return {'status': 'error', 'message': 'Erreur de sauvegarde', 'batch': batch_id}, 500
+        BULK_DOCUMENTS.inc(len(valid), labels=('saved',))
+        reply = {
+            'status': 'success',
+            'batch': batch_id,
+            'saved_count': len(valid),
+            'saved': [document['id'] for document in valid],
+            'total_validated': self.storage.get_validated_count(),
+            'rejected': rejected,
+            'warnings': warnings
+        }, 200
+        self._remember(batch_id, reply)
+        return reply
@@ -0,0 +1,259 @@
+"""
+Index binaire en lecture seule d'un corpus JSONL, partagé par mmap
+Construit une seule fois (verrou inter-processus), puis ouvert par chaque
+worker : le système ne garde qu'une copie en cache de pages, quel que soit le
+nombre de processus.
+
+Format du fichier .idx :
+    MAGIC (8 octets) | longueur de l'en-tête (uint64) | en-tête JSON
+    | offsets (uint64, alignés sur 8, count + 1 valeurs) | tableau JSON
+L'en-tête contient la version du fichier source, les statistiques et les
+bornes des sections. Le tableau JSON `[doc0,doc1,...]` est servi tel quel ;
+offsets[i] pointe sur le début du document i (le document se termine un
+octet avant offsets[i + 1], séparateur ou crochet fermant).
+Un fichier .gz voisin contient le même tableau compressé en gzip.
+"""
+import gzip
+import hashlib
+import json
+import mmap
+import os
+import re
+import shutil
+import struct
+import sys
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from .writer import FileLock
+
+MAGIC = b'AAIDX001'
+_PREFIX = struct.Struct('<8sQ')
+_LEADING_ID = re.compile(rb'\{"id":(-?\d+|"(?:[^"\\]|\\.)*")[,}]')  # Documents normalisés : id en tête
+
+
+def source_version(source: str) -> Dict[str, Any]:
+    st = os.stat(source)
+    return {'source': os.path.abspath(source), 'mtime_ns': st.st_mtime_ns, 'size': st.st_size}
+
+
+def _version_etag(version: Dict[str, Any]) -> str:
+    return hashlib.sha1(json.dumps(version, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def source_etag(source: str) -> str:
+    """ETag d'un corpus : identique qu'il soit servi par l'index ou lu directement"""
+    return _version_etag(source_version(source))
+
+
+def index_path_for(source: str, cache_dir: str) -> str:
+    digest = hashlib.sha1(os.path.abspath(source).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(cache_dir, f'{os.path.basename(source)}.{digest}.idx')
+
+
+class CorpusIndex:
+    """Vue mmap d'un index de corpus (documents normalisés + statistiques)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_len = _PREFIX.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Index invalide: {path}")
+        self.header = json.loads(self._mm[_PREFIX.size:_PREFIX.size + header_len])
+        self.count = self.header['count']
+        start = self.header['offsets_start']
+        self._view = memoryview(self._mm)
+        self._offsets = self._view[start:start + 8 * (self.count + 1)].cast('Q')
+        # Version gzip du tableau, ouverte tout de suite pour rester cohérente avec cet index
+        self._gz_file = self._gz_mm = None
+        if os.path.exists(path + '.gz') and os.path.getsize(path + '.gz'):
+            self._gz_file = open(path + '.gz', 'rb')
+            self._gz_mm = mmap.mmap(self._gz_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._ids: Optional[Dict[Any, int]] = None  # id -> position, construit à la demande
+        self._ids_bytes = 0
+
+    @property
+    def etag(self) -> str:
+        return self.header['etag']
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return dict(self.header['stats'])
+
+    def is_fresh(self, source: str) -> bool:
+        try:
+            version = source_version(source)
+        except OSError:
+            return False
+        return all(self.header['version'].get(k) == v for k, v in version.items())
+
+    def __len__(self) -> int:
+        return self.count
+
+    @property
+    def nbytes(self) -> int:
+        """Octets mappés (index et tableau gzip) : cache de pages partagé entre workers"""
+        return len(self._mm) + (len(self._gz_mm) if self._gz_mm is not None else 0)
+
+    def memory_bytes(self) -> int:
+        """Mémoire propre au processus : en-tête décodé et table des ids (hors pages mappées)"""
+        return sys.getsizeof(self.header) + sys.getsizeof(self.header.get('stats')) + self._ids_bytes
+
+    def raw(self, i: int) -> memoryview:
+        """Octets JSON du document i (sans copie)"""
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        return self._view[self._offsets[i]:self._offsets[i + 1] - 1]
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        if i < 0:
+            i += self.count
+        return json.loads(bytes(self.raw(i)))
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for i in range(self.count):
+            yield self[i]
+
+    def positions_by_id(self) -> Dict[Any, int]:
+        """Position de chaque document par id (premier document en cas de doublon)"""
+        if self._ids is None:
+            ids: Dict[Any, int] = {}
+            for i in range(self.count):
+                raw = self.raw(i)
+                match = _LEADING_ID.match(raw)
+                doc_id = json.loads(match.group(1)) if match else json.loads(bytes(raw)).get('id')
+                ids.setdefault(doc_id, i)
+            self._ids_bytes = sys.getsizeof(ids) + sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in ids.items())
+            self._ids = ids
+        return self._ids
+
+    def find(self, doc_id: Any, position: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """Document d'id `doc_id` ; `position` (indice vu par le client) évite la table des ids"""
+        if isinstance(position, int) and 0 <= position < self.count:
+            doc = self[position]
+            if doc.get('id') == doc_id:
+                return doc
+        i = self.positions_by_id().get(doc_id)
+        return self[i] if i is not None else None
+
+    def json_array(self) -> memoryview:
+        """Tableau JSON complet, prêt à servir"""
+        return self._view[self.header['payload_start']:self.header['payload_end']]
+
+    def gzip_array(self) -> Optional[memoryview]:
+        """Tableau JSON complet compressé en gzip, s'il a été construit"""
+        return memoryview(self._gz_mm) if self._gz_mm is not None else None
+
+    def close(self) -> None:
+        self._offsets.release()
+        self._view.release()
+        self._mm.close()
+        self._file.close()
+        if self._gz_mm is not None:
+            self._gz_mm.close()
+            self._gz_file.close()
+
+
+def build_index(source: str, index_path: str, documents: Iterator[Dict[str, Any]],
+                stats_from_totals: Callable[[int, int, int], Dict[str, Any]]) -> str:
+    """Sérialiser les documents normalisés dans un nouvel index (écriture atomique)"""
+    version = source_version(source)
+    tmp_payload = f'{index_path}.{os.getpid()}.payload'
+    tmp_index = f'{index_path}.{os.getpid()}.tmp'
+    tmp_gzip = f'{index_path}.{os.getpid()}.gz.tmp'
+    offsets = []
+    total_cues = total_scopes = 0
+    try:
+        with open(tmp_payload, 'wb') as payload, open(tmp_gzip, 'wb') as gz_raw:
+            gz = gzip.GzipFile(fileobj=gz_raw, mode='wb', compresslevel=6, mtime=0)
+            position = 0
+
+            def emit(data: bytes) -> None:
+                nonlocal position
+                payload.write(data)
+                gz.write(data)
+                position += len(data)
+
+            emit(b'[')
+            for doc in documents:
+                if offsets:
+                    emit(b',')
+                offsets.append(position)
+                emit(json.dumps(doc, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+                total_cues += len(doc.get('cues', []))
+                total_scopes += len(doc.get('scopes', []))
+            emit(b']')
+            offsets.append(position)  # Fin du dernier document = position du ']' + 1
+            gz.close()
+
+        header = {
+            'version': version,
+            'etag': _version_etag(version),
+            'count': len(offsets) - 1,
+            'stats': stats_from_totals(len(offsets) - 1, total_cues, total_scopes),
+        }
+        # La taille de l'en-tête dépend des bornes qu'il contient : itérer jusqu'à stabilité
+        offsets_start = 0
+        while True:
+            payload_start = offsets_start + 8 * len(offsets)
+            header.update({
+                'offsets_start': offsets_start,
+                'payload_start': payload_start,
+                'payload_end': payload_start + position,
+            })
+            header_bytes = json.dumps(header).encode('utf-8')
+            needed = _PREFIX.size + len(header_bytes)
+            needed += (-needed) % 8
+            if needed <= offsets_start:
+                break
+            offsets_start = needed
+        padding = offsets_start - _PREFIX.size - len(header_bytes)
+
+        with open(tmp_index, 'wb') as out, open(tmp_payload, 'rb') as payload:
+            out.write(_PREFIX.pack(MAGIC, len(header_bytes)))
+            out.write(header_bytes + b' ' * padding)
+            out.write(struct.pack(f'<{len(offsets)}Q', *(payload_start + o for o in offsets)))
+            shutil.copyfileobj(payload, out, 1 << 20)
+        os.replace(tmp_gzip, index_path + '.gz')
+        os.replace(tmp_index, index_path)
+    finally:
+        for path in (tmp_payload, tmp_index, tmp_gzip):
+            if os.path.exists(path):
+                os.remove(path)
+    return index_path
+
+
+def open_index(source: str, cache_dir: str, documents: Callable[[], Iterator[Dict[str, Any]]],
+               stats_from_totals: Callable[[int, int, int], Dict[str, Any]]) -> CorpusIndex:
+    """Ouvrir l'index d'un corpus, en le (re)construisant une seule fois si nécessaire"""
+    os.makedirs(cache_dir, exist_ok=True)
+    path = index_path_for(source, cache_dir)
+    index = _try_open(path, source)
+    if index is not None:
+        return index
+    # Un seul processus construit ; les autres attendent puis ouvrent le résultat
+    with FileLock(path + '.lock'):
+        index = _try_open(path, source)
+        if index is None:
+            build_index(source, path, documents(), stats_from_totals)
+            index = CorpusIndex(path)
+    return index
+
+
+def find_index(source: str, cache_dir: str) -> Optional[CorpusIndex]:
+    """Index à jour du corpus s'il existe déjà, sans jamais le construire"""
+    return _try_open(index_path_for(source, cache_dir), source)
+
+
+def _try_open(path: str, source: str) -> Optional[CorpusIndex]:
+    if not os.path.exists(path):
+        return None
+    try:
+        index = CorpusIndex(path)
+    except (OSError, ValueError, KeyError):
+        return None
+    if index.is_fresh(source):
+        return index
+    index.close()
+    return None
@@ -0,0 +1,136 @@
+"""
+Corpus résidents d'un worker, partagés par toutes les sessions
+Pour chaque fichier : un AnnotationManager (avec son index mmap) et, dès la
+première recherche, son index de recherche. Revenir sur un fichier récemment
+utilisé ne rouvre ni ne réanalyse rien.
+La taille de chaque corpus est mesurée sur les structures propres au worker
+(en-tête et table des ids de l'index, termes et postings de l'index de
+recherche) après chaque ouverture ou recherche ; au-delà du budget, les corpus
+les moins récemment utilisés sont libérés. Les pages mappées de l'index sont
+du cache de pages partagé entre workers : elles ne sont pas imputées au
+budget, seulement signalées dans info(). Leur index reste sur disque : il se rouvre en quelques
+millisecondes, seul l'index de recherche est à reconstruire.
+Un corpus libéré n'est pas fermé explicitement : une réponse en cours qui lit
+encore son mmap le garde en vie jusqu'à la fin.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from .annotations import AnnotationManager
+from .corpus_index import CorpusIndex
+from .search import SearchIndex
+
+
+class _Resident:
+    __slots__ = ('manager', 'search', 'nbytes')
+
+    def __init__(self, manager: AnnotationManager):
+        self.manager = manager
+        self.search: Optional[SearchIndex] = None
+        self.nbytes = 0
+
+
+class CorpusManager:
+    def __init__(self, cache_dir: str, budget_bytes: int):
+        self.cache_dir = cache_dir
+        self.budget_bytes = budget_bytes
+        self._entries: "OrderedDict[str, _Resident]" = OrderedDict()  # Du moins au plus récemment utilisé
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _entry(self, data_file: str) -> _Resident:
+        with self._lock:
+            entry = self._entries.get(data_file)
+            if entry is not None:
+                self._entries.move_to_end(data_file)
+                self.hits += 1
+            else:
+                entry = self._entries[data_file] = _Resident(AnnotationManager(data_file))
+                self.misses += 1
+            return entry
+
+    def manager(self, data_file: str) -> AnnotationManager:
+        """Manager d'un fichier (créé au besoin), marqué comme le plus récemment utilisé"""
+        return self._entry(data_file).manager
+
+    def open_index(self, data_file: str) -> CorpusIndex:
+        """Index mmap du fichier, construit si nécessaire"""
+        entry = self._entry(data_file)
+        index = entry.manager.open_index(self.cache_dir)
+        self._account(data_file, entry)
+        return index
+
+    def cached_index(self, data_file: str) -> Optional[CorpusIndex]:
+        """Index à jour s'il est déjà construit (None sinon : aucune construction ici)"""
+        entry = self._entry(data_file)
+        index = entry.manager.cached_index(self.cache_dir)
+        if index is not None:
+            self._account(data_file, entry)
+        return index
+
+    def search(self, data_file: str, query: str, offset: int = 0, limit: int = 50) -> Dict[str, Any]:
+        """Recherche sur un fichier ; l'index de recherche, mis à jour au passage, est remesuré"""
+        entry = self._entry(data_file)
+        with self._lock:
+            if entry.search is None:
+                entry.search = SearchIndex(data_file)
+            search = entry.search
+        try:
+            return search.search(query, offset, limit)
+        finally:
+            self._account(data_file, entry)
+
+    # ------------------------------------------------------------------
+    # Budget
+    # ------------------------------------------------------------------
+    def account(self, data_file: str) -> None:
+        """Remesurer un corpus résident après une structure construite à la demande (table des ids)"""
+        with self._lock:
+            entry = self._entries.get(data_file)
+        if entry is not None:
+            self._account(data_file, entry)
+
+    @staticmethod
+    def _measure(entry: _Resident) -> int:
+        search = entry.search
+        return entry.manager.memory_bytes() + (search.memory_bytes() if search is not None else 0)
+
+    def _account(self, data_file: str, entry: _Resident) -> None:
+        nbytes = self._measure(entry)  # Hors verrou : peut parcourir un gros index de recherche
+        with self._lock:
+            entry.nbytes = nbytes
+            total = sum(e.nbytes for e in self._entries.values())
+            # Le corpus qui vient d'être utilisé reste résident, même seul au-delà du budget
+            for key in list(self._entries):
+                if total <= self.budget_bytes:
+                    break
+                if key == data_file:
+                    continue
+                evicted = self._entries.pop(key)
+                total -= evicted.nbytes
+                self.evictions += 1
+                print(f"DEBUG: corpus {os.path.basename(key)} libéré ({evicted.nbytes // 1024} Ko, "
+                      f"budget {self.budget_bytes // 1024} Ko)")
+
+    def resident_bytes(self) -> int:
+        with self._lock:
+            return sum(e.nbytes for e in self._entries.values())
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            corpora = [{'file': os.path.basename(key), 'bytes': e.nbytes,
+                        'mapped_bytes': e.manager.mapped_bytes(),
+                        'search_documents': len(e.search) if e.search is not None else None}
+                       for key, e in reversed(self._entries.items())]
+        return {
+            'budget_bytes': self.budget_bytes,
+            'resident_bytes': sum(c['bytes'] for c in corpora),
+            'corpora': corpora,  # Du plus au moins récemment utilisé
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+        }
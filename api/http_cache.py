@@ -0,0 +1,258 @@
+"""
+Réponses JSON conditionnelles et compressées
+- ETag fort dérivé de la version des données (mtime/taille des fichiers sources)
+- 304 Not Modified si If-None-Match correspond
+- Compression gzip/deflate au-delà d'un seuil de taille
+- Corps sérialisés (et compressés) mis en cache par version : une requête sur
+  des données inchangées ne refait ni le chargement ni la sérialisation
+- Réponses en flux (tableau JSON ou NDJSON) construites document par document
+"""
+import gzip
+import hashlib
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from flask import Response, current_app, request
+
+COMPRESSIBLE_ENCODINGS = ('gzip', 'deflate')
+STREAM_CHUNK_SIZE = 64 * 1024  # Taille des blocs des réponses en flux
+
+
+def file_version(*paths: str) -> Tuple:
+    """Version d'un ensemble de fichiers : (chemin, mtime_ns, taille) pour chacun"""
+    version = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            version.append((path, st.st_mtime_ns, st.st_size))
+        except OSError:
+            version.append((path, None, None))
+    return tuple(version)
+
+
+def _accepted_encoding(header: str) -> Optional[str]:
+    """Choisir gzip ou deflate d'après Accept-Encoding (q=0 exclut l'encodage)"""
+    accepted = {}
+    for part in header.split(','):
+        token, _, params = part.strip().partition(';')
+        token = token.strip().lower()
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[token] = q
+    for encoding in COMPRESSIBLE_ENCODINGS:
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+
+def _compress(body: bytes, encoding: str, level: int) -> bytes:
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=level, mtime=0)  # mtime=0 : sortie stable
+    return zlib.compress(body, level)
+
+
+class _CachedBody:
+    __slots__ = ('etag', 'body', 'encoded', 'lock')
+
+    def __init__(self, etag: str, body: bytes):
+        self.etag = etag
+        self.body = body
+        self.encoded: Dict[str, bytes] = {}
+        self.lock = threading.Lock()
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int = 16, min_compress_size: int = 1024, compress_level: int = 6):
+        self.max_entries = max_entries                # Une entrée par (clé, version)
+        self.min_compress_size = min_compress_size    # En dessous : réponse non compressée
+        self.compress_level = compress_level
+        self._entries: "OrderedDict[Tuple[str, Tuple], _CachedBody]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_etag(key: str, version: Tuple) -> str:
+        return hashlib.sha1(f'{key}:{version!r}'.encode('utf-8')).hexdigest()
+
+    def _get(self, key: str, version: Tuple, build: Callable[[], Any]) -> _CachedBody:
+        cache_key = (key, version)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        body = current_app.json.dumps(build()).encode('utf-8')
+        entry = _CachedBody(self.make_etag(key, version), body)
+        with self._lock:
+            # Une seule version par clé : l'ancienne devient inutile
+            for stale in [k for k in self._entries if k[0] == key]:
+                del self._entries[stale]
+            self._entries[cache_key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def _encoded(self, entry: _CachedBody, encoding: str) -> bytes:
+        with entry.lock:
+            data = entry.encoded.get(encoding)
+            if data is None:
+                data = _compress(entry.body, encoding, self.compress_level)
+                entry.encoded[encoding] = data
+            return data
+
+    def json_response(self, key: str, version: Tuple, build: Callable[[], Any]) -> Response:
+        """Réponse JSON avec ETag, 304 et compression pour la version donnée"""
+        etag = self.make_etag(key, version)
+        if _etag_matches(request.headers.get('If-None-Match', ''), etag):
+            response = Response(status=304)
+            response.headers['ETag'] = f'"{etag}"'
+            response.headers['Vary'] = 'Accept-Encoding'
+            return response
+
+        entry = self._get(key, version, build)
+        body = entry.body
+        encoding = None
+        if len(body) >= self.min_compress_size:
+            encoding = _accepted_encoding(request.headers.get('Accept-Encoding', ''))
+
+        if encoding:
+            body = self._encoded(entry, encoding)
+            response_etag = f'"{entry.etag}-{encoding}"'  # ETag fort : distinct par encodage
+        else:
+            response_etag = f'"{entry.etag}"'
+
+        response = Response(body, mimetype='application/json')
+        response.headers['ETag'] = response_etag
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['Cache-Control'] = 'no-cache'  # Toujours revalider via If-None-Match
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        return response
+
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+def buffer_response(etag: str, raw: memoryview, gzipped: Optional[memoryview] = None,
+                    chunk_size: int = STREAM_CHUNK_SIZE) -> Response:
+    """Servir un corpus JSON déjà sérialisé (ex. index mmap) avec ETag, 304 et gzip précalculé"""
+    if _etag_matches(request.headers.get('If-None-Match', ''), etag):
+        response = Response(status=304)
+        response.headers['ETag'] = f'"{etag}"'
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
+    body, encoding = raw, None
+    if gzipped is not None and len(raw) >= 1024 and \
+            _accepted_encoding(request.headers.get('Accept-Encoding', '')) == 'gzip':
+        body, encoding = gzipped, 'gzip'
+
+    def generate():
+        # Découper la vue mmap : aucune copie complète du corpus en mémoire
+        for start in range(0, len(body), chunk_size):
+            yield bytes(body[start:start + chunk_size])
+
+    response = Response(generate(), mimetype='application/json')
+    response.headers['Content-Length'] = str(len(body))
+    response.headers['ETag'] = f'"{etag}-{encoding}"' if encoding else f'"{etag}"'
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'no-cache'
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def json_array_chunks(items: Iterable[bytes], chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """Tableau JSON `[a,b,...]` à partir de documents déjà sérialisés, par blocs"""
+    first = True
+    buffer = bytearray(b'[')
+    for item in items:
+        if not first:
+            buffer += b','
+        buffer += item
+        if first or len(buffer) >= chunk_size:  # Premier document envoyé sans attendre
+            yield bytes(buffer)
+            buffer.clear()
+        first = False
+    buffer += b']'
+    yield bytes(buffer)
+
+
+def ndjson_chunks(items: Iterable[bytes], chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+    """Un document JSON par ligne (les documents sérialisés ne contiennent pas de saut de ligne)"""
+    first = True
+    buffer = bytearray()
+    for item in items:
+        buffer += item
+        buffer += b'\n'
+        if first or len(buffer) >= chunk_size:
+            yield bytes(buffer)
+            buffer.clear()
+        first = False
+    if buffer:
+        yield bytes(buffer)
+
+
+def stream_response(etag: str, chunks: Iterator[bytes], mimetype: str = 'application/json',
+                    compress_level: int = 6) -> Response:
+    """Réponse en flux (chunked) avec ETag et 304 ; gzip à la volée, vidé à chaque bloc"""
+    if _etag_matches(request.headers.get('If-None-Match', ''), etag):
+        response = Response(status=304)
+        response.headers['ETag'] = f'"{etag}"'
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
+    encoding = _accepted_encoding(request.headers.get('Accept-Encoding', ''))
+    body = chunks
+    if encoding:
+        def compressed():
+            # wbits : 31 → en-tête gzip, 15 → zlib (deflate) ; Z_SYNC_FLUSH pour que le client
+            # puisse décoder chaque bloc dès sa réception
+            compressor = zlib.compressobj(compress_level, zlib.DEFLATED, 31 if encoding == 'gzip' else 15)
+            for chunk in chunks:
+                data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+                if data:
+                    yield data
+            yield compressor.flush()
+        body = compressed()
+
+    response = Response(body, mimetype=mimetype)
+    response.headers['ETag'] = f'"{etag}-{encoding}"' if encoding else f'"{etag}"'
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = 'no-cache'
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        candidate = candidate.strip('"')
+        # Accepter les variantes compressées du même corps
+        for encoding in COMPRESSIBLE_ENCODINGS:
+            suffix = f'-{encoding}'
+            if candidate.endswith(suffix):
+                candidate = candidate[:-len(suffix)]
+                break
+        if candidate == etag:
+            return True
+    return False
@@ -0,0 +1,269 @@
+"""
+Travaux d'annotation en masse en arrière-plan
+Un corpus téléversé (texte 1 phrase/ligne ou JSONL avec un champ `text`,
+éventuellement compressé) est copié dans data/jobs/<id>/ puis annoté par lots
+par un pool borné de threads. L'état de chaque travail est persisté dans
+data/jobs/<id>/job.json (progression, débit, ETA) : n'importe quel worker peut
+le lire, l'annuler (fichier `cancel`) ou servir le résultat. Le résultat
+terminé est publié dans data/ et apparaît donc dans /api/files.
+Au démarrage d'un processus, les travaux en attente ou en cours dont le
+processus propriétaire a disparu sont relancés depuis le début.
+"""
+import json
+import os
+import re
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, IO, Iterator, List, Optional, Tuple
+
+from api.writer import FileLock
+from prompts.compressed_io import open_text
+from prompts.types import cues_to_dicts
+from prompts.detector import annotate_threaded
+
+ACTIVE_STATES = ('queued', 'running')
+FINAL_STATES = ('done', 'failed', 'cancelled')
+_SAFE_NAME_RE = re.compile(r'[^\w.-]+')
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+
+class JobManager:
+    def __init__(self, jobs_dir: str, output_dir: str, rulebase, max_workers: int = 1, chunk_size: int = 500):
+        self.jobs_dir = jobs_dir
+        self.output_dir = output_dir
+        self.rulebase = rulebase
+        self.max_workers = max(1, max_workers)
+        self.chunk_size = max(1, chunk_size)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+        self._start_lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    # État persistant
+    # ------------------------------------------------------------------
+    def _dir(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, job_id)
+
+    def _valid_id(self, job_id: str) -> bool:
+        return bool(job_id) and os.path.basename(job_id) == job_id and os.path.isfile(
+            os.path.join(self._dir(job_id), 'job.json'))
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        if not self._valid_id(job_id):
+            return None
+        try:
+            with open(os.path.join(self._dir(job_id), 'job.json'), encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, job: Dict[str, Any]) -> None:
+        path = os.path.join(self._dir(job['id']), 'job.json')
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(job, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, path)  # Les lecteurs voient l'ancien ou le nouvel état, jamais un fichier partiel
+
+    def list(self) -> List[Dict[str, Any]]:
+        try:
+            names = os.listdir(self.jobs_dir)
+        except OSError:
+            return []
+        jobs = [job for job in (self.get(name) for name in names) if job]
+        return sorted(jobs, key=lambda j: j['created_at'], reverse=True)
+
+    # ------------------------------------------------------------------
+    # Pool de travail (un par processus, créé à la première utilisation)
+    # ------------------------------------------------------------------
+    def _pool(self) -> ThreadPoolExecutor:
+        with self._start_lock:
+            if self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='annotation-job')
+                self._executor_pid = os.getpid()
+                self._resume_orphans()
+            return self._executor
+
+    def start(self) -> None:
+        """Démarrer le pool de ce processus (et reprendre les travaux orphelins)"""
+        self._pool()
+
+    def _resume_orphans(self) -> None:
+        """Relancer les travaux actifs dont le processus propriétaire n'existe plus"""
+        for job in self.list():
+            if job['state'] not in ACTIVE_STATES:
+                continue
+            with FileLock(os.path.join(self._dir(job['id']), 'job.lock')):
+                job = self.get(job['id'])
+                if job is None or job['state'] not in ACTIVE_STATES or _pid_alive(job.get('pid')):
+                    continue
+                print(f"DEBUG: reprise du travail {job['id']} (processus {job.get('pid')} disparu)")
+                job.update(state='queued', processed=0, pid=os.getpid(), resumed=job.get('resumed', 0) + 1)
+                self._write(job)
+            self._executor.submit(self._run, job['id'])
+
+    # ------------------------------------------------------------------
+    # Création / annulation
+    # ------------------------------------------------------------------
+    def submit(self, filename: str, upload: IO[bytes]) -> Dict[str, Any]:
+        """Enregistrer le fichier téléversé (copie par blocs) et mettre le travail en file"""
+        pool = self._pool()
+        job_id = time.strftime('%Y%m%d%H%M%S') + '-' + secrets.token_hex(4)
+        job_dir = self._dir(job_id)
+        os.makedirs(job_dir)
+        name = _SAFE_NAME_RE.sub('_', os.path.basename(filename or 'corpus.txt')) or 'corpus.txt'
+        input_path = os.path.join(job_dir, 'input-' + name)
+        with open(input_path, 'wb') as f:
+            while True:
+                block = upload.read(1 << 20)
+                if not block:
+                    break
+                f.write(block)
+        job = {
+            'id': job_id,
+            'state': 'queued',
+            'filename': name,
+            'input': input_path,
+            'size': os.path.getsize(input_path),
+            'total': None,
+            'processed': 0,
+            'cues': 0,
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'output': None,
+            'error': None,
+            'pid': os.getpid(),
+        }
+        self._write(job)
+        pool.submit(self._run, job_id)
+        return self.status(job)
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Demander l'annulation (prise en compte entre deux lots, quel que soit le worker)"""
+        job = self.get(job_id)
+        if job is None:
+            return None
+        if job['state'] in ACTIVE_STATES:
+            open(os.path.join(self._dir(job_id), 'cancel'), 'w').close()
+            job['cancel_requested'] = True
+        return self.status(job)
+
+    def _cancel_requested(self, job_id: str) -> bool:
+        return os.path.exists(os.path.join(self._dir(job_id), 'cancel'))
+
+    # ------------------------------------------------------------------
+    # Exécution
+    # ------------------------------------------------------------------
+    def _read_sentences(self, path: str) -> Iterator[Tuple[Any, str]]:
+        """(id, texte) : lignes de texte (id = numéro de ligne) ou objets JSONL avec `text`"""
+        with open_text(path) as f:
+            is_jsonl = None
+            for lineno, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                if is_jsonl is None:
+                    is_jsonl = line.startswith('{')
+                if not is_jsonl:
+                    yield lineno, line
+                    continue
+                record = json.loads(line)
+                text = record.get('text')
+                if isinstance(text, str) and text.strip():
+                    yield record.get('id', lineno), text
+
+    def _count(self, path: str) -> int:
+        return sum(1 for _ in self._read_sentences(path))
+
+    def _run(self, job_id: str) -> None:
+        job = self.get(job_id)
+        if job is None or job['state'] not in ACTIVE_STATES:
+            return
+        job_dir = self._dir(job_id)
+        part_path = os.path.join(job_dir, 'output.jsonl.part')
+        try:
+            if self._cancel_requested(job_id):
+                raise JobCancelled()
+            job.update(state='running', started_at=time.time(), processed=0, cues=0, pid=os.getpid())
+            self._write(job)
+            job['total'] = self._count(job['input'])
+            snapshot = self.rulebase.snapshot()  # Mêmes règles pour tout le travail
+            job['rules_version'] = snapshot.version
+            self._write(job)
+
+            batch: List[Tuple[Any, str]] = []
+            with open(part_path, 'w', encoding='utf-8') as out:
+                for item in self._read_sentences(job['input']):
+                    batch.append(item)
+                    if len(batch) >= self.chunk_size:
+                        self._process_chunk(job, batch, snapshot, out)
+                        batch = []
+                if batch:
+                    self._process_chunk(job, batch, snapshot, out)
+
+            output_name = f"{os.path.splitext(job['filename'])[0].split('.')[0]}_annotated_{job_id}.jsonl"
+            output_path = os.path.join(self.output_dir, output_name)
+            os.replace(part_path, output_path)  # Publié dans data/ une fois complet
+            job.update(state='done', output=output_path, finished_at=time.time())
+        except JobCancelled:
+            job.update(state='cancelled', finished_at=time.time())
+        except Exception as e:
+            print(f"Erreur travail {job_id}: {e}")
+            job.update(state='failed', error=f"{type(e).__name__}: {e}", finished_at=time.time())
+        finally:
+            if job['state'] != 'done' and os.path.exists(part_path):
+                os.remove(part_path)
+            self._write(job)
+
+    def _process_chunk(self, job: Dict[str, Any], batch: List[Tuple[Any, str]], snapshot, out) -> None:
+        if self._cancel_requested(job['id']):
+            raise JobCancelled()
+        results = annotate_threaded([text for _, text in batch], 1, snapshot.markers_by_group,
+                                    self.rulebase.detect_threads)
+        for (doc_id, text), obj in zip(batch, results):
+            record = {'id': doc_id, 'text': text, 'cues': cues_to_dicts(obj['cues'])}
+            if obj.get('rule_timeouts'):
+                record['rule_timeouts'] = obj['rule_timeouts']
+            job['cues'] += len(record['cues'])
+            out.write(json.dumps(record, ensure_ascii=False) + '\n')
+        out.flush()
+        job['processed'] += len(batch)
+        job['updated_at'] = time.time()
+        self._write(job)
+
+    # ------------------------------------------------------------------
+    # Vue API
+    # ------------------------------------------------------------------
+    def status(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """État enrichi : progression, débit (phrases/s) et ETA calculés à la lecture"""
+        view = {k: v for k, v in job.items() if k not in ('input', 'pid')}
+        total, processed = job.get('total'), job.get('processed', 0)
+        view['progress'] = round(processed / total, 4) if total else (1.0 if job['state'] == 'done' else 0.0)
+        started = job.get('started_at')
+        end = job.get('finished_at') or time.time()
+        elapsed = end - started if started else 0.0
+        view['elapsed_s'] = round(elapsed, 2)
+        view['throughput'] = round(processed / elapsed, 1) if elapsed > 0 else None
+        view['eta_s'] = (round((total - processed) / view['throughput'], 1)
+                         if job['state'] == 'running' and total and view['throughput'] else None)
+        if os.path.exists(os.path.join(self._dir(job['id']), 'cancel')) and job['state'] in ACTIVE_STATES:
+            view['cancel_requested'] = True
+        view['output'] = os.path.basename(job['output']) if job.get('output') else None
+        return view
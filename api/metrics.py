@@ -0,0 +1,60 @@
+"""
+Instrumentation HTTP de l'application
+Latence par route (histogramme), requêtes par code de retour et tailles des
+corps reçus/envoyés, enregistrées dans le registre de prompts.metrics ; les
+métriques du détecteur et des sauvegardes y sont déclarées par leurs modules.
+La latence est mesurée à la fermeture de la réponse : elle inclut la génération
+des corps servis en flux (NDJSON, index mmap).
+Avec gunicorn, les workers publient leurs séries dans un dossier partagé et
+/api/metrics rend leur somme, quel que soit le worker qui répond (jauges : une
+série par worker, label pid).
+"""
+import time
+
+from flask import Flask, Response, g, request
+
+from prompts.metrics import REGISTRY, SIZE_BUCKETS
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+REQUEST_SECONDS = REGISTRY.histogram('annotator_http_request_duration_seconds',
+                                     'Durée de traitement des requêtes par route', labelnames=['route', 'method'])
+REQUESTS = REGISTRY.counter('annotator_http_requests_total', 'Requêtes par route et code de retour',
+                            ['route', 'method', 'status'])
+REQUEST_BYTES = REGISTRY.histogram('annotator_http_request_bytes', 'Taille des corps de requête',
+                                   SIZE_BUCKETS, ['route'])
+RESPONSE_BYTES = REGISTRY.histogram('annotator_http_response_bytes',
+                                    'Taille des corps de réponse (après compression, hors flux)',
+                                    SIZE_BUCKETS, ['route'])
+
+
+def _route() -> str:
+    # Motif de la route (`/api/jobs/<job_id>`) plutôt que l'URL : nombre de séries borné
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+def instrument(app: Flask) -> None:
+    """Mesurer toutes les requêtes de l'application"""
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _record(response: Response) -> Response:
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        route, method = _route(), request.method
+        # Corps en flux générés après after_request : durée relevée quand le serveur ferme la réponse
+        response.call_on_close(lambda: REQUEST_SECONDS.observe(time.perf_counter() - started, (route, method)))
+        REQUESTS.inc(1, (route, method, response.status_code))
+        if request.content_length:
+            REQUEST_BYTES.observe(request.content_length, (route,))
+        if response.content_length is not None:  # Inconnue pour les réponses en flux
+            RESPONSE_BYTES.observe(response.content_length, (route,))
+        return response
+
+
+def metrics_response() -> Response:
+    """Corps de /api/metrics au format texte Prometheus"""
+    return Response(REGISTRY.render(), content_type=PROMETHEUS_CONTENT_TYPE, headers={'Cache-Control': 'no-store'})
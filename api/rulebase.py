@@ -0,0 +1,171 @@
+"""
+Base de règles chaude pour /api/annotate
+Les YAML de rules/ sont chargés et compilés une fois par processus ; un thread
+surveille le dossier (mtime/taille des fichiers, toutes les `poll_interval`
+secondes) et recharge la base quand un fichier change. La nouvelle base est
+compilée à côté (seuls les fichiers modifiés sont relus) puis publiée par une
+seule affectation : une requête en cours garde l'instantané qu'elle a pris,
+sans verrou sur le chemin de lecture.
+Un YAML ou un motif invalide laisse la base précédente en place (`last_error`).
+"""
+import os
+import threading
+import time
+import weakref
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from prompts.detector import annotate_sentence, annotate_threaded
+from prompts.loaders import load_markers
+from prompts.types import cues_to_dicts
+
+RULE_SUBDIRS = ('10_markers', '20_scopes')
+
+
+class Snapshot(NamedTuple):
+    version: int
+    fingerprint: Tuple
+    markers_by_group: Dict[str, List[Dict[str, Any]]]
+    rule_count: int
+    loaded_at: float
+    load_ms: float
+
+
+class Rulebase:
+    def __init__(self, rules_dir: str, poll_interval: float = 0.05, default_timeout_ms: Optional[float] = None,
+                 detect_threads: int = 1):
+        self.rules_dir = rules_dir
+        self.detect_threads = detect_threads  # Threads de détection par lot (pool partagé du processus)
+        self.poll_interval = poll_interval
+        self.default_timeout_ms = default_timeout_ms
+        self.last_error: Optional[str] = None
+        self._snapshot: Optional[Snapshot] = None
+        self._file_cache: Dict[str, Any] = {}  # Règles compilées par fichier, clé (mtime, taille)
+        self._failed: Optional[Tuple] = None   # Empreinte du dernier chargement en erreur (pas de nouvel essai)
+        self._reload_lock = threading.Lock()   # Un seul rechargement à la fois (lecteurs non bloqués)
+        self._watcher_pid: Optional[int] = None
+        self._stop = threading.Event()
+        # Un fork peut survenir pendant qu'un thread du parent tient le verrou : l'enfant
+        # repart d'un verrou libre (sinon son premier rechargement se bloque pour toujours)
+        ref = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: ref() is not None and ref()._after_fork_in_child())
+
+    # ------------------------------------------------------------------
+    # Chargement
+    # ------------------------------------------------------------------
+    def fingerprint(self) -> Tuple:
+        """(nom, mtime_ns, taille) de chaque YAML : change dès qu'un fichier est modifié, ajouté ou retiré"""
+        entries = []
+        for sub in RULE_SUBDIRS:
+            folder = os.path.join(self.rules_dir, sub)
+            try:
+                names = sorted(os.listdir(folder))
+            except OSError:
+                continue
+            for name in names:
+                if name.endswith('.yaml'):
+                    try:
+                        st = os.stat(os.path.join(folder, name))
+                    except OSError:
+                        continue
+                    entries.append((sub, name, st.st_mtime_ns, st.st_size))
+        return tuple(entries)
+
+    def snapshot(self) -> Snapshot:
+        """Base courante (chargée au premier appel, surveillée ensuite)"""
+        self._ensure_watcher()
+        snap = self._snapshot
+        if snap is None:
+            self.reload()
+            snap = self._snapshot
+            if snap is None:
+                raise RuntimeError(f"Chargement des règles impossible: {self.last_error}")
+        return snap
+
+    def reload(self, force: bool = False) -> bool:
+        """Recompiler si les YAML ont changé ; True si une nouvelle base a été publiée"""
+        with self._reload_lock:
+            fingerprint = self.fingerprint()
+            current = self._snapshot
+            if not force and ((current is not None and current.fingerprint == fingerprint)
+                              or fingerprint == self._failed):
+                return False
+            started = time.perf_counter()
+            try:
+                markers_by_group = load_markers(Path(self.rules_dir), default_timeout_ms=self.default_timeout_ms,
+                                                file_cache=self._file_cache)
+            except Exception as e:
+                self._failed = fingerprint
+                self.last_error = f"{type(e).__name__}: {e}"
+                print(f"Erreur rechargement des règles (base précédente conservée): {self.last_error}")
+                return False
+            self.last_error = self._failed = None
+            self._snapshot = Snapshot(
+                version=(current.version + 1) if current else 1,
+                fingerprint=fingerprint,
+                markers_by_group=markers_by_group,
+                rule_count=sum(len(rules) for rules in markers_by_group.values()),
+                loaded_at=time.time(),
+                load_ms=round((time.perf_counter() - started) * 1000, 1),
+            )
+            print(f"DEBUG: règles v{self._snapshot.version} chargées "
+                  f"({self._snapshot.rule_count} règles, {self._snapshot.load_ms} ms)")
+            return True
+
+    # ------------------------------------------------------------------
+    # Surveillance
+    # ------------------------------------------------------------------
+    def _after_fork_in_child(self) -> None:
+        self._reload_lock = threading.Lock()
+        self._watcher_pid = None
+        self._stop = threading.Event()
+
+    def _ensure_watcher(self) -> None:
+        # Un thread par processus : celui démarré avant un fork (gunicorn preload) n'existe
+        # pas dans les workers
+        if self.poll_interval <= 0 or self._watcher_pid == os.getpid():
+            return
+        with self._reload_lock:
+            if self._watcher_pid == os.getpid():
+                return
+            self._watcher_pid = os.getpid()
+            self._stop.clear()
+            threading.Thread(target=self._watch, name='rulebase-watcher', daemon=True).start()
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.poll_interval):
+            snap = self._snapshot
+            try:
+                if snap is not None:
+                    self.reload()  # Sans effet si l'empreinte n'a pas changé
+            except Exception as e:
+                print(f"Erreur surveillance des règles: {e}")
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._watcher_pid = None
+
+    # ------------------------------------------------------------------
+    # Annotation
+    # ------------------------------------------------------------------
+    def annotate(self, texts: List[str], first_id: int = 1) -> Tuple[Snapshot, List[Dict[str, Any]]]:
+        """Annoter des phrases avec un instantané de la base (cues au format JSON)"""
+        snap = self.snapshot()
+        if len(texts) == 1:
+            results = [annotate_sentence(texts[0], first_id, snap.markers_by_group, [])]
+        else:
+            results = annotate_threaded(texts, first_id, snap.markers_by_group, self.detect_threads)
+        for obj in results:
+            obj['cues'] = cues_to_dicts(obj['cues'])
+        return snap, results
+
+    def info(self) -> Dict[str, Any]:
+        snap = self._snapshot
+        return {
+            'rules_dir': self.rules_dir,
+            'version': snap.version if snap else None,
+            'rule_count': snap.rule_count if snap else 0,
+            'loaded_at': snap.loaded_at if snap else None,
+            'load_ms': snap.load_ms if snap else None,
+            'last_error': self.last_error,
+        }
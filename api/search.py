@@ -0,0 +1,278 @@
+"""
+Index inversé et recherche booléenne sur un corpus JSONL
+Termes indexés, par document (position dans le fichier) :
+    rule:<id de règle>   group:<groupe>   label:<cue_label>
+    tok:<mot du texte>   bi:<mot1 mot2>   (bigrammes, pour les phrases)
+Syntaxe des requêtes :
+    rule:PREP_SANS_CORE AND group:bipartite
+    group:bipartite label:"ne plus"          (AND implicite)
+    "absence de" OR sans                      (phrase / mot du texte)
+    NOT group:lexical, parenthèses acceptées
+L'index suit le fichier en ajout seul : seules les lignes ajoutées depuis la
+dernière mise à jour sont indexées (fichier compressé : réindexé s'il change,
+les positions étant celles du flux décompressé).
+"""
+import json
+import os
+import re
+import sys
+import threading
+import unicodedata
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from prompts.compressed_io import detect_codec, open_binary
+
+FIELDS = ('rule', 'group', 'label', 'tok', 'text')
+_WORD_RE = re.compile(r'\w+')
+_QUERY_TOKEN_RE = re.compile(r'\(|\)|(?:(\w+):)?"([^"]*)"|(?:(\w+):)?([^\s()"]+)')
+
+
+def normalize(s: str) -> str:
+    """NFKC, minuscules, apostrophes typographiques, espaces multiples"""
+    s = unicodedata.normalize('NFKC', s or '').lower().replace('’', "'").replace('‘', "'")
+    return ' '.join(s.split())
+
+
+def tokenize(text: str) -> List[str]:
+    return _WORD_RE.findall(normalize(text))
+
+
+class QuerySyntaxError(ValueError):
+    pass
+
+
+class SearchIndex:
+    def __init__(self, data_file: str):
+        self.data_file = data_file
+        self._lock = threading.RLock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.postings: Dict[str, array] = {}
+        self.doc_offsets = array('Q')   # Position (octets) de chaque document dans le fichier
+        self.doc_ids: List[Any] = []
+        self.indexed_bytes = 0          # Fin de la dernière ligne complète indexée
+        self._file_key = None
+        self._memory = None             # (taille de l'index, octets) de la dernière mesure
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def memory_bytes(self) -> int:
+        """Taille mesurée des structures de l'index (termes, postings, offsets, ids)"""
+        with self._lock:
+            key = (len(self.doc_ids), len(self.postings))
+            if self._memory is not None and self._memory[0] == key:
+                return self._memory[1]
+            size = sys.getsizeof(self.postings) + sys.getsizeof(self.doc_offsets) + sys.getsizeof(self.doc_ids)
+            size += sum(sys.getsizeof(term) + sys.getsizeof(plist) for term, plist in self.postings.items())
+            size += sum(sys.getsizeof(doc_id) for doc_id in self.doc_ids)
+            self._memory = (key, size)
+            return size
+
+    # ------------------------------------------------------------------
+    # Construction incrémentale
+    # ------------------------------------------------------------------
+    def _add(self, term: str, doc: int) -> None:
+        plist = self.postings.get(term)
+        if plist is None:
+            plist = self.postings[term] = array('I')
+        if not plist or plist[-1] != doc:  # Documents ajoutés dans l'ordre : pas de doublon
+            plist.append(doc)
+
+    def _index_document(self, doc: int, annotation: Dict[str, Any]) -> None:
+        tokens = tokenize(annotation.get('text', ''))
+        for tok in tokens:
+            self._add(f'tok:{tok}', doc)
+        for a, b in zip(tokens, tokens[1:]):
+            self._add(f'bi:{a} {b}', doc)
+        for cue in annotation.get('cues', []) or []:
+            if cue.get('id'):
+                self._add(f"rule:{cue['id']}", doc)
+            if cue.get('group'):
+                self._add(f"group:{normalize(cue['group'])}", doc)
+            if cue.get('cue_label'):
+                self._add(f"label:{normalize(cue['cue_label'])}", doc)
+
+    def refresh(self) -> int:
+        """Indexer les lignes ajoutées depuis la dernière mise à jour (reconstruit si le fichier a changé)"""
+        with self._lock:
+            try:
+                st = os.stat(self.data_file)
+            except OSError:
+                self._reset()
+                return 0
+            compressed = detect_codec(self.data_file) is not None
+            if compressed:
+                # Offsets du flux décompressé : pas de reprise incrémentale possible par la taille
+                file_key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+                if file_key == self._file_key:
+                    return 0
+                self._reset()
+                self._file_key = file_key
+            else:
+                file_key = (st.st_dev, st.st_ino)
+                if file_key != self._file_key or st.st_size < self.indexed_bytes:
+                    self._reset()  # Fichier remplacé ou tronqué : pas un simple ajout
+                    self._file_key = file_key
+                if st.st_size == self.indexed_bytes:
+                    return 0
+
+            added = 0
+            with open_binary(self.data_file) as f:
+                f.seek(self.indexed_bytes)
+                position = self.indexed_bytes
+                for raw in f:
+                    if not raw.endswith(b'\n'):
+                        # Dernière ligne éventuellement en cours d'écriture : attendre qu'elle soit complète
+                        try:
+                            json.loads(raw)
+                        except json.JSONDecodeError:
+                            break
+                    line_start = position
+                    position += len(raw)
+                    if not raw.strip():
+                        continue
+                    try:
+                        annotation = json.loads(raw)
+                    except json.JSONDecodeError:
+                        continue
+                    doc = len(self.doc_ids)
+                    self.doc_ids.append(annotation.get('id'))
+                    self.doc_offsets.append(line_start)
+                    self._index_document(doc, annotation)
+                    added += 1
+                self.indexed_bytes = position
+            return added
+
+    # ------------------------------------------------------------------
+    # Requêtes
+    # ------------------------------------------------------------------
+    def _term(self, key: str) -> np.ndarray:
+        plist = self.postings.get(key)
+        if not plist:
+            return np.empty(0, dtype=np.uint32)
+        return np.frombuffer(plist, dtype=np.uint32)
+
+    def _field_postings(self, field: Optional[str], value: str) -> Tuple[np.ndarray, Optional[str]]:
+        """Postings d'un terme ; renvoie aussi la phrase à vérifier sur le texte si nécessaire"""
+        field = (field or 'text').lower()
+        if field not in FIELDS:
+            raise QuerySyntaxError(f"Champ inconnu: {field}")
+        if field == 'rule':
+            return self._term(f'rule:{value}'), None
+        if field in ('group', 'label'):
+            return self._term(f'{field}:{normalize(value)}'), None
+
+        tokens = tokenize(value)
+        if not tokens:
+            return np.empty(0, dtype=np.uint32), None
+        if len(tokens) == 1:
+            return self._term(f'tok:{tokens[0]}'), None
+        result = None
+        for a, b in zip(tokens, tokens[1:]):
+            plist = self._term(f'bi:{a} {b}')
+            result = plist if result is None else np.intersect1d(result, plist, assume_unique=True)
+        # Au-delà de deux mots, les bigrammes ne garantissent pas la contiguïté
+        return result, (' '.join(tokens) if len(tokens) > 2 else None)
+
+    def _parse(self, query: str) -> List[Tuple[str, Any]]:
+        items = []
+        for m in _QUERY_TOKEN_RE.finditer(query):
+            text = m.group(0)
+            if text in ('(', ')'):
+                items.append((text, None))
+            elif m.group(2) is not None:
+                items.append(('TERM', (m.group(1), m.group(2))))
+            elif m.group(4) in ('AND', 'OR', 'NOT') and not m.group(3):
+                items.append((m.group(4), None))
+            else:
+                items.append(('TERM', (m.group(3), m.group(4))))
+        return items
+
+    def search(self, query: str, offset: int = 0, limit: int = 50) -> Dict[str, Any]:
+        """Évaluer une requête booléenne ; renvoie une page de documents"""
+        self.refresh()
+        with self._lock:
+            items = self._parse(query)
+            if not items:
+                raise QuerySyntaxError("Requête vide")
+            pos = 0
+
+            def peek():
+                return items[pos][0] if pos < len(items) else None
+
+            def parse_or():
+                nonlocal pos
+                result = parse_and()
+                while peek() == 'OR':
+                    pos += 1
+                    result = np.union1d(result, parse_and())
+                return result
+
+            def parse_and():
+                nonlocal pos
+                result = parse_not()
+                while peek() in ('AND', 'NOT', 'TERM', '('):
+                    if peek() == 'AND':
+                        pos += 1
+                    result = np.intersect1d(result, parse_not(), assume_unique=True)
+                return result
+
+            def parse_not():
+                nonlocal pos
+                if peek() == 'NOT':
+                    pos += 1
+                    everything = np.arange(len(self.doc_ids), dtype=np.uint32)
+                    return np.setdiff1d(everything, parse_not(), assume_unique=True)
+                return parse_atom()
+
+            def parse_atom():
+                nonlocal pos
+                kind = peek()
+                if kind == '(':
+                    pos += 1
+                    result = parse_or()
+                    if peek() != ')':
+                        raise QuerySyntaxError("Parenthèse fermante manquante")
+                    pos += 1
+                    return result
+                if kind != 'TERM':
+                    raise QuerySyntaxError(f"Terme attendu, trouvé: {kind}")
+                field, value = items[pos][1]
+                pos += 1
+                plist, phrase = self._field_postings(field, value)
+                if phrase:
+                    plist = self._filter_phrase(plist, phrase)
+                return plist
+
+            docs = parse_or()
+            if pos != len(items):
+                raise QuerySyntaxError(f"Élément inattendu: {items[pos][0]}")
+            docs = np.array(docs, dtype=np.uint32)  # Copie : ne pas retenir les buffers des postings
+
+            page = docs[offset:offset + limit]
+            results = []
+            with open_binary(self.data_file) as f:  # Documents lus dans l'ordre : seeks vers l'avant
+                for doc in page:
+                    annotation = self._read(f, int(doc))
+                    annotation['_position'] = int(doc)  # Index du document dans le fichier
+                    results.append(annotation)
+            return {'query': query, 'total': int(len(docs)), 'offset': offset, 'limit': limit, 'results': results}
+
+    def _read(self, f, doc: int) -> Dict[str, Any]:
+        f.seek(self.doc_offsets[doc])
+        return json.loads(f.readline())
+
+    def _filter_phrase(self, candidates: np.ndarray, phrase: str) -> np.ndarray:
+        """Vérifier sur le texte les candidats d'une phrase de plus de deux mots"""
+        kept = []
+        with open_binary(self.data_file) as f:
+            for doc in candidates:
+                text = ' '.join(tokenize(self._read(f, int(doc)).get('text', '')))
+                if f' {phrase} ' in f' {text} ':
+                    kept.append(doc)
+        return np.array(kept, dtype=np.uint32)
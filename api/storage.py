@@ -2,103 +2,126 @@
 Module de stockage et persistance des données
 Gestion des sauvegardes, historique et validation
 """
-import json
 import os
-import shutil
+import time
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import Iterator, List, Dict, Any, Optional
+
+from prompts.evaluate import iter_latest_jsonl
+from prompts.metrics import REGISTRY, COUNT_BUCKETS
+
+from .backends import make_backend
+from .backups import JournalBackup
+from .writer import FileLock, GroupCommitWriter
+
+SAVE_BATCH_RECORDS = REGISTRY.histogram('annotator_save_batch_records',
+                                        'Annotations écrites par commit (group commit)', COUNT_BUCKETS)
+SAVE_COMMIT_SECONDS = REGISTRY.histogram('annotator_save_commit_duration_seconds',
+                                         'Durée d\'un commit de sauvegarde (verrou, écriture, fsync, journal)')
 
 
 class StorageManager:
-    def __init__(self, validated_dir: str):
+    def __init__(self, validated_dir: str, backend: str = 'jsonl', group_commit: bool = True,
+                 max_latency_ms: float = 10, max_batch: int = 1000,
+                 compression: Optional[str] = None, compress_level: Optional[int] = None):
         self.validated_dir = validated_dir
-        self.validated_file = os.path.join(validated_dir, 'annotations_validated.jsonl')
+        # compression='gzip' → annotations_validated.jsonl.gz (backend jsonl uniquement)
+        self.backend = make_backend(backend, validated_dir, compression=compression, compress_level=compress_level)
+        self.validated_file = self.backend.path
         self.backup_dir = os.path.join(validated_dir, 'backups')
-        self.last_backup_time = None  # 🔄 NOUVEAU: Tracker le dernier backup
-        self.backup_interval_minutes = 5  # 🔄 NOUVEAU: Intervalle minimum entre backups
+        # Sauvegardes incrémentales : base complète + segments de journal
+        self.journal = JournalBackup(self.backup_dir)
+        # Verrou consultatif partagé par tous les processus qui écrivent ce stockage
+        self.lock = FileLock(self.validated_file + '.lock')
+        # Writer unique : regroupe les sauvegardes concurrentes en un seul commit durable
+        self.writer = GroupCommitWriter(self._commit_batch, max_latency_ms, max_batch) if group_commit else None
         
     def ensure_directories(self):
         """Créer les répertoires nécessaires"""
         os.makedirs(self.validated_dir, exist_ok=True)
         os.makedirs(self.backup_dir, exist_ok=True)
     
-    def should_create_backup(self) -> bool:
-        """Déterminer s'il faut créer un backup"""
-        if not os.path.exists(self.validated_file):
-            return False  # Pas de fichier existant = pas besoin de backup
-            
-        now = datetime.now()
-        
-        # Si aucun backup précédent, créer un
-        if self.last_backup_time is None:
-            return True
-            
-        # Vérifier l'intervalle de temps
-        time_diff = (now - self.last_backup_time).total_seconds() / 60  # en minutes
-        return time_diff >= self.backup_interval_minutes
-    
-    def create_backup(self) -> Optional[str]:
-        """Créer une sauvegarde avant modification (seulement si nécessaire)"""
-        if not self.should_create_backup():
-            print("DEBUG: Backup ignoré (trop récent ou inutile)")
+    def ensure_backup_base(self) -> Optional[str]:
+        """Créer la base initiale du journal (copie complète unique)"""
+        if self.journal.has_base():
             return None
-            
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_file = os.path.join(self.backup_dir, f'annotations_validated_{timestamp}.jsonl')
-        
         try:
-            shutil.copy2(self.validated_file, backup_file)
-            self.last_backup_time = datetime.now()  # 🔄 NOUVEAU: Mettre à jour le timestamp
-            print(f"DEBUG: Backup créé: {backup_file}")
-            return backup_file
+            base = self.journal.create_base(self.backend.iter_records())
+            print(f"DEBUG: Base de sauvegarde créée: {base}")
+            return base
         except Exception as e:
             print(f"Erreur backup: {e}")
             return None
+
+    def _compaction_source(self):
+        # Le backend SQLite contient déjà l'état dédupliqué : inutile de rejouer les journaux
+        return self.backend.iter_records() if self.backend.name == 'sqlite' else None
+
+    def journal_records(self, records: List[Dict[str, Any]]) -> None:
+        """Journaliser des enregistrements écrits et compacter si nécessaire"""
+        try:
+            self.journal.append(records)
+            if self.journal.needs_compaction():
+                base = self.journal.compact(self._compaction_source())
+                print(f"DEBUG: Journal compacté dans une nouvelle base: {base}")
+        except Exception as e:
+            print(f"Erreur backup: {e}")
     
     def force_backup(self) -> Optional[str]:
-        """Forcer la création d'un backup (ignorer l'intervalle de temps)"""
-        if not os.path.exists(self.validated_file):
+        """Forcer une nouvelle base (compaction immédiate du journal)"""
+        if not self.backend.exists():
             return None
-            
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_file = os.path.join(self.backup_dir, f'annotations_validated_{timestamp}_manual.jsonl')
         
         try:
-            shutil.copy2(self.validated_file, backup_file)
-            self.last_backup_time = datetime.now()
-            print(f"DEBUG: Backup manuel créé: {backup_file}")
-            return backup_file
+            self.ensure_directories()
+            base = self.journal.compact(self._compaction_source())
+            print(f"DEBUG: Backup manuel créé: {base}")
+            return base
         except Exception as e:
             print(f"Erreur backup manuel: {e}")
             return None
 
+    def restore(self, output_path: str, at: Optional[datetime] = None) -> int:
+        """Reconstruire les annotations validées telles qu'à l'instant `at`"""
+        return self.journal.restore(output_path, at)
+
     def save_annotation(self, annotation: Dict[str, Any]) -> bool:
         """Sauvegarder une annotation unique"""
         return self.save_annotations([annotation])
     
     def save_annotations(self, annotations: List[Dict[str, Any]]) -> bool:
-        """Sauvegarder plusieurs annotations"""
-        self.ensure_directories()
-        
+        """Sauvegarder plusieurs annotations (retour une fois l'écriture durable)"""
         try:
-            # 🔄 NOUVEAU: Créer backup seulement si nécessaire
-            backup_file = self.create_backup()
-            if backup_file:
-                print(f"DEBUG: Backup créé avant sauvegarde: {backup_file}")
+            # Réorganiser les champs dans l'ordre souhaité
+            ordered = [self._reorder_annotation_fields(annotation) for annotation in annotations]
+            if self.writer is not None:
+                self.writer.submit(ordered).wait()
             else:
-                print("DEBUG: Aucun backup créé (pas nécessaire)")
-            
-            with open(self.validated_file, 'a', encoding='utf-8') as f:
-                for annotation in annotations:
-                    # 🔄 NOUVEAU: Réorganiser les champs dans l'ordre souhaité
-                    ordered_annotation = self._reorder_annotation_fields(annotation)
-                    f.write(json.dumps(ordered_annotation, ensure_ascii=False) + '\n')
+                self._commit_batch(ordered)
             
             print(f"DEBUG: {len(annotations)} annotation(s) sauvegardée(s)")
             return True
         except Exception as e:
             print(f"Erreur sauvegarde: {e}")
             return False
+
+    def _commit_batch(self, records: List[Dict[str, Any]]) -> None:
+        """Écrire un lot sous verrou inter-processus : un seul fsync par lot"""
+        started = time.perf_counter()
+        self.ensure_directories()
+        with self.lock:
+            self.ensure_backup_base()
+            self.backend.write(records, sync=True)
+            # Sauvegarde incrémentale : seuls les nouveaux enregistrements sont journalisés
+            self.journal_records(records)
+        SAVE_BATCH_RECORDS.observe(len(records))
+        SAVE_COMMIT_SECONDS.observe(time.perf_counter() - started)
+
+    def close(self) -> None:
+        """Vider la file d'écriture et libérer le backend"""
+        if self.writer is not None:
+            self.writer.close()
+        self.backend.close()
     
     def _reorder_annotation_fields(self, annotation: Dict[str, Any]) -> Dict[str, Any]:
         """Réorganiser les champs dans l'ordre souhaité : id, text, cues, scopes, validated_at"""
@@ -124,23 +147,51 @@ class StorageManager:
     
     def get_validated_count(self) -> int:
         """Compter les annotations validées"""
-        if not os.path.exists(self.validated_file):
-            return 0
-            
         try:
-            with open(self.validated_file, 'r', encoding='utf-8') as f:
-                return sum(1 for line in f if line.strip())
+            return self.backend.count()
         except Exception:
             return 0
+
+    def version(self) -> tuple:
+        """Version du stockage (mtime/taille du fichier, du WAL SQLite et du dossier de backups)"""
+        version = []
+        for path in (self.validated_file, self.validated_file + '-wal', self.backup_dir):
+            try:
+                st = os.stat(path)
+                version.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                version.append(None)
+        return tuple(version)
+
+    def get_latest(self, doc_id: Any) -> Optional[Dict[str, Any]]:
+        """Dernière version validée d'un document"""
+        try:
+            return self.backend.get_latest(doc_id)
+        except Exception as e:
+            print(f"Erreur lecture: {e}")
+            return None
+
+    def iter_validated(self) -> Iterator[Dict[str, Any]]:
+        """Dernière version de chaque annotation validée (doublons JSONL éliminés)"""
+        if self.backend.name == 'sqlite':
+            return self.backend.iter_records()  # Une ligne par document
+        if not os.path.exists(self.validated_file):
+            return iter(())
+        return iter_latest_jsonl(self.validated_file)
+
+    def export_jsonl(self, output_path: str, compress_level: Optional[int] = None) -> int:
+        """Exporter les annotations validées en JSONL (ordre des champs conservé, compressé selon l'extension)"""
+        return self.backend.export_jsonl(output_path, compress_level)
     
     def get_recent_backups(self, limit: int = 5) -> List[str]:
-        """Liste des sauvegardes récentes"""
+        """Liste des sauvegardes récentes (bases, segments de journal et anciennes copies)"""
         if not os.path.exists(self.backup_dir):
             return []
             
         try:
             backups = [f for f in os.listdir(self.backup_dir) if f.endswith('.jsonl')]
-            backups.sort(reverse=True)  # Plus récent en premier
+            # Plus récent en premier
+            backups.sort(key=lambda f: os.path.getmtime(os.path.join(self.backup_dir, f)), reverse=True)
             return backups[:limit]
         except Exception:
             return []
@@ -0,0 +1,173 @@
+"""
+Validation serveur des annotations envoyées à /api/save
+Tous les intervalles d'un lot (positions des cues et des portées, ou
+start/end de l'ancien format) sont aplatis dans des tableaux NumPy ; les
+contrôles sont faits sur le lot entier, sans boucle sur les paires :
+    malformed        position qui n'est pas une paire d'entiers
+    bounds           0 <= start < end <= len(text) non respecté
+    text_mismatch    le texte pointé ne correspond pas au libellé
+                     (cue_label, scope ou text ; comparaison normalisée)
+    scope_overlap    deux portées différentes d'un document se chevauchent
+    scope_covers_cue une portée recouvre un cue du même document
+Les deux derniers sont des avertissements (le document est enregistré) sauf en
+mode strict : deux cues peuvent légitimement partager la même portée, et les
+cues se chevauchent entre eux (« pas » est aussi la 2e partie de « ne ... pas »),
+ce qui n'est pas vérifié.
+Chevauchements par balayage : intervalles triés par (document, début), fin
+maximale cumulée (np.maximum.accumulate) sur des positions décalées par
+document pour que les documents ne se mélangent pas ; la fin maximale est
+codée avec l'indice de l'intervalle qui l'atteint, pour nommer le conflit.
+"""
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from prompts.metrics import REGISTRY
+
+REQUIRED_FIELDS = ('id', 'text', 'cues')
+WARNING_CODES = frozenset({'scope_overlap', 'scope_covers_cue'})
+CUE, SCOPE = 0, 1
+_KIND_NAMES = ('cues', 'scopes')
+
+VALIDATION_ISSUES = REGISTRY.counter('annotator_save_validation_issues_total',
+                                     'Erreurs et avertissements de validation des sauvegardes', ['code'])
+
+
+def _normalize(s: str) -> str:
+    """NFKC, minuscules, apostrophes typographiques, espaces multiples (comme le navigateur)"""
+    s = unicodedata.normalize('NFKC', s or '').lower().replace('’', "'").replace('‘', "'")
+    return ' '.join(s.split())
+
+
+def _intervals(item: Dict[str, Any]) -> Optional[List[Any]]:
+    positions = item.get('positions')
+    if isinstance(positions, list) and positions:
+        return positions
+    if 'start' in item or 'end' in item:
+        return [[item.get('start'), item.get('end')]]
+    return None  # Portée sans positions (non encore placée) : rien à vérifier
+
+
+def validate_batch(annotations: List[Any], strict: bool = False) -> List[Dict[str, Any]]:
+    """Rapport par document, dans l'ordre du lot : {'index', 'id', 'valid', 'errors', 'warnings'}"""
+    reports = [{'index': i, 'id': ann.get('id') if isinstance(ann, dict) else None, 'valid': True,
+                'errors': [], 'warnings': []}
+               for i, ann in enumerate(annotations)]
+
+    def error(doc: int, code: str, message: str, **where: Any) -> None:
+        if code in WARNING_CODES and not strict:
+            reports[doc]['warnings'].append({'code': code, 'message': message, **where})
+            return
+        reports[doc]['valid'] = False
+        reports[doc]['errors'].append({'code': code, 'message': message, **where})
+
+    rows: List[Tuple[int, int, int, int, int, int]] = []  # (doc, type, élément, partie, début, fin)
+    lengths = np.zeros(len(annotations), dtype=np.int64)
+    for doc, ann in enumerate(annotations):
+        if not isinstance(ann, dict):
+            error(doc, 'missing_field', 'Annotation non objet')
+            continue
+        missing = [field for field in REQUIRED_FIELDS if field not in ann]
+        if missing:
+            error(doc, 'missing_field', f"Champ(s) manquant(s): {', '.join(missing)}")
+            continue
+        if not isinstance(ann['text'], str):
+            error(doc, 'missing_field', 'Champ text non textuel')
+            continue
+        text = ann['text']
+        lengths[doc] = len(text)
+        for kind, field, label_field in ((CUE, 'cues', 'cue_label'), (SCOPE, 'scopes', 'scope')):
+            items = ann.get(field) or []
+            if not isinstance(items, list):
+                error(doc, 'malformed', f'Champ {field} non liste', kind=field)
+                continue
+            for item, entry in enumerate(items):
+                intervals = _intervals(entry) if isinstance(entry, dict) else None
+                if intervals is None:
+                    if not isinstance(entry, dict):
+                        error(doc, 'malformed', f'{field}[{item}] non objet', kind=field, item=item)
+                    continue
+                label = entry.get(label_field) or entry.get('text')
+                if not isinstance(label, str):
+                    label = None
+                normalized_label = None
+                for part, pos in enumerate(intervals):
+                    if not (isinstance(pos, (list, tuple)) and len(pos) == 2
+                            and type(pos[0]) is int and type(pos[1]) is int):
+                        error(doc, 'malformed', f'{field}[{item}] : position {pos!r} invalide',
+                              kind=field, item=item, part=part)
+                        continue
+                    start, end = pos
+                    rows.append((doc, kind, item, part, start, end))
+                    # Texte pointé contre libellé (bornes vérifiées sur tout le lot ensuite)
+                    if label is None or not 0 <= start < end <= len(text):
+                        continue
+                    segment = text[start:end]
+                    if segment in label:
+                        continue  # Cas courant : pas de normalisation
+                    if normalized_label is None:
+                        normalized_label = _normalize(label)
+                    if _normalize(segment) not in normalized_label:
+                        error(doc, 'text_mismatch', f'{field}[{item}] : « {segment} » ne correspond pas à « {label} »',
+                              kind=field, item=item, part=part)
+
+    if rows:
+        _check_intervals(np.array(rows, dtype=np.int64), lengths, error)
+    issues = Counter(issue['code'] for report in reports for issue in report['errors'] + report['warnings'])
+    if issues:
+        VALIDATION_ISSUES.inc_many({(code,): n for code, n in issues.items()})
+    return reports
+
+
+def _check_intervals(rows: np.ndarray, lengths: np.ndarray, error) -> None:
+    doc, kind, item, part, start, end = rows.T
+
+    # Bornes
+    bad = (start < 0) | (end <= start) | (end > lengths[doc])
+    for i in np.flatnonzero(bad):
+        error(int(doc[i]), 'bounds',
+              f'{_KIND_NAMES[kind[i]]}[{item[i]}] : [{start[i]}, {end[i]}] hors de [0, {lengths[doc[i]]}]',
+              kind=_KIND_NAMES[kind[i]], item=int(item[i]), part=int(part[i]))
+    ok = ~bad
+
+    # Positions décalées par document : un intervalle ne peut chevaucher que son document
+    stride = int(lengths.max()) + 1
+    shifted_start = start + doc * stride
+    shifted_end = end + doc * stride
+    is_scope = ok & (kind == SCOPE)
+    is_cue = ok & (kind == CUE)
+    scopes = np.flatnonzero(is_scope)
+    scopes = scopes[np.argsort(shifted_start[scopes], kind='stable')]
+    cues = np.flatnonzero(is_cue)
+    cues = cues[np.argsort(shifted_start[cues], kind='stable')]
+    count = len(start)
+
+    def running_max(order: np.ndarray) -> np.ndarray:
+        # Fin maximale cumulée, codée avec l'indice de l'intervalle qui l'atteint
+        return np.maximum.accumulate(shifted_end[order] * count + order)
+
+    # Portées entre elles : chaque portée contre la fin maximale des précédentes
+    if len(scopes) > 1:
+        best = running_max(scopes)
+        previous = best[:-1]
+        current = scopes[1:]
+        other = previous % count
+        hits = (previous // count > shifted_start[current]) & (item[other] != item[current])
+        for i, j in zip(current[hits], other[hits]):
+            error(int(doc[i]), 'scope_overlap',
+                  f'scopes[{item[i]}] [{start[i]}, {end[i]}] chevauche scopes[{item[j]}] [{start[j]}, {end[j]}]',
+                  kind='scopes', item=int(item[i]), part=int(part[i]), other=int(item[j]))
+
+    # Portées contre cues : cues commençant avant la fin de la portée, fin maximale cumulée
+    if len(scopes) and len(cues):
+        best = running_max(cues)
+        k = np.searchsorted(shifted_start[cues], shifted_end[scopes], side='left')
+        has = k > 0
+        candidates = best[np.maximum(k - 1, 0)]
+        hits = has & (candidates // count > shifted_start[scopes])
+        for i, j in zip(scopes[hits], candidates[hits] % count):
+            error(int(doc[i]), 'scope_covers_cue',
+                  f'scopes[{item[i]}] [{start[i]}, {end[i]}] recouvre le cue cues[{item[j]}] [{start[j]}, {end[j]}]',
+                  kind='scopes', item=int(item[i]), part=int(part[i]), other=int(item[j]))
@@ -0,0 +1,155 @@
+"""
+Préchauffage en arrière-plan
+Au démarrage de chaque processus, un thread compile les règles puis construit
+(ou ouvre) l'index du fichier par défaut et des derniers fichiers utilisés,
+pour que la première requête n'attende pas l'analyse complète d'un gros corpus.
+Un fichier survolé dans le sélecteur peut être préchargé (`prefetch`) avant que
+le changement soit confirmé : il passe en tête de file.
+La liste des fichiers récents est partagée par les workers
+(data/.cache/recent_files.json).
+"""
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from .writer import FileLock
+
+
+class Warmup:
+    def __init__(self, open_file: Callable[[str], Any], recent_path: str, max_recent: int = 3):
+        self.open_file = open_file        # Construit/ouvre l'index d'un fichier, renvoie un objet avec len()
+        self.recent_path = recent_path
+        self.max_recent = max_recent
+        self._queue: Deque[Tuple[str, Any]] = deque()  # (clé, fichier ou fonction)
+        self._state: Dict[str, Dict[str, Any]] = {}
+        self._required: List[str] = []    # Étapes conditionnant la disponibilité (/api/health)
+        self._cond = threading.Condition()
+        self._worker_pid: Optional[int] = None
+        self.started_at: Optional[float] = None
+
+    # ------------------------------------------------------------------
+    # Fichiers récents
+    # ------------------------------------------------------------------
+    def recent_files(self) -> List[str]:
+        try:
+            with open(self.recent_path, encoding='utf-8') as f:
+                files = json.load(f)
+        except (OSError, ValueError):
+            return []
+        return [p for p in files if isinstance(p, str)][:self.max_recent]
+
+    def touch(self, path: str) -> None:
+        """Placer un fichier en tête des fichiers récents"""
+        try:
+            os.makedirs(os.path.dirname(self.recent_path), exist_ok=True)
+            with FileLock(self.recent_path + '.lock'):
+                files = [path] + [p for p in self.recent_files() if p != path]
+                tmp = f"{self.recent_path}.{os.getpid()}.tmp"
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    json.dump(files[:self.max_recent], f, ensure_ascii=False)
+                os.replace(tmp, self.recent_path)
+        except OSError as e:
+            print(f"Erreur mise à jour des fichiers récents: {e}")
+
+    # ------------------------------------------------------------------
+    # File de préchauffage
+    # ------------------------------------------------------------------
+    def start(self, default_file: str, steps: Tuple[Tuple[str, Callable[[], Any]], ...] = ()) -> None:
+        """Lancer le préchauffage de ce processus (sans effet s'il est déjà lancé)"""
+        with self._cond:
+            if self._worker_pid == os.getpid():
+                return
+            self._worker_pid = os.getpid()
+            self.started_at = time.time()
+            self._queue.clear()
+            self._state.clear()  # État hérité d'un fork : le thread du parent n'existe pas ici
+            self._required = [name for name, _ in steps] + [default_file]
+            for name, fn in steps:
+                self._enqueue(name, fn)
+            for path in [default_file] + self.recent_files():
+                if os.path.exists(path):
+                    self._enqueue(path, path)
+                elif path == default_file:
+                    self._state[path] = {'state': 'error', 'error': 'Fichier introuvable'}
+        threading.Thread(target=self._run, name='warmup', daemon=True).start()
+
+    def _enqueue(self, key: str, item: Any, first: bool = False) -> None:
+        state = self._state.get(key)
+        if state is not None and state['state'] in ('queued', 'running', 'ready'):
+            if first and state['state'] == 'queued':
+                self._queue.remove((key, item))
+                self._queue.appendleft((key, item))
+            return
+        self._state[key] = {'state': 'queued'}
+        if first:
+            self._queue.appendleft((key, item))
+        else:
+            self._queue.append((key, item))
+        self._cond.notify()
+
+    def prefetch(self, path: str) -> Dict[str, Any]:
+        """Précharger un fichier en priorité ; renvoie son état courant"""
+        with self._cond:
+            state = self._state.get(path)
+            if state is not None and state['state'] == 'ready' and not self._is_stale(path):
+                return {k: v for k, v in state.items() if k != 'version'}
+            if state is not None and state['state'] == 'ready':
+                del self._state[path]  # Fichier modifié depuis : index à reconstruire
+            self._enqueue(path, path, first=True)
+            return dict(self._state[path])
+
+    def _is_stale(self, path: str) -> bool:
+        state = self._state.get(path, {})
+        try:
+            st = os.stat(path)
+        except OSError:
+            return True
+        return state.get('version') != (st.st_mtime_ns, st.st_size)
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                key, item = self._queue.popleft()
+                self._state[key] = {'state': 'running'}
+            started = time.perf_counter()
+            state: Dict[str, Any] = {}
+            try:
+                if callable(item):
+                    item()
+                else:
+                    st = os.stat(item)
+                    index = self.open_file(item)
+                    state['documents'] = len(index)
+                    state['version'] = (st.st_mtime_ns, st.st_size)
+                state['state'] = 'ready'
+            except Exception as e:
+                print(f"Erreur préchauffage {key}: {e}")
+                state.update(state='error', error=f"{type(e).__name__}: {e}")
+            state['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 1)
+            with self._cond:
+                self._state[key] = state
+            print(f"DEBUG: préchauffage {os.path.basename(key)} : {state['state']} ({state['elapsed_ms']} ms)")
+
+    # ------------------------------------------------------------------
+    # État
+    # ------------------------------------------------------------------
+    def status(self) -> Dict[str, Any]:
+        """`ready` une fois les étapes requises terminées ; `errors` liste celles en échec"""
+        with self._cond:
+            states = {key: dict(state) for key, state in self._state.items()}
+            required = list(self._required)
+        for state in states.values():
+            if 'version' in state:
+                del state['version']
+        done = [key for key in required if states.get(key, {}).get('state') in ('ready', 'error')]
+        return {
+            'ready': self._worker_pid == os.getpid() and len(done) == len(required),
+            'errors': [key for key in required if states.get(key, {}).get('state') == 'error'],
+            'started_at': self.started_at,
+            'items': {os.path.basename(key): state for key, state in states.items()},
+        }
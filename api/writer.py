@@ -0,0 +1,147 @@
+"""
+Écriture groupée des sauvegardes (group commit)
+Un thread unique regroupe les sauvegardes en attente, les écrit en un seul lot
+sous verrou consultatif inter-processus, puis acquitte chaque requête une fois
+le lot rendu durable.
+"""
+import os
+import queue
+import threading
+import time
+from typing import List, Dict, Any, Callable, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class FileLock:
+    """Verrou consultatif exclusif sur un fichier .lock (fcntl ou msvcrt)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = None
+        self._thread_lock = threading.Lock()  # flock ne protège pas entre threads d'un même processus
+
+    def acquire(self) -> None:
+        self._thread_lock.acquire()
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            else:
+                while True:
+                    try:
+                        msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        continue  # LK_LOCK abandonne après ~10 s : on réessaie
+            self._fd = fd
+        except Exception:
+            self._thread_lock.release()
+            raise
+
+    def release(self) -> None:
+        fd, self._fd = self._fd, None
+        try:
+            if fd is not None:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                else:
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+                os.close(fd)
+        finally:
+            self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class PendingSave:
+    """Sauvegarde soumise au writer, acquittée quand son lot est durable"""
+    __slots__ = ('records', 'done', 'error')
+
+    def __init__(self, records: List[Dict[str, Any]]):
+        self.records = records
+        self.done = threading.Event()
+        self.error: Optional[BaseException] = None
+
+    def wait(self, timeout: Optional[float] = None) -> None:
+        if not self.done.wait(timeout):
+            raise TimeoutError("Sauvegarde non acquittée dans le délai imparti")
+        if self.error is not None:
+            raise self.error
+
+
+class GroupCommitWriter:
+    def __init__(self, commit: Callable[[List[Dict[str, Any]]], None],
+                 max_latency_ms: float = 10, max_batch: int = 1000):
+        self.commit = commit                  # Écrit un lot complet (appelé depuis le thread writer)
+        self.max_latency = max_latency_ms / 1000.0
+        self.max_batch = max_batch            # Nombre maximal d'enregistrements par lot
+        self._queue: "queue.Queue[Optional[PendingSave]]" = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='group-commit-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, records: List[Dict[str, Any]]) -> PendingSave:
+        self.start()
+        pending = PendingSave(records)
+        self._queue.put(pending)
+        return pending
+
+    def close(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+    def _collect(self, first: PendingSave) -> Tuple[List[PendingSave], bool]:
+        """Regrouper les sauvegardes arrivées pendant la fenêtre de latence"""
+        batch = [first]
+        size = len(first.records)
+        deadline = time.monotonic() + self.max_latency
+        while size < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                return batch, True
+            batch.append(item)
+            size += len(item.records)
+        return batch, False
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            first = self._queue.get()
+            if first is None:
+                break
+            batch, stop = self._collect(first)
+            records = [r for pending in batch for r in pending.records]
+            error = None
+            try:
+                self.commit(records)
+            except BaseException as e:
+                error = e
+            for pending in batch:
+                pending.error = error
+                pending.done.set()
@@ -2,27 +2,118 @@
 Auto Annotator v1.1 - Backend Flask modulaire
 Interface moderne pour annotation de négations et portées
 """
-from flask import Flask, jsonify, request, render_template, send_from_directory
+from flask import Flask, jsonify, request, render_template, send_file, send_from_directory, session
+import argparse
 import os
 import glob
+import secrets
+import time
 
 # Import des modules métier
-from api.annotations import AnnotationManager
 from api.storage import StorageManager
+from api.bulk import BulkSaver
+from api.http_cache import (ResponseCache, buffer_response, file_version, json_array_chunks, ndjson_chunks,
+                            stream_response)
+from api.corpus_index import source_etag
+from api.corpus_manager import CorpusManager
+from api.search import QuerySyntaxError
+from api.rulebase import Rulebase
+from api.jobs import JobManager
+from api.metrics import instrument, metrics_response
+from api.validation import validate_batch
+from api.warmup import Warmup
+from prompts.evaluate import evaluate_files
+from prompts.compressed_io import jsonl_patterns, open_binary
+from prompts.metrics import REGISTRY
 
 # Configuration
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 DATA_DIR = os.path.join(BASE_DIR, 'data')
 DEFAULT_DATA_FILE = os.path.join(DATA_DIR, 'annotations_scope_added.jsonl')
 VALIDATED_DIR = os.path.join(BASE_DIR, 'data', 'validated')
+CACHE_DIR = os.path.join(DATA_DIR, '.cache')  # Index mmap partagés entre workers
+METRICS_DIR = os.path.join(CACHE_DIR, 'metrics')  # Métriques publiées par chaque worker (mode production)
+STORAGE_BACKEND = os.environ.get('AUTO_ANNOTATOR_STORAGE', 'jsonl')  # 'jsonl' ou 'sqlite'
+SAVE_MAX_LATENCY_MS = float(os.environ.get('AUTO_ANNOTATOR_SAVE_LATENCY_MS', '10'))  # Fenêtre du group commit
+# Annotations validées compressées (backend jsonl) : 'gzip', 'zstd'... et niveau optionnel
+STORAGE_COMPRESSION = os.environ.get('AUTO_ANNOTATOR_COMPRESSION') or None
+STORAGE_COMPRESS_LEVEL = int(os.environ['AUTO_ANNOTATOR_COMPRESS_LEVEL']) if os.environ.get('AUTO_ANNOTATOR_COMPRESS_LEVEL') else None
+RULES_DIR = os.environ.get('AUTO_ANNOTATOR_RULES_DIR') or os.path.join(BASE_DIR, 'rules')
+RULES_POLL_MS = float(os.environ.get('AUTO_ANNOTATOR_RULES_POLL_MS', '50'))  # Surveillance de rules/ (0 : désactivée)
+RULE_TIMEOUT_MS = float(os.environ.get('AUTO_ANNOTATOR_RULE_TIMEOUT_MS', '200'))  # Budget de matching par règle et phrase
+DETECT_THREADS = int(os.environ.get('AUTO_ANNOTATOR_DETECT_THREADS', '1'))  # Threads de détection par lot (regex hors GIL)
+ANNOTATE_MAX_TEXTS = 1000
+JOBS_DIR = os.path.join(DATA_DIR, 'jobs')  # Entrées et état des travaux d'annotation en masse
+JOB_WORKERS = int(os.environ.get('AUTO_ANNOTATOR_JOB_WORKERS', '1'))  # Travaux exécutés en parallèle par processus
+JOB_CHUNK_SIZE = int(os.environ.get('AUTO_ANNOTATOR_JOB_CHUNK', '500'))  # Phrases par lot (granularité progression/annulation)
+CORPUS_BUDGET_MB = float(os.environ.get('AUTO_ANNOTATOR_CORPUS_BUDGET_MB', '512'))  # Corpus résidents par worker
 
 # Initialisation Flask
 app = Flask(__name__, static_folder='static', static_url_path='/static', template_folder='templates')
+# Le fichier sélectionné est stocké dans la session (cookie signé) : la clé doit être
+# commune à tous les workers (variable d'environnement, ou générée avant le fork)
+app.secret_key = os.environ.get('AUTO_ANNOTATOR_SECRET_KEY') or secrets.token_hex(32)
+# Latence, codes de retour et tailles des corps par route (exposés sur /api/metrics)
+instrument(app)
 
-# Initialisation des managers
-current_data_file = DEFAULT_DATA_FILE
-annotation_manager = AnnotationManager(current_data_file)
-storage_manager = StorageManager(VALIDATED_DIR)
+# Corpus résidents (manager, index mmap et index de recherche par fichier), partagés par toutes
+# les sessions du worker et libérés du moins récemment utilisé au-delà du budget mémoire
+corpus_manager = CorpusManager(CACHE_DIR, int(CORPUS_BUDGET_MB * 2**20))
+storage_manager = StorageManager(VALIDATED_DIR, backend=STORAGE_BACKEND, max_latency_ms=SAVE_MAX_LATENCY_MS,
+                                 compression=STORAGE_COMPRESSION, compress_level=STORAGE_COMPRESS_LEVEL)
+# Lots de différences envoyés par la file de sauvegarde du navigateur (un commit par lot)
+bulk_saver = BulkSaver(storage_manager)
+# Corps JSON sérialisés/compressés par version des données (ETag + 304)
+response_cache = ResponseCache()
+# Règles compilées une fois par processus, rechargées à chaud quand rules/ change
+rulebase = Rulebase(RULES_DIR, poll_interval=RULES_POLL_MS / 1000, default_timeout_ms=RULE_TIMEOUT_MS or None,
+                    detect_threads=DETECT_THREADS)
+REGISTRY.gauge('annotator_response_cache_requests', 'Corps JSON servis depuis le cache (hit) ou reconstruits (miss)',
+               lambda: {('hit',): response_cache.hits, ('miss',): response_cache.misses}, ['result'])
+REGISTRY.gauge('annotator_response_cache_hit_ratio', 'Part des corps JSON servis depuis le cache',
+               lambda: response_cache.hit_ratio())
+REGISTRY.gauge('annotator_rules_version', 'Version de la base de règles chargée',
+               lambda: rulebase.info()['version'] or 0)
+REGISTRY.gauge('annotator_corpus_resident_bytes', 'Mémoire mesurée des corpus résidents',
+               lambda: corpus_manager.resident_bytes())
+REGISTRY.gauge('annotator_corpus_requests', 'Accès aux corpus déjà résidents (hit) ou à charger (miss)',
+               lambda: {('hit',): corpus_manager.hits, ('miss',): corpus_manager.misses}, ['result'])
+REGISTRY.gauge('annotator_corpus_evictions', 'Corpus libérés pour respecter le budget mémoire',
+               lambda: corpus_manager.evictions)
+# Annotation de corpus entiers en arrière-plan (résultats publiés dans data/)
+job_manager = JobManager(JOBS_DIR, DATA_DIR, rulebase, max_workers=JOB_WORKERS, chunk_size=JOB_CHUNK_SIZE)
+
+# Index du fichier par défaut et des derniers fichiers utilisés construits en arrière-plan
+warmup = Warmup(corpus_manager.open_index,
+                os.path.join(CACHE_DIR, 'recent_files.json'))
+
+
+def start_warmup():
+    """Préchauffage de ce processus (une fois par worker, sans effet ensuite)"""
+    REGISTRY.start_publishing()
+    warmup.start(DEFAULT_DATA_FILE, (('rules', rulebase.snapshot),))
+
+
+@app.before_request
+def _ensure_warmup():
+    start_warmup()
+
+
+def resolve_data_file(filename):
+    """Chemin d'un fichier de données, limité au dossier data/"""
+    if not filename or os.path.basename(filename) != filename:
+        return None
+    return os.path.join(DATA_DIR, filename)
+
+
+def get_annotation_manager(data_file=None):
+    """Manager du fichier demandé, ou du fichier sélectionné par la session courante"""
+    return corpus_manager.manager(data_file or current_data_file())
+
+
+def current_data_file():
+    """Fichier sélectionné par la session courante (fichier par défaut sinon)"""
+    return resolve_data_file(session.get('data_file')) or DEFAULT_DATA_FILE
 
 
 @app.route('/')
@@ -35,87 +126,274 @@ def index():
 def api_files():
     """API: Lister tous les fichiers JSONL disponibles"""
     try:
-        # Chercher tous les fichiers .jsonl dans le dossier data
-        pattern = os.path.join(DATA_DIR, '*.jsonl')
-        jsonl_files = glob.glob(pattern)
-        
-        files_info = []
-        for file_path in jsonl_files:
-            filename = os.path.basename(file_path)
-            # Obtenir la taille du fichier et le nombre de lignes
-            try:
-                line_count = 0
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    for _ in f:
-                        line_count += 1
-                
-                file_size = os.path.getsize(file_path)
-                
-                files_info.append({
-                    'filename': filename,
-                    'path': file_path,
-                    'size': file_size,
-                    'line_count': line_count,
-                    'is_current': file_path == annotation_manager.data_file
-                })
-            except Exception as e:
-                print(f"Erreur lors de la lecture de {file_path}: {e}")
-                continue
-        
-        # Trier par nom de fichier
-        files_info.sort(key=lambda x: x['filename'])
-        
-        return jsonify(files_info)
+        # Chercher tous les fichiers .jsonl (et .jsonl.gz, .jsonl.zst...) dans le dossier data
+        jsonl_files = sorted({path for pattern in jsonl_patterns()
+                              for path in glob.glob(os.path.join(DATA_DIR, pattern))})
+        # La liste ne change que si un fichier est ajouté, modifié ou sélectionné
+        current_file = current_data_file()
+        version = (file_version(*jsonl_files), current_file)
+        return response_cache.json_response('files', version, lambda: _list_files_info(jsonl_files, current_file))
     except Exception as e:
         print(f"Erreur lors de la liste des fichiers: {e}")
         return jsonify([])
 
 
+def _list_files_info(jsonl_files, current_file):
+    """Taille et nombre de lignes de chaque fichier JSONL"""
+    files_info = []
+    for file_path in jsonl_files:
+        filename = os.path.basename(file_path)
+        # Obtenir la taille du fichier et le nombre de lignes
+        try:
+            line_count = 0
+            with open_binary(file_path) as f:  # Décompressé à la volée si besoin
+                for _ in f:
+                    line_count += 1
+            
+            file_size = os.path.getsize(file_path)
+            
+            files_info.append({
+                'filename': filename,
+                'path': file_path,
+                'size': file_size,
+                'line_count': line_count,
+                'is_current': file_path == current_file
+            })
+        except Exception as e:
+            print(f"Erreur lors de la lecture de {file_path}: {e}")
+            continue
+    
+    # Trier par nom de fichier
+    files_info.sort(key=lambda x: x['filename'])
+    return files_info
+
+
 @app.route('/api/switch-file', methods=['POST'])
 def api_switch_file():
-    """API: Changer le fichier de données actuel"""
-    global annotation_manager
-    
+    """API: Changer le fichier de données de la session courante"""
     data = request.get_json()
     if not data or 'filename' not in data:
         return jsonify({'status': 'error', 'message': 'Nom de fichier requis'}), 400
     
     filename = data['filename']
-    new_file_path = os.path.join(DATA_DIR, filename)
+    new_file_path = resolve_data_file(filename)
     
     # Vérifier que le fichier existe
-    if not os.path.exists(new_file_path):
+    if not new_file_path or not os.path.exists(new_file_path):
         return jsonify({'status': 'error', 'message': 'Fichier non trouvé'}), 404
     
-    # Créer un nouveau manager avec le nouveau fichier
-    annotation_manager = AnnotationManager(new_file_path)
-    
-    # Charger les annotations du nouveau fichier
-    annotations = annotation_manager.load_annotations()
+    # Indexer le nouveau fichier (réutilise l'index partagé s'il est à jour)
+    index = corpus_manager.open_index(new_file_path)  # Immédiat si le fichier est encore résident
+    session['data_file'] = filename
+    warmup.touch(new_file_path)  # Préchauffé au prochain démarrage
     
     return jsonify({
         'status': 'success',
         'message': f'Fichier changé vers {filename}',
         'current_file': filename,
-        'annotation_count': len(annotations)
+        'annotation_count': len(index)
     })
 
 
+@app.route('/api/prefetch', methods=['POST'])
+def api_prefetch():
+    """API: Construire en arrière-plan l'index d'un fichier sélectionné avant le changement effectif"""
+    data = request.get_json(silent=True) or {}
+    path = resolve_data_file(data.get('filename'))
+    if not path or not os.path.exists(path):
+        return jsonify({'status': 'error', 'message': 'Fichier non trouvé'}), 404
+    return jsonify({'status': 'success', 'filename': data['filename'], **warmup.prefetch(path)}), 202
+
+
+@app.route('/api/health')
+def api_health():
+    """API: Disponibilité du worker (503 tant que les règles et le fichier par défaut ne sont pas prêts)"""
+    status = warmup.status()
+    status['pid'] = os.getpid()
+    status['corpora'] = corpus_manager.info()
+    status['status'] = ('degraded' if status['errors'] else 'ready') if status['ready'] else 'warming'
+    return jsonify(status), 200 if status['ready'] else 503
+
+
 @app.route('/api/annotations')
 def api_annotations():
-    """API: Récupérer toutes les annotations"""
-    annotations = annotation_manager.load_annotations()
-    return jsonify(annotations)
+    """API: Récupérer toutes les annotations (tableau JSON, ou NDJSON avec ?format=ndjson)"""
+    ndjson = request.args.get('format') == 'ndjson'
+    manager = get_annotation_manager()
+    index = corpus_manager.cached_index(manager.data_file)
+    if index is None:
+        # Index pas encore construit : documents lus et envoyés au fil de l'eau pendant que
+        # l'index est construit en arrière-plan pour les requêtes suivantes
+        if not os.path.exists(manager.data_file):
+            return jsonify([])
+        warmup.prefetch(manager.data_file)
+        docs = manager.iter_serialized()
+        etag = source_etag(manager.data_file)
+    elif ndjson:
+        docs = (bytes(index.raw(i)) for i in range(len(index)))
+        etag = index.etag
+    else:
+        # Tableau JSON servi directement depuis l'index mmap (gzip précalculé)
+        return buffer_response(index.etag, index.json_array(), index.gzip_array())
+    if ndjson:
+        return stream_response(etag + '-ndjson', ndjson_chunks(docs), 'application/x-ndjson')
+    return stream_response(etag, json_array_chunks(docs))
 
 
 @app.route('/api/stats')
 def api_stats():
     """API: Statistiques des annotations"""
-    annotations = annotation_manager.load_annotations()
-    stats = annotation_manager.get_annotation_stats(annotations)
+    index = corpus_manager.open_index(current_data_file())
+    version = (index.etag, storage_manager.version())
+    return response_cache.json_response('stats', version, lambda: _build_stats(index))
+
+
+def _build_stats(index):
+    stats = index.stats  # Calculées une fois à la construction de l'index
     stats['validated_count'] = storage_manager.get_validated_count()
     stats['recent_backups'] = storage_manager.get_recent_backups()
-    return jsonify(stats)
+    return stats
+
+
+@app.route('/api/search')
+def api_search():
+    """API: Recherche booléenne (règles, groupes, labels, texte) sur le fichier courant"""
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'status': 'error', 'message': 'Paramètre q requis'}), 400
+    try:
+        offset = max(0, int(request.args.get('offset', 0)))
+        limit = min(500, max(1, int(request.args.get('limit', 50))))
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'offset/limit invalides'}), 400
+
+    try:
+        return jsonify(corpus_manager.search(current_data_file(), query, offset, limit))
+    except QuerySyntaxError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+
+@app.route('/api/evaluate')
+def api_evaluate():
+    """API: Comparer les annotations automatiques (fichier courant ou ?auto=) aux annotations validées"""
+    manager = get_annotation_manager()
+    auto = request.args.get('auto')
+    if auto:
+        auto_file = resolve_data_file(auto)
+        if auto_file is None or not os.path.exists(auto_file):
+            return jsonify({'status': 'error', 'message': f'Fichier inconnu: {auto}'}), 404
+        manager = get_annotation_manager(auto_file)
+
+    def build():
+        # Même normalisation que l'interface (positions des portées) côté automatique
+        return evaluate_files(manager.data_file, storage_manager.iter_validated(),
+                              prepare=manager.prepare_annotation, use_cache=True)
+
+    try:
+        version = (file_version(manager.data_file), storage_manager.version())
+        return response_cache.json_response(f'evaluate:{manager.data_file}', version, build)
+    except Exception as e:
+        print(f"Erreur évaluation: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+
+@app.route('/api/annotate', methods=['POST'])
+def api_annotate():
+    """API: Annoter une phrase ({"text": ..., "id": ...}) ou une liste ({"texts": [...]}) avec les règles courantes"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'status': 'error', 'message': 'JSON invalide'}), 400
+    texts = data.get('texts')
+    if texts is None and isinstance(data.get('text'), str):
+        texts = [data['text']]
+    if not isinstance(texts, list) or not texts or not all(isinstance(t, str) for t in texts):
+        return jsonify({'status': 'error', 'message': 'Champ text (chaîne) ou texts (liste de chaînes) requis'}), 400
+    if len(texts) > ANNOTATE_MAX_TEXTS:
+        return jsonify({'status': 'error', 'message': f'Au plus {ANNOTATE_MAX_TEXTS} phrases par requête'}), 413
+
+    started = time.perf_counter()
+    try:
+        snapshot, results = rulebase.annotate(texts)
+    except Exception as e:
+        print(f"Erreur annotation: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+    if 'texts' not in data and 'id' in data:
+        results[0]['id'] = data['id']
+    return jsonify({
+        'status': 'success',
+        'rules_version': snapshot.version,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 2),
+        'annotations': results,
+    })
+
+
+@app.route('/api/rulebase')
+def api_rulebase():
+    """API: État de la base de règles chargée (version, dernier rechargement, erreur éventuelle)"""
+    rulebase.snapshot()
+    return jsonify(rulebase.info())
+
+
+@app.route('/api/jobs', methods=['POST'])
+def api_jobs_create():
+    """API: Lancer l'annotation d'un corpus (fichier multipart `file`, ou corps brut avec ?filename=)"""
+    upload = request.files.get('file')
+    if upload is not None:
+        filename, stream = upload.filename, upload.stream
+    elif request.content_length:
+        filename, stream = request.args.get('filename', 'corpus.txt'), request.stream
+    else:
+        return jsonify({'status': 'error', 'message': 'Fichier requis (champ file ou corps de la requête)'}), 400
+    try:
+        job = job_manager.submit(filename, stream)
+    except Exception as e:
+        print(f"Erreur création du travail: {e}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+    return jsonify({'status': 'success', 'job': job}), 202
+
+
+@app.route('/api/jobs')
+def api_jobs_list():
+    """API: Lister les travaux (plus récents d'abord)"""
+    job_manager.start()
+    return jsonify([job_manager.status(job) for job in job_manager.list()])
+
+
+@app.route('/api/jobs/<job_id>')
+def api_job_status(job_id):
+    """API: Progression d'un travail (phrases traitées, débit, ETA)"""
+    job_manager.start()
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Travail inconnu'}), 404
+    return jsonify(job_manager.status(job))
+
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def api_job_cancel(job_id):
+    """API: Annuler un travail en attente ou en cours"""
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Travail inconnu'}), 404
+    return jsonify(job)
+
+
+@app.route('/api/jobs/<job_id>/result')
+def api_job_result(job_id):
+    """API: Télécharger le JSONL annoté d'un travail terminé (envoyé par blocs)"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Travail inconnu'}), 404
+    if job['state'] != 'done' or not os.path.exists(job['output']):
+        return jsonify({'status': 'error', 'message': f"Résultat indisponible (état: {job['state']})"}), 409
+    return send_file(job['output'], mimetype='application/x-ndjson', as_attachment=True,
+                     download_name=os.path.basename(job['output']))
+
+
+@app.route('/api/metrics')
+def api_metrics():
+    """API: Métriques (de tous les workers en production) au format texte Prometheus"""
+    return metrics_response()
 
 
 @app.route('/Simed.png')
@@ -134,16 +412,16 @@ def api_save():
     # Normaliser en liste
     annotations = data if isinstance(data, list) else [data]
     
-    # Valider les annotations
-    valid_annotations = []
-    for ann in annotations:
-        if annotation_manager.validate_annotation(ann):
-            valid_annotations.append(ann)
-        else:
-            print(f"Annotation invalide ignorée: {ann.get('id', 'unknown')}")
+    # Valider les annotations (bornes, positions/texte, chevauchements ; tout le lot d'un coup)
+    reports = validate_batch(annotations, strict=request.args.get('strict') == '1')
+    valid_annotations = [ann for ann, report in zip(annotations, reports) if report['valid']]
+    rejected = [report for report in reports if not report['valid']]
+    warnings = [report for report in reports if report['valid'] and report['warnings']]
+    for report in rejected:
+        print(f"Annotation invalide ignorée: {report['id']} ({report['errors'][0]['message']})")
     
     if not valid_annotations:
-        return jsonify({'status': 'error', 'message': 'Aucune annotation valide'}), 400
+        return jsonify({'status': 'error', 'message': 'Aucune annotation valide', 'rejected': rejected}), 400
     
     # Sauvegarder
     success = storage_manager.save_annotations(valid_annotations)
@@ -152,11 +430,71 @@ def api_save():
         return jsonify({
             'status': 'success',
             'saved_count': len(valid_annotations),
-            'total_validated': storage_manager.get_validated_count()
+            'total_validated': storage_manager.get_validated_count(),
+            'rejected': rejected,
+            'warnings': warnings
         })
     else:
         return jsonify({'status': 'error', 'message': 'Erreur de sauvegarde'}), 500
 
 
+@app.route('/api/save/bulk', methods=['POST'])
+def api_save_bulk():
+    """API: Sauvegarder un lot de différences (champs modifiés seulement) en un seul commit"""
+    data = request.get_json(silent=True)
+    if data is None:
+        return jsonify({'status': 'error', 'message': 'JSON invalide'}), 400
+
+    # Documents d'origine : fichier indiqué par le lot (il peut précéder un changement de fichier)
+    data_file = resolve_data_file(data.get('file')) if isinstance(data, dict) and data.get('file') else current_data_file()
+    if not data_file or not os.path.exists(data_file):
+        return jsonify({'status': 'error', 'message': 'Fichier non trouvé'}), 404
+    index = corpus_manager.open_index(data_file)
+
+    try:
+        body, status = bulk_saver.apply(data, index.find, strict=request.args.get('strict') == '1')
+    finally:
+        corpus_manager.account(data_file)  # Table des ids éventuellement construite par index.find
+    return jsonify(body), status
+
+
+def serve_production(host, port, workers):
+    """Servir avec plusieurs processus workers (gunicorn, application préchargée)"""
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise SystemExit("Le mode production nécessite gunicorn (pip install gunicorn)")
+
+    rulebase.reload()  # Règles compilées une fois, héritées par les workers (pas de surveillance dans le maître)
+    REGISTRY.share(METRICS_DIR)  # /api/metrics agrège tous les workers, quel que soit celui qui répond
+    # Les index sont construits après le fork, en arrière-plan dans chaque worker (un seul
+    # construit sous verrou, les autres l'ouvrent en mmap) : le serveur répond tout de suite
+    # et /api/health indique quand il est prêt
+
+    class ProductionServer(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'{host}:{port}')
+            self.cfg.set('workers', workers)
+            self.cfg.set('preload_app', True)  # Clé de session et index partagés par tous les workers
+            self.cfg.set('post_worker_init', lambda worker: start_warmup())
+            self.cfg.set('worker_exit', lambda server, worker: REGISTRY.publish())  # Derniers compteurs du worker
+
+        def load(self):
+            return app
+
+    ProductionServer().run()
+
+
 if __name__ == '__main__':
-    app.run(debug=True, host='127.0.0.1', port=5000)
+    ap = argparse.ArgumentParser(description="Auto Annotator - serveur web")
+    ap.add_argument('--production', action='store_true', help="Plusieurs workers, sans debug")
+    ap.add_argument('--workers', type=int, default=4)
+    ap.add_argument('--host', default='127.0.0.1')
+    ap.add_argument('--port', type=int, default=5000)
+    args = ap.parse_args()
+
+    if args.production:
+        serve_production(args.host, args.port, args.workers)
+    else:
+        start_warmup()
+        app.run(debug=True, host=args.host, port=args.port)
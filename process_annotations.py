@@ -13,11 +13,15 @@ rules = {
     "locution": "rules/20_scopes/locutions.yaml",
 }
 
+def cue_end(cue):
+    # Cues du runner : `positions` [[début, fin], ...] ; anciens fichiers : `end`
+    return cue["positions"][-1][1] if cue.get("positions") else cue["end"]
+
 # Fonction pour appliquer les règles
 # (Simplifiée pour cet exemple, à compléter selon les règles YAML)
 def apply_rules(annotation, rules):
     scopes = []
-    for cue in annotation["cues"]:
+    for i, cue in enumerate(annotation["cues"]):
         group = cue["group"]
         rule_file = rules.get(group)
         if rule_file:
@@ -25,19 +29,20 @@ def apply_rules(annotation, rules):
             scope = {
                 "id": "RULE_APPLIED",
                 "scope_label": annotation["text"],
-                "start": cue["end"],
+                "start": cue_end(cue),
                 "end": len(annotation["text"]),
                 "group": group,
             }
             scopes.append(scope)
         else:
-            # Portée de secours
+            # Portée de secours (résolue ensuite par python -m prompts.llm_fallback)
             scopes.append({
                 "id": "LLM_FALLBACK_SCOPE",
                 "scope_label": annotation["text"],
-                "start": cue["end"],
+                "start": cue_end(cue),
                 "end": len(annotation["text"]),
                 "group": group,
+                "cue_index": i,
             })
     return scopes
 
@@ -0,0 +1,180 @@
+"""Banc d'essai des modes d'exécution du détecteur sur un même corpus.
+
+Modes comparés, par lots de `--batch-size` phrases comme le runner :
+    single       annotate_batch dans le thread courant
+    threads:N    annotate_threaded : pool de N threads, matching regex hors GIL
+                 (concurrent=True), une seule base de règles en mémoire
+    processes:N  ProcessPoolExecutor de N processus : base de règles héritée par
+                 fork (rechargée sinon), textes et résultats sérialisés (pickle)
+Pour chaque mode : durée totale (dont démarrage du pool), phrases/s, accélération
+par rapport à `single`, mémoire résidente totale (processus courant + processus de
+travail, lue dans /proc) et identité des sorties avec `single`.
+Le gain des threads dépend de la part du matching dans le temps total (la
+construction des cues reste sous GIL) et du nombre de cœurs disponibles.
+
+Usage:
+    python -m prompts.bench --rules rules --input corpus.txt [--threads 2,4] [--processes 2,4]
+                            [--repeat 3] [--json bench.json]
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .detector import annotate_batch, annotate_threaded
+from .loaders import load_markers
+from .runner import to_record
+from .shards import ShardReader
+
+log = logging.getLogger("prompts.bench")
+
+_worker_markers: Optional[Dict[str, List[Dict[str, Any]]]] = None  # Base de règles d'un processus de travail
+
+
+def rss_kb(pid: Optional[int] = None) -> Optional[int]:
+    """Mémoire résidente d'un processus (Ko), None hors Linux"""
+    try:
+        with open(f"/proc/{pid or 'self'}/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def _init_worker(rules_dir: str, default_timeout_ms: Optional[float]) -> None:
+    global _worker_markers
+    if _worker_markers is None:  # Déjà hérité par fork
+        _worker_markers = load_markers(Path(rules_dir), default_timeout_ms)
+
+
+def _process_chunk(texts: List[str], first_sid: int) -> Tuple[int, Optional[int], List[Dict[str, Any]]]:
+    records = [to_record(obj) for obj in annotate_batch(texts, first_sid, _worker_markers)]
+    return os.getpid(), rss_kb(), records
+
+
+def _chunks(texts: List[str], size: int):
+    for start in range(0, len(texts), size):
+        yield start, texts[start:start + size]
+
+
+def run_single(texts: List[str], markers_by_group, batch_size: int) -> Dict[str, Any]:
+    records = []
+    for start, chunk in _chunks(texts, batch_size):
+        records.extend(to_record(obj) for obj in annotate_batch(chunk, start + 1, markers_by_group))
+    return {"records": records, "startup_seconds": 0.0, "rss_kb": rss_kb()}
+
+
+def run_threads(texts: List[str], markers_by_group, batch_size: int, threads: int) -> Dict[str, Any]:
+    records = []
+    for start, chunk in _chunks(texts, batch_size):
+        records.extend(to_record(obj) for obj in annotate_threaded(chunk, start + 1, markers_by_group, threads))
+    return {"records": records, "startup_seconds": 0.0, "rss_kb": rss_kb()}
+
+
+def run_processes(texts: List[str], markers_by_group, batch_size: int, processes: int,
+                  rules_dir: Path, default_timeout_ms: Optional[float]) -> Dict[str, Any]:
+    global _worker_markers
+    started = time.perf_counter()
+    _worker_markers = markers_by_group  # Hérité par les processus en fork, rechargé sinon
+    try:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                 initargs=(str(rules_dir), default_timeout_ms)) as pool:
+            # Démarrage mesuré à part : un premier lot vide par processus
+            list(pool.map(_process_chunk, [[]] * processes, [1] * processes))
+            startup = time.perf_counter() - started
+            futures = [pool.submit(_process_chunk, chunk, start + 1) for start, chunk in _chunks(texts, batch_size)]
+            records, workers_rss = [], {}
+            for future in futures:
+                pid, rss, chunk_records = future.result()
+                records.extend(chunk_records)
+                if rss is not None:
+                    workers_rss[pid] = max(rss, workers_rss.get(pid, 0))
+    finally:
+        _worker_markers = None
+    main_rss = rss_kb()
+    total = main_rss + sum(workers_rss.values()) if main_rss is not None else None
+    return {"records": records, "startup_seconds": startup, "rss_kb": total}
+
+
+def parse_counts(value: Optional[str]) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()] if value else []
+
+
+def run_bench(rules_dir: Path, texts: List[str], threads: List[int], processes: List[int],
+              batch_size: int = 1000, default_timeout_ms: Optional[float] = None) -> Dict[str, Any]:
+    """Exécuter chaque mode sur `texts` ; rapport JSON-sérialisable"""
+    markers_by_group = load_markers(rules_dir, default_timeout_ms)
+    modes = [("single", lambda: run_single(texts, markers_by_group, batch_size))]
+    modes += [(f"threads:{n}", lambda n=n: run_threads(texts, markers_by_group, batch_size, n)) for n in threads]
+    modes += [(f"processes:{n}", lambda n=n: run_processes(texts, markers_by_group, batch_size, n,
+                                                           rules_dir, default_timeout_ms))
+              for n in processes]
+
+    reference = None
+    results = []
+    for name, run in modes:
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        outcome = run()
+        seconds = time.perf_counter() - started
+        records = outcome.pop("records")
+        if reference is None:
+            reference = records
+        results.append({
+            "mode": name,
+            "seconds": round(seconds, 4),
+            "startup_seconds": round(outcome["startup_seconds"], 4),
+            "cpu_seconds": round(time.process_time() - cpu_started, 4),  # Processus courant seulement
+            "sentences_per_second": round(len(texts) / seconds, 1) if seconds else None,
+            "speedup": round(results[0]["seconds"] / seconds, 2) if results and seconds else 1.0,
+            "rss_mb": round(outcome["rss_kb"] / 1024, 1) if outcome["rss_kb"] is not None else None,
+            "identical": records == reference,
+        })
+        log.info("%-12s %8.2f s  %9.1f phrases/s  x%-5.2f  %s Mo%s", name, seconds,
+                 results[-1]["sentences_per_second"] or 0, results[-1]["speedup"],
+                 results[-1]["rss_mb"], "" if results[-1]["identical"] else "  SORTIE DIFFÉRENTE")
+    return {"sentences": len(texts), "batch_size": batch_size, "cpu_count": os.cpu_count(), "results": results}
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Comparer détection mono-thread, pool de threads et pool de processus")
+    ap.add_argument("--rules", required=True, help="Chemin dossier rules/")
+    ap.add_argument("--input", required=True, help="Fichier texte (1 phrase/ligne), éventuellement compressé")
+    ap.add_argument("--threads", default="2,4", help="Tailles de pool de threads, séparées par des virgules")
+    ap.add_argument("--processes", default="2,4", help="Tailles de pool de processus, séparées par des virgules")
+    ap.add_argument("--batch-size", type=int, default=1000, help="Phrases par lot (comme le runner)")
+    ap.add_argument("--limit", type=int, default=None, help="Nombre maximal de phrases lues")
+    ap.add_argument("--repeat", type=int, default=1, help="Répéter le corpus (petits corpus d'exemple)")
+    ap.add_argument("--timeout-ms", type=float, default=None, help="Budget de matching par règle et par phrase")
+    ap.add_argument("--json", help="Rapport JSON")
+    ap.add_argument("--log", default="INFO")
+    args = ap.parse_args()
+    logging.basicConfig(level=getattr(logging, args.log.upper(), logging.INFO), format="%(message)s")
+
+    texts = []
+    for _, text in ShardReader(args.input):
+        if args.limit is not None and len(texts) >= args.limit:
+            break
+        texts.append(text)
+    texts *= max(1, args.repeat)
+    log.info("%d phrases, lots de %d, %s CPU", len(texts), args.batch_size, os.cpu_count())
+    report = run_bench(Path(args.rules), texts, parse_counts(args.threads), parse_counts(args.processes),
+                       args.batch_size, args.timeout_ms)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    raise SystemExit(0 if all(r["identical"] for r in report["results"]) else 1)
+
+
+if __name__ == "__main__":
+    main()
+
+__all__ = ["run_bench", "run_single", "run_threads", "run_processes", "rss_kb"]
@@ -0,0 +1,502 @@
+"""Cache colonnaire binaire d'un corpus JSONL annoté (fichier `<corpus>.jsonl.cols` voisin).
+
+Un document n'est plus une ligne JSON à décoder mais une suite d'indices dans
+des colonnes typées, ouvertes par mmap :
+- textes dans un seul buffer UTF-8 + offsets ; ids et portées textuelles idem
+- cues et scopes : tableaux d'offsets par document, positions en int32 (N, 2)
+- id de règle, groupe et cue_label encodés par dictionnaire (table de chaînes)
+- ordre des clés de chaque dict conservé via des « layouts » partagés
+- toute valeur hors de ce schéma (type inattendu, champ inconnu) part dans un
+  petit JSON « extras » : la reconstruction est identique à la ligne d'origine
+
+L'ouverture ne lit que l'en-tête ; `corpus[i]` reconstruit un document à la
+demande, et les colonnes NumPy sont accessibles directement via `column()`.
+
+Format :
+    MAGIC (8 octets) | longueur de l'en-tête (uint64) | en-tête JSON
+    | sections alignées sur 8 octets (décrites dans l'en-tête)
+
+Usage:
+    python -m prompts.columnar data/annotations.jsonl data/validated/annotations_validated.jsonl
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .compressed_io import open_binary
+
+log = logging.getLogger("prompts.columnar")
+
+MAGIC = b"AACOL001"
+SUFFIX = ".cols"
+_PREFIX = struct.Struct("<8sQ")
+_FLUSH_ITEMS = 1 << 16
+_CHUNK_DOCS = 4096  # Documents reconstruits par lot lors d'un parcours complet
+
+# Sections : nom → type NumPy (les buffers d'octets sont en uint8)
+_SECTIONS = {
+    "doc_layout": "<i4", "doc_id_off": "<u8", "doc_text_off": "<u8", "doc_extra_off": "<u8",
+    "doc_cue_off": "<u8", "doc_scope_off": "<u8",
+    "cue_layout": "<i4", "cue_rule": "<i4", "cue_group": "<i4", "cue_label": "<i4",
+    "cue_pos_off": "<u8", "cue_extra_off": "<u8", "cue_pos": "<i4",
+    "scope_layout": "<i4", "scope_rule": "<i4", "scope_text_off": "<u8",
+    "scope_pos_off": "<u8", "scope_extra_off": "<u8", "scope_pos": "<i4",
+    "ids": "u1", "texts": "u1", "scope_texts": "u1",
+    "doc_extras": "u1", "cue_extras": "u1", "scope_extras": "u1",
+}
+_ARRAY_CODES = {"<i4": "i", "<u8": "Q"}
+
+
+def cache_path_for(source: str) -> str:
+    return source + SUFFIX
+
+
+def source_version(source: str) -> Dict[str, Any]:
+    st = os.stat(source)
+    return {"mtime_ns": st.st_mtime_ns, "size": st.st_size}
+
+
+def _positions(value: Any) -> Optional[List[Tuple[int, int]]]:
+    """Liste [[début, fin], ...] d'entiers, sinon None (valeur conservée dans extras)"""
+    if not isinstance(value, list):
+        return None
+    for p in value:
+        if not (isinstance(p, list) and len(p) == 2
+                and type(p[0]) is int and type(p[1]) is int
+                and -(1 << 31) <= p[0] < (1 << 31) and -(1 << 31) <= p[1] < (1 << 31)):
+            return None
+    return value
+
+
+class _Section:
+    """Colonne en cours d'écriture, déversée par blocs dans un fichier temporaire"""
+
+    def __init__(self, name: str, dtype: str, tmp_dir: str):
+        self.name = name
+        self.dtype = dtype
+        self.file = tempfile.TemporaryFile(dir=tmp_dir)
+        self.count = 0
+        self._pending = array(_ARRAY_CODES[dtype]) if dtype in _ARRAY_CODES else None
+
+    @property
+    def size(self) -> int:
+        """Nombre d'éléments écrits, y compris ceux encore en mémoire"""
+        return self.count + (len(self._pending) if self._pending is not None else 0)
+
+    def append(self, value: int) -> None:
+        self._pending.append(value)
+        if len(self._pending) >= _FLUSH_ITEMS:
+            self.flush()
+
+    def extend(self, values) -> None:
+        self._pending.extend(values)
+        if len(self._pending) >= _FLUSH_ITEMS:
+            self.flush()
+
+    def write_bytes(self, data: bytes) -> int:
+        """Ajoute des octets (sections buffer) ; renvoie l'offset de fin"""
+        self.file.write(data)
+        self.count += len(data)
+        return self.count
+
+    def flush(self) -> None:
+        if self._pending:
+            if self._pending.itemsize > 1 and struct.pack("=H", 1) != struct.pack("<H", 1):
+                self._pending.byteswap()  # Format fichier little-endian
+            self.file.write(self._pending.tobytes())
+            self.count += len(self._pending)
+            self._pending = array(self._pending.typecode)
+
+
+class _Builder:
+    def __init__(self, tmp_dir: str):
+        self.sections = {name: _Section(name, dtype, tmp_dir) for name, dtype in _SECTIONS.items()}
+        self.strings: List[str] = []
+        self._string_codes: Dict[str, int] = {}
+        self.layouts: Dict[str, List[List[str]]] = {"doc": [], "cue": [], "scope": []}
+        self._layout_codes: Dict[Tuple[str, Tuple[str, ...]], int] = {}
+        self.documents = self.cues = self.scopes = 0
+        s = self.sections
+        for name in ("doc_id_off", "doc_text_off", "doc_extra_off", "doc_cue_off", "doc_scope_off",
+                     "cue_pos_off", "cue_extra_off", "scope_text_off", "scope_pos_off", "scope_extra_off"):
+            s[name].append(0)
+
+    def _string(self, value: str) -> int:
+        code = self._string_codes.get(value)
+        if code is None:
+            code = self._string_codes[value] = len(self.strings)
+            self.strings.append(value)
+        return code
+
+    def _layout(self, kind: str, keys: Tuple[str, ...]) -> int:
+        code = self._layout_codes.get((kind, keys))
+        if code is None:
+            code = self._layout_codes[(kind, keys)] = len(self.layouts[kind])
+            self.layouts[kind].append(list(keys))
+        return code
+
+    def _extras(self, kind: str, extras: Dict[str, Any]) -> None:
+        s = self.sections
+        buffer = s[f"{kind}_extras"]
+        if extras:
+            buffer.write_bytes(json.dumps(extras, ensure_ascii=False).encode("utf-8"))
+        s[f"{kind}_extra_off"].append(buffer.count)
+
+    def add(self, doc: Dict[str, Any]) -> None:
+        s = self.sections
+        extras: Dict[str, Any] = {}
+        s["doc_layout"].append(self._layout("doc", tuple(doc)))
+        text_end = s["texts"].count
+        cues = scopes = None
+        for key, value in doc.items():
+            if key == "text" and type(value) is str:
+                text_end = s["texts"].write_bytes(value.encode("utf-8"))
+            elif key == "cues" and isinstance(value, list) and all(isinstance(c, dict) for c in value):
+                cues = value
+            elif key == "scopes" and isinstance(value, list) and all(isinstance(c, dict) for c in value):
+                scopes = value
+            elif key != "id":
+                extras[key] = value
+        s["doc_id_off"].append(s["ids"].write_bytes(json.dumps(doc.get("id"), ensure_ascii=False).encode("utf-8")))
+        s["doc_text_off"].append(text_end)
+        for cue in cues or ():
+            self._add_cue(cue)
+        for scope in scopes or ():
+            self._add_scope(scope)
+        s["doc_cue_off"].append(self.cues)
+        s["doc_scope_off"].append(self.scopes)
+        self._extras("doc", extras)
+        self.documents += 1
+
+    def _add_cue(self, cue: Dict[str, Any]) -> None:
+        s = self.sections
+        extras: Dict[str, Any] = {}
+        codes = {"id": -1, "group": -1, "cue_label": -1}
+        positions = None
+        for key, value in cue.items():
+            if key in codes and type(value) is str:
+                codes[key] = self._string(value)
+            elif key == "positions" and _positions(value) is not None:
+                positions = value
+            else:
+                extras[key] = value
+        s["cue_layout"].append(self._layout("cue", tuple(cue)))
+        s["cue_rule"].append(codes["id"])
+        s["cue_group"].append(codes["group"])
+        s["cue_label"].append(codes["cue_label"])
+        for start, end in positions or ():
+            s["cue_pos"].extend((start, end))
+        s["cue_pos_off"].append(s["cue_pos"].size // 2)
+        self._extras("cue", extras)
+        self.cues += 1
+
+    def _add_scope(self, scope: Dict[str, Any]) -> None:
+        s = self.sections
+        extras: Dict[str, Any] = {}
+        rule = -1
+        text_end = s["scope_texts"].count
+        positions = None
+        for key, value in scope.items():
+            if key == "id" and type(value) is str:
+                rule = self._string(value)
+            elif key == "scope" and type(value) is str:
+                text_end = s["scope_texts"].write_bytes(value.encode("utf-8"))
+            elif key == "positions" and _positions(value) is not None:
+                positions = value
+            else:
+                extras[key] = value
+        s["scope_layout"].append(self._layout("scope", tuple(scope)))
+        s["scope_rule"].append(rule)
+        s["scope_text_off"].append(text_end)
+        for start, end in positions or ():
+            s["scope_pos"].extend((start, end))
+        s["scope_pos_off"].append(s["scope_pos"].size // 2)
+        self._extras("scope", extras)
+        self.scopes += 1
+
+    def write(self, out_path: str, version: Dict[str, Any]) -> None:
+        for section in self.sections.values():
+            if section._pending is not None:
+                section.flush()
+        header: Dict[str, Any] = {
+            "version": version, "documents": self.documents, "cues": self.cues, "scopes": self.scopes,
+            "strings": self.strings, "layouts": self.layouts, "sections": {},
+        }
+        # Les bornes des sections dépendent de la taille de l'en-tête : itérer jusqu'à stabilité
+        data_start = 0
+        while True:
+            position = data_start
+            for name, section in self.sections.items():
+                header["sections"][name] = [position, section.count]
+                position += section.count * np.dtype(section.dtype).itemsize
+                position += (-position) % 8
+            header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+            needed = _PREFIX.size + len(header_bytes)
+            needed += (-needed) % 8
+            if needed <= data_start:
+                break
+            data_start = needed
+
+        with open(out_path, "wb") as out:
+            out.write(_PREFIX.pack(MAGIC, len(header_bytes)))
+            out.write(header_bytes)
+            out.write(b" " * (data_start - _PREFIX.size - len(header_bytes)))
+            for name, section in self.sections.items():
+                offset = header["sections"][name][0]
+                out.write(b"\0" * (offset - out.tell()))
+                section.file.seek(0)
+                while True:
+                    chunk = section.file.read(1 << 20)
+                    if not chunk:
+                        break
+                    out.write(chunk)
+                section.file.close()
+
+
+def build_columnar(source: str, out_path: Optional[str] = None) -> str:
+    """Construire le cache colonnaire d'un JSONL (écriture atomique)"""
+    out_path = out_path or cache_path_for(source)
+    version = source_version(source)
+    out_dir = os.path.dirname(os.path.abspath(out_path))
+    builder = _Builder(out_dir)
+    with open_binary(source) as f:  # .jsonl.gz, .jsonl.zst... décompressés à la volée
+        for line_num, raw in enumerate(f, 1):
+            if not raw.strip():
+                continue
+            try:
+                doc = json.loads(raw)
+            except json.JSONDecodeError as e:
+                log.warning("%s:%d ignorée (%s)", source, line_num, e)
+                continue
+            if isinstance(doc, dict):
+                builder.add(doc)
+    tmp_path = f"{out_path}.{os.getpid()}.tmp"
+    try:
+        builder.write(tmp_path, version)
+        os.replace(tmp_path, out_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    log.info("Cache colonnaire %s : %d documents, %d cues, %d scopes",
+             out_path, builder.documents, builder.cues, builder.scopes)
+    return out_path
+
+
+class ColumnarCorpus:
+    """Vue mmap d'un cache colonnaire ; documents reconstruits à la demande"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # Fichier vide
+            self._file.close()
+            raise
+        magic, header_len = _PREFIX.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"Cache colonnaire invalide: {path}")
+        self.header = json.loads(self._mm[_PREFIX.size:_PREFIX.size + header_len])
+        self.strings: List[Optional[str]] = self.header["strings"]
+        self.layouts = {kind: [tuple(keys) for keys in layouts] for kind, layouts in self.header["layouts"].items()}
+        self._columns: Dict[str, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return self.header["documents"]
+
+    def is_fresh(self, source: str) -> bool:
+        try:
+            return source_version(source) == self.header["version"]
+        except OSError:
+            return False
+
+    def column(self, name: str) -> np.ndarray:
+        """Colonne brute (vue NumPy sur le mmap, sans copie)"""
+        col = self._columns.get(name)
+        if col is None:
+            offset, count = self.header["sections"][name]
+            col = np.frombuffer(self._mm, dtype=_SECTIONS[name], count=count, offset=offset)
+            if name in ("cue_pos", "scope_pos"):
+                col = col.reshape(-1, 2)
+            self._columns[name] = col
+        return col
+
+    def _slice(self, buffer: str, start: int, end: int) -> bytes:
+        base = self.header["sections"][buffer][0]
+        return self._mm[base + start:base + end]
+
+    def doc_id(self, i: int) -> Any:
+        off = self.column("doc_id_off")
+        return json.loads(self._slice("ids", int(off[i]), int(off[i + 1])))
+
+    def text(self, i: int) -> str:
+        off = self.column("doc_text_off")
+        return self._slice("texts", int(off[i]), int(off[i + 1])).decode("utf-8")
+
+    def cue_range(self, i: int) -> Tuple[int, int]:
+        off = self.column("doc_cue_off")
+        return int(off[i]), int(off[i + 1])
+
+    def scope_range(self, i: int) -> Tuple[int, int]:
+        off = self.column("doc_scope_off")
+        return int(off[i]), int(off[i + 1])
+
+    def _records(self, kind: str, lo: int, hi: int) -> List[Dict[str, Any]]:
+        """Cues ou scopes [lo, hi) : chaque colonne est convertie une fois pour toute la plage"""
+        col = self.column
+        strings = self.strings
+        layouts = self.layouts[kind]
+        layout = col(f"{kind}_layout")[lo:hi].tolist()
+        extra_off = col(f"{kind}_extra_off")[lo:hi + 1].tolist()
+        extras_raw = self._slice(f"{kind}_extras", extra_off[0], extra_off[-1])
+        pos_off = col(f"{kind}_pos_off")[lo:hi + 1].tolist()
+        positions = col(f"{kind}_pos")[pos_off[0]:pos_off[-1]].tolist()
+        if kind == "cue":
+            codes = {"id": col("cue_rule")[lo:hi].tolist(), "group": col("cue_group")[lo:hi].tolist(),
+                     "cue_label": col("cue_label")[lo:hi].tolist()}
+        else:
+            codes = {"id": col("scope_rule")[lo:hi].tolist()}
+            text_off = col("scope_text_off")[lo:hi + 1].tolist()
+            texts_raw = self._slice("scope_texts", text_off[0], text_off[-1])
+        records = []
+        for j in range(hi - lo):
+            e0, e1 = extra_off[j] - extra_off[0], extra_off[j + 1] - extra_off[0]
+            extras = json.loads(extras_raw[e0:e1]) if e1 > e0 else None
+            record: Dict[str, Any] = {}
+            for key in layouts[layout[j]]:
+                if extras and key in extras:
+                    record[key] = extras[key]
+                elif key == "positions":
+                    record[key] = positions[pos_off[j] - pos_off[0]:pos_off[j + 1] - pos_off[0]]
+                elif key == "scope":
+                    record[key] = texts_raw[text_off[j] - text_off[0]:text_off[j + 1] - text_off[0]].decode("utf-8")
+                else:
+                    record[key] = strings[codes[key][j]]
+            records.append(record)
+        return records
+
+    def cue(self, k: int) -> Dict[str, Any]:
+        return self._records("cue", k, k + 1)[0]
+
+    def scope(self, k: int) -> Dict[str, Any]:
+        return self._records("scope", k, k + 1)[0]
+
+    def documents(self, lo: int, hi: int) -> List[Dict[str, Any]]:
+        """Documents [lo, hi), reconstruits dans la forme exacte de leur ligne JSONL"""
+        hi = min(hi, len(self))
+        if lo >= hi:
+            return []
+        col = self.column
+        layouts = self.layouts["doc"]
+        layout = col("doc_layout")[lo:hi].tolist()
+        id_off = col("doc_id_off")[lo:hi + 1].tolist()
+        ids_raw = self._slice("ids", id_off[0], id_off[-1])
+        text_off = col("doc_text_off")[lo:hi + 1].tolist()
+        texts_raw = self._slice("texts", text_off[0], text_off[-1])
+        extra_off = col("doc_extra_off")[lo:hi + 1].tolist()
+        extras_raw = self._slice("doc_extras", extra_off[0], extra_off[-1])
+        cue_off = col("doc_cue_off")[lo:hi + 1].tolist()
+        cues = self._records("cue", cue_off[0], cue_off[-1])
+        scope_off = col("doc_scope_off")[lo:hi + 1].tolist()
+        scopes = self._records("scope", scope_off[0], scope_off[-1])
+        docs = []
+        for j in range(hi - lo):
+            e0, e1 = extra_off[j] - extra_off[0], extra_off[j + 1] - extra_off[0]
+            extras = json.loads(extras_raw[e0:e1]) if e1 > e0 else None
+            doc: Dict[str, Any] = {}
+            for key in layouts[layout[j]]:
+                if extras and key in extras:
+                    doc[key] = extras[key]
+                elif key == "id":
+                    doc[key] = json.loads(ids_raw[id_off[j] - id_off[0]:id_off[j + 1] - id_off[0]])
+                elif key == "text":
+                    doc[key] = texts_raw[text_off[j] - text_off[0]:text_off[j + 1] - text_off[0]].decode("utf-8")
+                elif key == "cues":
+                    doc[key] = cues[cue_off[j] - cue_off[0]:cue_off[j + 1] - cue_off[0]]
+                else:
+                    doc[key] = scopes[scope_off[j] - scope_off[0]:scope_off[j + 1] - scope_off[0]]
+            docs.append(doc)
+        return docs
+
+    def __getitem__(self, i: int) -> Dict[str, Any]:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.documents(i, i + 1)[0]
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for lo in range(0, len(self), _CHUNK_DOCS):
+            yield from self.documents(lo, lo + _CHUNK_DOCS)
+
+    def id_index(self) -> Dict[str, int]:
+        """str(id) → position de la dernière occurrence (jointures par id)"""
+        off = self.column("doc_id_off").tolist()
+        ids = self._slice("ids", 0, off[-1])
+        return {str(json.loads(ids[off[i]:off[i + 1]])): i for i in range(len(self))}
+
+    def close(self) -> None:
+        self._columns.clear()
+        try:
+            self._mm.close()
+        except BufferError:
+            pass  # Colonnes encore référencées par l'appelant : le mmap sera libéré avec elles
+        self._file.close()
+
+
+def open_columnar(source: str, build: bool = True) -> Optional[ColumnarCorpus]:
+    """Cache colonnaire à jour d'un JSONL ; (re)construit si absent ou périmé.
+
+    Renvoie None si le cache n'est pas disponible (pas de build demandé, dossier
+    en lecture seule...) : l'appelant retombe alors sur la lecture JSONL.
+    """
+    path = cache_path_for(source)
+    try:
+        corpus = ColumnarCorpus(path)
+        if corpus.is_fresh(source):
+            return corpus
+        corpus.close()
+    except (OSError, ValueError, KeyError, struct.error):
+        pass
+    if not build or not os.path.exists(source):
+        return None
+    try:
+        build_columnar(source, path)
+        return ColumnarCorpus(path)
+    except OSError as e:
+        log.warning("Cache colonnaire indisponible pour %s: %s", source, e)
+        return None
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Construire le cache colonnaire de fichiers JSONL")
+    ap.add_argument("inputs", nargs="+", help="Fichiers JSONL")
+    ap.add_argument("--force", action="store_true", help="Reconstruire même si le cache est à jour")
+    ap.add_argument("--log", default="INFO")
+    args = ap.parse_args()
+    logging.basicConfig(level=getattr(logging, args.log.upper(), logging.INFO))
+    for source in args.inputs:
+        if args.force:
+            build_columnar(source)
+        else:
+            corpus = open_columnar(source)
+            if corpus is not None:
+                log.info("%s : %d documents", corpus.path, len(corpus))
+                corpus.close()
+
+
+if __name__ == "__main__":
+    main()
+
+__all__ = ["ColumnarCorpus", "build_columnar", "open_columnar", "cache_path_for"]
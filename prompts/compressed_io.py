@@ -0,0 +1,260 @@
+"""Lecture/écriture transparente de JSONL compressés (.jsonl.gz, .jsonl.zst, ...).
+
+Le codec est détecté par les octets magiques à la lecture (l'extension peut
+mentir) et par l'extension à l'écriture. gzip, bz2 et xz sont dans la
+bibliothèque standard ; zstd est utilisé si `compression.zstd` (Python 3.14+)
+ou le paquet `zstandard` est installé.
+
+Les flux compressés restent « seekables » en lecture (reprise depuis le début
+pour un retour en arrière) : les index par offset (recherche, évaluation)
+fonctionnent sur les positions du flux décompressé.
+"""
+
+from __future__ import annotations
+import bz2
+import gzip
+import io
+import lzma
+import os
+from typing import IO, Dict, List, Optional, Tuple
+
+try:  # Python 3.14+
+    from compression import zstd as _zstd_std  # type: ignore
+except ImportError:
+    _zstd_std = None
+try:
+    import zstandard as _zstandard  # type: ignore
+except ImportError:
+    _zstandard = None
+
+# Codec → (extension, octets magiques, niveau par défaut)
+CODECS: Dict[str, Tuple[str, bytes, int]] = {
+    "gzip": (".gz", b"\x1f\x8b", 6),
+    "bz2": (".bz2", b"BZh", 9),
+    "xz": (".xz", b"\xfd7zXZ\x00", 6),
+    "zstd": (".zst", b"\x28\xb5\x2f\xfd", 3),
+}
+
+
+def available_codecs() -> List[str]:
+    return [name for name in CODECS if name != "zstd" or _zstd_std is not None or _zstandard is not None]
+
+
+def codec_from_name(path: str) -> Optional[str]:
+    """Codec indiqué par l'extension (None pour un fichier texte)"""
+    lower = path.lower()
+    for name, (ext, _, _) in CODECS.items():
+        if lower.endswith(ext):
+            return name
+    return None
+
+
+def detect_codec(path: str) -> Optional[str]:
+    """Codec d'un fichier existant d'après ses octets magiques, sinon d'après son extension"""
+    try:
+        with open(path, "rb") as f:
+            head = f.read(6)
+    except OSError:
+        return codec_from_name(path)
+    if not head:
+        return codec_from_name(path)
+    for name, (_, magic, _) in CODECS.items():
+        if head.startswith(magic):
+            return name
+    return None
+
+
+def is_jsonl(filename: str) -> bool:
+    """`x.jsonl` ou `x.jsonl.<ext>` pour un codec disponible"""
+    lower = filename.lower()
+    if lower.endswith(".jsonl"):
+        return True
+    codec = codec_from_name(lower)
+    return codec in available_codecs() and lower[:-len(CODECS[codec][0])].endswith(".jsonl")
+
+
+def jsonl_patterns() -> List[str]:
+    """Motifs glob des JSONL lisibles ici"""
+    return ["*.jsonl"] + [f"*.jsonl{CODECS[name][0]}" for name in available_codecs()]
+
+
+def _require(codec: str) -> None:
+    if codec not in CODECS:
+        raise ValueError(f"Codec inconnu: {codec} (attendu: {', '.join(CODECS)})")
+    if codec not in available_codecs():
+        raise RuntimeError(f"Codec {codec} indisponible (installer le paquet 'zstandard')")
+
+
+def _level(codec: str, level: Optional[int]) -> int:
+    return CODECS[codec][2] if level is None else int(level)
+
+
+def wrap_reader(raw: IO[bytes], codec: str) -> IO[bytes]:
+    """Décompresser un fichier binaire déjà ouvert à partir de sa position courante.
+
+    Tous les codecs acceptent plusieurs trames concaténées : un fichier écrit
+    par ajouts successifs (un membre par lot) se relit d'un seul tenant.
+    """
+    _require(codec)
+    if codec == "gzip":
+        return gzip.GzipFile(fileobj=raw, mode="rb")
+    if codec == "bz2":
+        return bz2.BZ2File(raw, "rb")
+    if codec == "xz":
+        return lzma.LZMAFile(raw, "rb")
+    if _zstd_std is not None:
+        return _zstd_std.ZstdFile(raw, "rb")
+    return io.BufferedReader(_zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=False))
+
+
+def wrap_writer(raw: IO[bytes], codec: str, level: Optional[int] = None) -> IO[bytes]:
+    """Compresser vers un fichier binaire ouvert ; fermer le flux retourné ne ferme pas `raw`"""
+    _require(codec)
+    level = _level(codec, level)
+    if codec == "gzip":
+        return gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=level, mtime=0)
+    if codec == "bz2":
+        return bz2.BZ2File(raw, "wb", compresslevel=level)
+    if codec == "xz":
+        return lzma.LZMAFile(raw, "wb", preset=level)
+    if _zstd_std is not None:
+        return _zstd_std.ZstdFile(raw, "wb", level=level)
+    return _zstandard.ZstdCompressor(level=level).stream_writer(raw, closefd=False)
+
+
+def compress_bytes(data: bytes, codec: str, level: Optional[int] = None) -> bytes:
+    """Une trame complète, à ajouter telle quelle en fin de fichier"""
+    buffer = io.BytesIO()
+    with wrap_writer(buffer, codec, level) as writer:
+        writer.write(data)
+    return buffer.getvalue()
+
+
+class _RestartableReader(io.RawIOBase):
+    """Flux décompressé seekable : avance en lisant, recule en rouvrant le fichier"""
+
+    def __init__(self, path: str, codec: str):
+        self._path = path
+        self._codec = codec
+        self._raw: Optional[IO[bytes]] = None
+        self._stream: Optional[IO[bytes]] = None
+        self._pos = 0
+        self._open()
+
+    def _open(self) -> None:
+        self._close_streams()
+        self._raw = open(self._path, "rb")
+        self._stream = wrap_reader(self._raw, self._codec)
+        self._pos = 0
+
+    def _close_streams(self) -> None:
+        if self._stream is not None:
+            self._stream.close()
+        if self._raw is not None:
+            self._raw.close()
+        self._stream = self._raw = None
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        data = self._stream.read(len(b))
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("seek depuis la fin d'un flux compressé")
+        if offset < self._pos:
+            self._open()
+        while self._pos < offset:
+            chunk = self._stream.read(min(offset - self._pos, 1 << 20))
+            if not chunk:
+                break
+            self._pos += len(chunk)
+        return self._pos
+
+    def close(self) -> None:
+        self._close_streams()
+        super().close()
+
+
+class _CompressedWriter(io.BufferedIOBase):
+    """Écriture compressée vers un chemin ; `fsync()` rend le contenu durable"""
+
+    def __init__(self, path: str, mode: str, codec: str, level: Optional[int]):
+        self._raw = open(path, mode)
+        self._stream = wrap_writer(self._raw, codec, level)
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        return self._stream.write(data)
+
+    def flush(self) -> None:
+        if not self.closed:
+            self._stream.flush()
+            self._raw.flush()
+
+    def fileno(self) -> int:
+        return self._raw.fileno()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        try:
+            super().close()  # flush()
+        finally:
+            try:
+                self._stream.close()  # Termine la trame compressée
+            finally:
+                self._raw.close()
+
+
+def open_binary(path: str, mode: str = "rb", level: Optional[int] = None,
+                codec: Optional[str] = "auto") -> IO[bytes]:
+    """`open()` binaire transparent ; en ajout ('ab'), chaque ouverture ajoute une trame"""
+    if codec == "auto":
+        codec = detect_codec(path) if "r" in mode else codec_from_name(path)
+    if codec is None:
+        return open(path, mode)
+    if "r" in mode:
+        _require(codec)
+        return io.BufferedReader(_RestartableReader(path, codec), buffer_size=1 << 16)
+    if mode not in ("wb", "ab", "xb"):
+        raise ValueError(f"Mode non supporté pour un fichier compressé: {mode}")
+    return _CompressedWriter(path, mode, codec, level)
+
+
+def open_text(path: str, mode: str = "r", level: Optional[int] = None,
+              encoding: str = "utf-8", codec: Optional[str] = "auto") -> IO[str]:
+    """`open()` texte transparent (UTF-8 par défaut)"""
+    if "b" in mode:
+        raise ValueError("open_text: mode texte attendu")
+    binary_mode = mode.replace("t", "") + "b"
+    resolved = codec
+    if codec == "auto":
+        resolved = detect_codec(path) if "r" in mode else codec_from_name(path)
+    if resolved is None:
+        return open(path, mode, encoding=encoding)
+    return io.TextIOWrapper(open_binary(path, binary_mode, level, resolved), encoding=encoding)
+
+
+def fsync(f: IO) -> None:
+    """Vider les tampons (texte, compression, fichier) puis fsync"""
+    f.flush()
+    os.fsync(f.fileno())
+
+
+__all__ = ["CODECS", "available_codecs", "codec_from_name", "detect_codec", "is_jsonl", "jsonl_patterns",
+           "wrap_reader", "wrap_writer", "compress_bytes", "open_binary", "open_text", "fsync"]
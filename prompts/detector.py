@@ -4,21 +4,52 @@ import logging
 import re
 from pathlib import Path
 from typing import Dict, List, Any, Tuple, Optional
-from .types import Token, Cue, Rule, Strategy
+from .types import Token, Cue, Rule, Strategy, CueRecord
 from .loaders import _iter_yaml_files, infer_group_from_filename, load_markers
 from .markers import _guard_hits, _extract_negation_markers_only, _find_cleaned_text_positions
 import regex as reg
+import numpy as np
 import os
+import threading
+import time
 import yaml
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from .debug_print import debug_print
+from .metrics import REGISTRY, COUNT_BUCKETS
+log = logging.getLogger("prompts.detector")
+
+SENTENCES = REGISTRY.counter("annotator_detector_sentences_total", "Phrases annotées")
+SECONDS = REGISTRY.counter("annotator_detector_seconds_total", "Temps passé à annoter (s)")
+CUES = REGISTRY.counter("annotator_detector_cues_total", "Cues produits par groupe", ["group"])
+RULE_TIMEOUTS = REGISTRY.counter("annotator_detector_rule_timeouts_total",
+                                 "Règles ignorées sur une phrase pour dépassement de budget", ["rule"])
+BATCH_SIZES = REGISTRY.histogram("annotator_detector_batch_sentences", "Phrases par appel d'annotation",
+                                 COUNT_BUCKETS)
 
 def _mk_cue(rule: Dict[str,Any], a:int,b:int, span:str) -> Dict[str,Any]:
     return {"id": rule.get("id","UNK_RULE"), "cue_label": span, "start": a, "end": b, "group": rule.get("group","unknown")}
 
 seen_starts = set()
 
-def apply_marker_rule(rule: Dict[str,Any], text: str, seen_intervals: List[Tuple[int, int]]) -> List[Dict[str,Any]]:
-    out: List[Dict[str,Any]] = []
+Candidate = Tuple[int, int, Optional[CueRecord]]  # (start, end, cue ou None si gardé)
+
+def _record_overrun(rule: Dict[str,Any], text: str, overruns: Optional[List[str]]) -> None:
+    """Budget de temps dépassé : compté sur la règle, signalé, et la règle est sautée pour ce texte"""
+    rule["_overruns"] = rule.get("_overruns", 0) + 1
+    log.warning("Règle %s : budget de %.0f ms dépassé sur un texte de %d caractères, règle ignorée",
+                rule.get("id", "UNK_RULE"), rule["_timeout"] * 1000, len(text))
+    if overruns is not None:
+        overruns.append(rule.get("id", "UNK_RULE"))
+
+def rule_candidates(rule: Dict[str,Any], text: str, overruns: Optional[List[str]] = None,
+                    concurrent: Optional[bool] = None) -> Optional[List[Candidate]]:
+    """Matches d'une règle seule, avant dédoublonnage entre règles : (start, end, cue ou None si gardé).
+
+    Ne dépend que de la règle et du texte (cache possible par empreinte de règle) ;
+    None si le budget de temps est dépassé. `concurrent` : matching hors GIL (module regex).
+    """
+    out: List[Candidate] = []
     if rule.get("action") or str(rule.get("id",""))[:2].upper() == "QC": # Ignorer certaines règles
         return out
     pat = rule.get("_compiled") # Récupère le motif regex précompilé (pattern original `when_pattern`, compilé dans load_markers avec reg.VERBOSE + options éventuelles).
@@ -31,21 +62,23 @@ def apply_marker_rule(rule: Dict[str,Any], text: str, seen_intervals: List[Tuple
     #   - la position de début (`match.start()`)
     #   - la position de fin (`match.end()`)
     # Type : Iterator[re.Match]
-    # liste intermédiaire pour stocker les intervalles des matches conservés
-# ensemble pour stocker les positions de début déjà vues
-    for m in pat.finditer(text):  # parcourt tout le texte et trouve chaque portion (mot, phrase, ou expression) qui correspond au motif regex compilé dans 'pat'
+    # Les matches sont collectés avant traitement : un dépassement du budget (`_timeout`) ne
+    # produit aucun cue partiel.
+    try:
+        matches = list(pat.finditer(text, concurrent=concurrent, timeout=rule.get("_timeout")))
+    except TimeoutError:
+        _record_overrun(rule, text, overruns)
+        return None
+    return _match_candidates(rule, text, matches)
+
+def _match_candidates(rule: Dict[str,Any], text: str, matches) -> List[Candidate]:
+    """Candidats d'une règle à partir de ses matches dans `text` (positions locales au texte)"""
+    out: List[Candidate] = []
+    for m in matches:  # parcourt tout le texte et trouve chaque portion (mot, phrase, ou expression) qui correspond au motif regex compilé dans 'pat'
         start, end = m.start(), m.end()
         # debug_print("Match avant filtrage :", m.group(0), "| Positions:", (start, end), "| Groupdict:", m.groupdict())
-        # ignorer si ce match chevauche un intervalle déjà vu
-        if any(start == s for s, e in seen_intervals):
-            # debug_print("Match ignoré (début identique à un match existant):", m.group(0), "| Positions:", (start, end))
-            continue
-
-        # sinon, on conserve ce match
-        seen_intervals.append((start, end))
-        # debug_print("Match unique conservé:", m.group(0), "| Positions:", (start, end), "| Groupdict:", m.groupdict())
-
         if _guard_hits(rule, text, m):
+            out.append((start, end, None))  # Le match occupe quand même sa position de début
             continue
         # Vérifier exclusion des verbes
         exclude_verbs = rule.get("options", {}).get("exclude_verbs_from_cue", False)
@@ -61,20 +94,221 @@ def apply_marker_rule(rule: Dict[str,Any], text: str, seen_intervals: List[Tuple
         else:
             label = _format_cue_label(rule.get("cue_label"), m)
         # Construire le cue avec positions découpées
-        cue = {
-            "id": rule.get("id", "UNK_RULE"),
-            "cue_label": label,
-            "positions": cleaned_positions,  # liste de tuples (start, end)
-            "group": rule.get("group", "unknown"),
-        }
-        out.append(cue)
+        cue = CueRecord(rule.get("id", "UNK_RULE"), rule.get("group", "unknown"), label,
+                        cleaned_positions)  # Converti en dict {id, cue_label, positions, group} à la sérialisation
+        out.append((start, end, cue))
+    return out
+
+def merge_candidates(candidates: List[Candidate],
+                     seen_intervals: List[Tuple[int, int]]) -> List[CueRecord]:
+    out: List[CueRecord] = []
+    for start, end, cue in candidates:
+        # ignorer si ce match commence à une position déjà vue (règle précédente)
+        if any(start == s for s, e in seen_intervals):
+            continue
+        # sinon, on conserve ce match
+        seen_intervals.append((start, end))
+        if cue is not None:
+            out.append(cue)
+    return out
+
+def apply_marker_rule(rule: Dict[str,Any], text: str, seen_intervals: List[Tuple[int, int]],
+                      overruns: Optional[List[str]] = None, concurrent: Optional[bool] = None) -> List[CueRecord]:
+    return merge_candidates(rule_candidates(rule, text, overruns, concurrent) or [], seen_intervals)
+
+# ----------------------------------------------------------------------
+# Mode lot : chaque règle tourne une fois sur les phrases concaténées
+# ----------------------------------------------------------------------
+BATCH_SEPARATOR = "\x00"  # Ni mot, ni espace : \b, \s, \w s'y comportent comme en bord de chaîne
+
+class _LocalMatch:
+    """Match du tampon concaténé vu avec les positions de sa phrase"""
+    __slots__ = ("_m", "_base")
+
+    def __init__(self, m, base: int):
+        self._m = m
+        self._base = base
+
+    def _shift(self, pos: int) -> int:
+        return pos - self._base if pos >= 0 else pos  # -1 : groupe non capturé
+
+    def start(self, group=0) -> int:
+        return self._shift(self._m.start(group))
+
+    def end(self, group=0) -> int:
+        return self._shift(self._m.end(group))
+
+    def span(self, group=0) -> Tuple[int, int]:
+        return self.start(group), self.end(group)
+
+    def group(self, *groups):
+        return self._m.group(*groups)
+
+    def groups(self, default=None):
+        return self._m.groups(default)
+
+    def groupdict(self, default=None):
+        return self._m.groupdict(default)
+
+    def __getitem__(self, group):
+        return self._m[group]
+
+def batch_rule_candidates(rule: Dict[str,Any], texts: List[str], starts: np.ndarray, ends: np.ndarray,
+                          buffer: str, overruns: Optional[List[List[str]]] = None,
+                          concurrent: Optional[bool] = None) -> List[Optional[List[Candidate]]]:
+    """`rule_candidates` pour chaque texte, avec un seul `finditer` sur le tampon concaténé.
+
+    Un match qui déborde sur le séparateur n'existerait pas phrase par phrase : les
+    phrases qu'il touche sont rejouées seules. Les règles à lookaround/ancre
+    (`_batchable` faux) et les dépassements de budget repassent phrase par phrase.
+    """
+    def one_by_one(indices) -> None:
+        for i in indices:
+            result[i] = rule_candidates(rule, texts[i], overruns[i] if overruns is not None else None, concurrent)
+
+    n = len(texts)
+    result: List[Optional[List[Candidate]]] = [[] for _ in range(n)]
+    if rule.get("action") or str(rule.get("id",""))[:2].upper() == "QC" or not rule.get("_compiled"):
+        return result
+    if not rule.get("_batchable"):
+        one_by_one(range(n))
+        return result
+    timeout = rule.get("_timeout")
+    try:
+        matches = list(rule["_compiled"].finditer(buffer, concurrent=concurrent, timeout=timeout * n if timeout else None))
+    except TimeoutError:
+        one_by_one(range(n))
+        return result
+    if not matches:
+        return result
+    m_start = np.fromiter((m.start() for m in matches), dtype=np.int64, count=len(matches))
+    m_end = np.fromiter((m.end() for m in matches), dtype=np.int64, count=len(matches))
+    sent = np.searchsorted(starts, m_start, side="right") - 1  # Phrase contenant le début du match
+    crossing = m_end > ends[sent]
+    redo = set()
+    for k in np.flatnonzero(crossing).tolist():
+        last = int(np.searchsorted(starts, m_end[k] - 1, side="right") - 1)
+        redo.update(range(int(sent[k]), last + 1))
+    # Regroupement des matches locaux par phrase (sent est croissant)
+    local = np.flatnonzero(~crossing)
+    bounds = np.flatnonzero(np.diff(sent[local])) + 1
+    for group in np.split(local, bounds):
+        if not len(group):
+            continue
+        i = int(sent[group[0]])
+        if i in redo:
+            continue
+        base = int(starts[i])
+        result[i] = _match_candidates(rule, texts[i], [_LocalMatch(matches[k], base) for k in group.tolist()])
+    one_by_one(sorted(redo))
+    return result
+
+def _record_metrics(results: List[Dict[str,Any]], elapsed: float) -> None:
+    """Compteurs du détecteur pour un appel (une prise de verrou par métrique)"""
+    SENTENCES.inc(len(results))
+    SECONDS.inc(elapsed)
+    BATCH_SIZES.observe(len(results))
+    groups = Counter(c["group"] for obj in results for c in obj["cues"])
+    if groups:
+        CUES.inc_many({(g,): n for g, n in groups.items()})
+    timeouts = Counter(rule_id for obj in results for rule_id in obj.get("rule_timeouts", ()))
+    if timeouts:
+        RULE_TIMEOUTS.inc_many({(r,): n for r, n in timeouts.items()})
+
+def annotate_batch(texts: List[str], first_sid: int, markers_by_group) -> List[Dict[str,Any]]:
+    """Équivalent de `annotate_sentence` sur chaque texte (seen_intervals propre à chaque phrase)"""
+    started = time.perf_counter()
+    out = _annotate_batch(texts, first_sid, markers_by_group)
+    _record_metrics(out, time.perf_counter() - started)
+    return out
+
+def _annotate_batch(texts: List[str], first_sid: int, markers_by_group,
+                    concurrent: Optional[bool] = None) -> List[Dict[str,Any]]:
+    n = len(texts)
+    overruns: List[List[str]] = [[] for _ in range(n)]
+    if any(BATCH_SEPARATOR in t for t in texts):
+        per_rule = None  # Le séparateur doit être absent des textes
+    else:
+        lengths = np.fromiter((len(t) for t in texts), dtype=np.int64, count=n)
+        starts = np.zeros(n, dtype=np.int64)
+        np.cumsum(lengths[:-1] + len(BATCH_SEPARATOR), out=starts[1:])
+        ends = starts + lengths
+        buffer = BATCH_SEPARATOR.join(texts)
+        per_rule = [batch_rule_candidates(r, texts, starts, ends, buffer, overruns, concurrent)
+                    for rules in markers_by_group.values() for r in rules]
+    out = []
+    for i, text in enumerate(texts):
+        if per_rule is None:
+            out.append(_annotate_sentence(text, first_sid + i, markers_by_group, [], concurrent))
+            continue
+        seen_intervals: List[Tuple[int, int]] = []
+        cues: List[CueRecord] = []
+        for candidates in per_rule:
+            cues.extend(merge_candidates(candidates[i] or [], seen_intervals))
+        obj = {"id": first_sid + i, "text": text, "pipeline_step": "STEP1_DETERMINISTIC", "cues": cues}
+        if overruns[i]:
+            obj["rule_timeouts"] = overruns[i]
+        out.append(obj)
+    return out
+
+# ----------------------------------------------------------------------
+# Mode pool de threads : le module regex relâche le GIL pendant le matching
+# (concurrent=True) et tous les threads partagent la base de règles compilée
+# ----------------------------------------------------------------------
+THREAD_MIN_CHUNK = 64  # Phrases par tâche au minimum : en deçà, la répartition coûte plus qu'elle ne rapporte
+
+_pool_lock = threading.Lock()
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_key: Tuple[int, int] = (0, 0)  # (pid, threads) : après un fork, le pool hérité n'a plus de threads
+
+def _thread_pool(threads: int) -> ThreadPoolExecutor:
+    """Pool partagé du processus, agrandi au besoin (jamais réduit)"""
+    global _pool, _pool_key
+    pid = os.getpid()
+    with _pool_lock:
+        if _pool is None or _pool_key[0] != pid or _pool_key[1] < threads:
+            # L'ancien pool n'est pas arrêté : un appelant qui l'a déjà obtenu peut encore y
+            # soumettre ses tranches. Ses threads s'arrêtent quand il n'est plus référencé.
+            _pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="detector")
+            _pool_key = (pid, threads)
+        return _pool
+
+def annotate_threaded(texts: List[str], first_sid: int, markers_by_group, threads: int = 1,
+                      min_chunk: int = THREAD_MIN_CHUNK) -> List[Dict[str,Any]]:
+    """`annotate_batch` réparti par tranches contiguës sur un pool de threads
+
+    Chaque tranche est annotée en mode lot avec concurrent=True : seul le matching des
+    motifs se fait hors GIL, la construction des cues reste sérialisée. Les règles
+    compilées ne sont ni copiées ni sérialisées, ce qui permet de l'utiliser dans le
+    serveur (pas de fork). Seul `_overruns` est écrit dans les règles (compteur
+    indicatif, incréments concurrents possibles).
+    """
+    started = time.perf_counter()
+    n = len(texts)
+    size = max(min_chunk, -(-n // (2 * threads)))  # ~2 tranches par thread pour équilibrer
+    if threads <= 1 or n <= size:
+        out = _annotate_batch(texts, first_sid, markers_by_group)
+    else:
+        pool = _thread_pool(threads)
+        futures = [pool.submit(_annotate_batch, texts[a:a + size], first_sid + a, markers_by_group, True)
+                   for a in range(0, n, size)]
+        out = [obj for future in futures for obj in future.result()]
+    _record_metrics(out, time.perf_counter() - started)
     return out
 
 def annotate_sentence(text: str, sid: int, markers_by_group, seen_intervals) -> Dict[str,Any]:
-    cues: List[Dict[str,Any]] = []
+    started = time.perf_counter()
+    obj = _annotate_sentence(text, sid, markers_by_group, seen_intervals)
+    _record_metrics([obj], time.perf_counter() - started)
+    return obj
+
+def _annotate_sentence(text: str, sid: int, markers_by_group, seen_intervals,
+                       concurrent: Optional[bool] = None) -> Dict[str,Any]:
+    cues: List[CueRecord] = []
+    overruns: List[str] = []  # Règles sautées pour dépassement de budget
     for g, rules in markers_by_group.items(): # Parcourt chaque groupe (g) par exemple "adversative", "determinant", etc. de marqueurs  et ses règles associées par exemple MAIS_RESTRICTIF # .items() retourne des paires (clé, valeur) : g = nom du groupe, rules = liste des règles associées
         for r in rules: #  ses règles associées par exemple MAIS_RESTRICTIF
-            cues.extend(apply_marker_rule(r, text, seen_intervals)) # Applique la règle `r` au texte et ajoute toutes les cues détectées à la liste `cues`
+            cues.extend(apply_marker_rule(r, text, seen_intervals, overruns, concurrent)) # Applique la règle `r` au texte et ajoute toutes les cues détectées à la liste `cues`
     groups_present = sorted({c["group"] for c in cues})
     obj = {
         "id": sid,
@@ -83,6 +317,9 @@ def annotate_sentence(text: str, sid: int, markers_by_group, seen_intervals) ->
         # "candidates_rules_ID_cues": build_candidates_rules_id_cues(groups_present, markers_by_group),
         "cues": cues
     }
+    if overruns:
+        obj["rule_timeouts"] = overruns  # Règles non appliquées : l'annotation de ce texte est incomplète
     return obj
 
-__all__ = ["load_markers","annotate_sentence","make_logger"]
+__all__ = ["load_markers","annotate_sentence","make_logger","rule_candidates","merge_candidates","annotate_batch",
+           "annotate_threaded"]
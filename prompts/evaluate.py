@@ -0,0 +1,437 @@
+"""Évaluation des annotations automatiques (STEP1) contre les annotations validées.
+
+Jointure par id en streaming : chaque fichier est d'abord indexé (id → offset,
+dernière occurrence pour le fichier validé), puis les documents sont relus par
+seek et comparés par lots. Les comparaisons d'intervalles sont vectorisées :
+chaque lot devient des tableaux NumPy (catégorie, document, début, fin) placés
+sur un axe global, et le recouvrement est calculé par searchsorted sur les
+débuts triés et un maximum cumulé des fins.
+
+Unités comparées :
+- cue   : enveloppe [premier début, dernière fin) de ses `positions`
+- scope : chaque intervalle de `positions` (une portée peut en avoir plusieurs)
+
+Usage:
+    python -m prompts.evaluate --auto data/annotations.jsonl \
+        --gold data/validated/annotations_validated.jsonl --output report.json
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import logging
+import re
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .columnar import ColumnarCorpus, open_columnar
+from .compressed_io import open_binary
+
+log = logging.getLogger("prompts.evaluate")
+
+# Axe global : (catégorie, document du lot) * _STRIDE + offset caractère
+_STRIDE = 1 << 32
+_LEADING_ID_RE = re.compile(rb'\{\s*"id"\s*:\s*("[^"\\]*"|-?\d+)\s*[,}]')
+BATCH_SIZE = 2048
+MAX_EXAMPLES = 200
+
+
+def _line_id(raw: bytes) -> Any:
+    """id d'une ligne JSONL ; évite le décodage complet quand l'id est la première clé"""
+    m = _LEADING_ID_RE.match(raw)
+    if m:
+        value = m.group(1)
+        return value[1:-1].decode("utf-8") if value[:1] == b'"' else value.decode("ascii")
+    try:
+        doc_id = json.loads(raw).get("id")
+    except (json.JSONDecodeError, AttributeError):
+        return None
+    return None if doc_id is None else _key(doc_id)
+
+
+def index_jsonl_ids(path: str) -> Dict[Any, int]:
+    """id → offset de la dernière ligne portant cet id"""
+    offsets: Dict[Any, int] = {}
+    with open_binary(path) as f:
+        position = 0
+        for raw in f:
+            if raw.strip():
+                doc_id = _line_id(raw)
+                if doc_id is not None:
+                    offsets[doc_id] = position
+            position += len(raw)
+    return offsets
+
+
+def _key(doc_id: Any) -> Any:
+    # Les ids peuvent être int ou str selon les fichiers : comparer leur forme texte
+    return str(doc_id)
+
+
+def iter_latest_jsonl(path: str) -> Iterator[Dict[str, Any]]:
+    """Dernière version de chaque document d'un JSONL en ajout seul, dans l'ordre du fichier"""
+    latest = set(index_jsonl_ids(path).values())
+    with open_binary(path) as f:
+        position = 0
+        for raw in f:
+            if position in latest:  # Lecture séquentielle : seules les lignes retenues sont décodées
+                yield json.loads(raw)
+            position += len(raw)
+
+
+def _overlap_match(p_block: np.ndarray, p_start: np.ndarray, p_end: np.ndarray,
+                   g_block: np.ndarray, g_start: np.ndarray, g_end: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Pour chaque prédiction : recouvre-t-elle un intervalle de référence du même bloc ?
+
+    Renvoie (masque de recouvrement, indice d'une référence recouverte ou -1).
+    """
+    if len(p_start) == 0 or len(g_start) == 0:
+        return np.zeros(len(p_start), dtype=bool), np.full(len(p_start), -1, dtype=np.int64)
+    gs = g_block * _STRIDE + g_start
+    ge = g_block * _STRIDE + g_end
+    order = np.argsort(gs, kind="stable")
+    gs, ge = gs[order], ge[order]
+    running_end = np.maximum.accumulate(ge)
+    # Indice (dans l'ordre trié) qui porte le maximum courant des fins
+    running_idx = np.maximum.accumulate(np.where(ge == running_end, np.arange(len(ge)), 0))
+    ps = p_block * _STRIDE + p_start
+    pe = p_block * _STRIDE + p_end
+    idx = np.searchsorted(gs, pe, side="left")  # Références qui commencent avant la fin
+    has = idx > 0
+    prev = np.maximum(idx - 1, 0)
+    matched = has & (running_end[prev] > ps)
+    partner = np.where(matched, order[running_idx[prev]], -1)
+    return matched, partner
+
+
+def _exact_match(p_block: np.ndarray, p_start: np.ndarray, p_end: np.ndarray,
+                 g_block: np.ndarray, g_start: np.ndarray, g_end: np.ndarray) -> np.ndarray:
+    """Pour chaque prédiction : existe-t-il une référence de même bloc et mêmes bornes ?"""
+    spans = np.concatenate([p_start * _STRIDE + p_end, g_start * _STRIDE + g_end])
+    # Rang des bornes plutôt que leur valeur : la clé (bloc, bornes) tient sur 64 bits
+    _, rank = np.unique(spans, return_inverse=True)
+    width = len(spans) + 1
+    p_key = p_block * width + rank[:len(p_start)]
+    g_key = g_block * width + rank[len(p_start):]
+    return np.isin(p_key, g_key)
+
+
+class _Scorer:
+    """Compteurs par catégorie pour un type d'unité et une façon de catégoriser"""
+
+    def __init__(self) -> None:
+        self.names: List[str] = []
+        self.codes: Dict[str, int] = {}
+        self.counts = np.zeros((0, 6), dtype=np.int64)  # pred, gold, exact_p, exact_g, overlap_p, overlap_g
+
+    def code(self, name: str) -> int:
+        code = self.codes.get(name)
+        if code is None:
+            code = self.codes[name] = len(self.names)
+            self.names.append(name)
+            self.counts = np.vstack([self.counts, np.zeros((1, 6), dtype=np.int64)])
+        return code
+
+    def update(self, p_cat: np.ndarray, g_cat: np.ndarray, flags: List[np.ndarray]) -> None:
+        n = len(self.names)
+        columns = [np.bincount(p_cat, minlength=n), np.bincount(g_cat, minlength=n)]
+        for mask, cat in zip(flags, (p_cat, g_cat, p_cat, g_cat)):
+            columns.append(np.bincount(cat[mask], minlength=n))
+        self.counts += np.stack(columns, axis=1)
+
+    def report(self) -> Dict[str, Any]:
+        per = {name: _metrics(self.counts[i]) for i, name in enumerate(self.names)}
+        return {"overall": _metrics(self.counts.sum(axis=0)), "by_category": per}
+
+
+def _prf(tp_pred: int, tp_gold: int, n_pred: int, n_gold: int) -> Dict[str, Any]:
+    precision = tp_pred / n_pred if n_pred else 0.0
+    recall = tp_gold / n_gold if n_gold else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"tp": int(tp_pred), "fp": int(n_pred - tp_pred), "fn": int(n_gold - tp_gold),
+            "precision": round(precision, 4), "recall": round(recall, 4), "f1": round(f1, 4)}
+
+
+def _metrics(row: np.ndarray) -> Dict[str, Any]:
+    n_pred, n_gold, ex_p, ex_g, ov_p, ov_g = (int(v) for v in row)
+    return {"predicted": n_pred, "gold": n_gold,
+            "exact": _prf(ex_p, ex_g, n_pred, n_gold), "overlap": _prf(ov_p, ov_g, n_pred, n_gold)}
+
+
+def _cue_envelope(cue: Dict[str, Any]) -> Optional[Tuple[int, int]]:
+    positions = cue.get("positions")
+    if positions:
+        try:
+            if len(positions) == 1:  # Cas courant : un seul intervalle
+                return int(positions[0][0]), int(positions[0][1])
+            return min(int(p[0]) for p in positions), max(int(p[1]) for p in positions)
+        except (TypeError, ValueError, IndexError):
+            return None
+    if cue.get("start") is not None and cue.get("end") is not None:  # Ancien format start/end
+        return int(cue["start"]), int(cue["end"])
+    return None
+
+
+def _scope_spans(scope: Dict[str, Any]) -> List[Tuple[int, int]]:
+    spans = []
+    for p in scope.get("positions") or []:
+        try:
+            spans.append((int(p[0]), int(p[1])))
+        except (TypeError, ValueError, IndexError):
+            continue
+    if not spans and scope.get("start") is not None and scope.get("end") is not None:
+        spans.append((int(scope["start"]), int(scope["end"])))
+    return spans
+
+
+class Evaluator:
+    """Accumule les compteurs lot par lot ; `report()` peut être appelé à tout moment"""
+
+    def __init__(self, batch_size: int = BATCH_SIZE, max_examples: int = MAX_EXAMPLES):
+        self.batch_size = batch_size
+        self.max_examples = max_examples
+        self.cues_by_group = _Scorer()
+        self.cues_by_rule = _Scorer()
+        self.scopes_by_rule = _Scorer()
+        self.group_confusion: Dict[str, Dict[str, int]] = {}
+        self.false_positives: List[Dict[str, Any]] = []
+        self.false_negatives: List[Dict[str, Any]] = []
+        self.documents = 0
+        self.missing_auto = 0
+        self.unpositioned = 0
+
+    # ------------------------------------------------------------------
+    def run(self, gold: Iterable[Dict[str, Any]], lookup_auto: Callable[[Any], Optional[Dict[str, Any]]],
+            prepare: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None) -> Dict[str, Any]:
+        pending: List[Dict[str, Any]] = []
+        for gold_doc in gold:
+            pending.append(gold_doc)
+            if len(pending) >= self.batch_size:
+                self._join(pending, lookup_auto, prepare)
+                pending = []
+        if pending:
+            self._join(pending, lookup_auto, prepare)
+        return self.report()
+
+    def _join(self, gold_docs: List[Dict[str, Any]], lookup_auto, prepare) -> None:
+        ids = [doc.get("id") for doc in gold_docs]
+        # Accès groupé si disponible (lectures dans l'ordre du fichier / plages contiguës)
+        many = getattr(lookup_auto, "many", None)
+        autos = many(ids) if many is not None else [lookup_auto(doc_id) for doc_id in ids]
+        batch = []
+        for auto_doc, gold_doc in zip(autos, gold_docs):
+            if auto_doc is None:
+                self.missing_auto += 1
+                continue
+            if prepare is not None:
+                auto_doc = prepare(auto_doc)
+            batch.append((auto_doc, gold_doc))
+        if batch:
+            self._process(batch)
+
+    def _collect(self, batch, side: int) -> Tuple[np.ndarray, List[Tuple[Any, str]], np.ndarray, List[Tuple[Any, str]]]:
+        """Tables (doc, groupe, règle, début, fin) des cues et (doc, règle, début, fin) des portées"""
+        group_code, rule_code, scope_code = self.cues_by_group.code, self.cues_by_rule.code, self.scopes_by_rule.code
+        cue_rows: List[Tuple[int, int, int, int, int]] = []
+        cue_refs: List[Tuple[Any, str]] = []  # (id du document, label) pour les exemples d'erreurs
+        scope_rows: List[Tuple[int, int, int, int]] = []
+        scope_refs: List[Tuple[Any, str]] = []
+        for doc_index, pair in enumerate(batch):
+            doc = pair[side]
+            doc_id = doc.get("id")
+            for cue in doc.get("cues") or ():
+                envelope = _cue_envelope(cue)
+                if envelope is None:
+                    self.unpositioned += 1
+                    continue
+                cue_rows.append((doc_index, group_code(str(cue.get("group", "unknown"))),
+                                 rule_code(str(cue.get("id", "UNK_RULE"))), envelope[0], envelope[1]))
+                cue_refs.append((doc_id, cue.get("cue_label", "")))
+            for scope in doc.get("scopes") or ():
+                spans = _scope_spans(scope)
+                if not spans:
+                    self.unpositioned += 1
+                    continue
+                cat = scope_code(str(scope.get("id", "UNK_RULE")))
+                for start, end in spans:
+                    scope_rows.append((doc_index, cat, start, end))
+                    scope_refs.append((doc_id, scope.get("scope", "")))
+        cues = np.array(cue_rows, dtype=np.int64).reshape(-1, 5)
+        scopes = np.array(scope_rows, dtype=np.int64).reshape(-1, 4)
+        return cues, cue_refs, scopes, scope_refs
+
+    def _process(self, batch) -> None:
+        self.documents += len(batch)
+        n_docs = len(batch)
+        p_cues, p_cue_refs, p_scopes, p_scope_refs = self._collect(batch, 0)
+        g_cues, g_cue_refs, g_scopes, g_scope_refs = self._collect(batch, 1)
+        # (scorer, colonnes doc/catégorie/début/fin prédites puis validées, références, type d'exemple)
+        units = (
+            (self.cues_by_group, p_cues[:, [0, 1, 3, 4]], g_cues[:, [0, 1, 3, 4]], p_cue_refs, g_cue_refs, "cue"),
+            (self.cues_by_rule, p_cues[:, [0, 2, 3, 4]], g_cues[:, [0, 2, 3, 4]], None, None, None),
+            (self.scopes_by_rule, p_scopes, g_scopes, p_scope_refs, g_scope_refs, "scope"),
+        )
+        for scorer, pred, gold, pred_refs, gold_refs, kind in units:
+            p_doc, p_cat, p_s, p_e = pred.T
+            g_doc, g_cat, g_s, g_e = gold.T
+            p_block, g_block = p_cat * n_docs + p_doc, g_cat * n_docs + g_doc
+            p_exact = _exact_match(p_block, p_s, p_e, g_block, g_s, g_e)
+            g_exact = _exact_match(g_block, g_s, g_e, p_block, p_s, p_e)
+            p_over, _ = _overlap_match(p_block, p_s, p_e, g_block, g_s, g_e)
+            g_over, _ = _overlap_match(g_block, g_s, g_e, p_block, p_s, p_e)
+            scorer.update(p_cat, g_cat, [p_exact, g_exact, p_over, g_over])
+            if scorer is self.cues_by_group:
+                self._confusion(p_doc, p_cat, p_s, p_e, g_doc, g_cat, g_s, g_e)
+            if kind:
+                self._examples(self.false_positives, pred, pred_refs, ~p_over, kind, scorer)
+                self._examples(self.false_negatives, gold, gold_refs, ~g_over, kind, scorer)
+
+    def _confusion(self, p_doc, p_cat, p_s, p_e, g_doc, g_cat, g_s, g_e) -> None:
+        """Groupe prédit × groupe validé pour les cues qui se recouvrent, tous groupes confondus"""
+        matched, partner = _overlap_match(p_doc, p_s, p_e, g_doc, g_s, g_e)
+        if not matched.any():
+            return
+        names = self.cues_by_group.names
+        pairs = np.stack([p_cat[matched], g_cat[partner[matched]]], axis=1)
+        uniq, counts = np.unique(pairs, axis=0, return_counts=True)
+        for (pc, gc), n in zip(uniq, counts):
+            row = self.group_confusion.setdefault(names[pc], {})
+            row[names[gc]] = row.get(names[gc], 0) + int(n)
+
+    def _examples(self, target: List[Dict[str, Any]], table: np.ndarray, refs: List[Tuple[Any, str]],
+                  mask: np.ndarray, kind: str, scorer: _Scorer) -> None:
+        room = self.max_examples - len(target)
+        if room <= 0:
+            return
+        for i in np.flatnonzero(mask)[:room]:
+            doc_id, label = refs[i]
+            _, cat, start, end = (int(v) for v in table[i])
+            target.append({"kind": kind, "id": doc_id, "category": scorer.names[cat],
+                           "label": label, "span": [start, end]})
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "documents": self.documents,
+            "missing_auto": self.missing_auto,
+            "unpositioned_units": self.unpositioned,
+            "cues": {
+                "by_group": self.cues_by_group.report(),
+                "by_rule": self.cues_by_rule.report(),
+                "group_confusion": self.group_confusion,
+            },
+            "scopes": {"by_rule": self.scopes_by_rule.report()},
+            "errors": {"false_positives": self.false_positives, "false_negatives": self.false_negatives},
+        }
+
+
+class JsonlLookup:
+    """Accès par id à un JSONL sans le charger : index id → offset puis seek"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offsets = index_jsonl_ids(path)
+        self._f = open_binary(path)
+
+    def __call__(self, doc_id: Any) -> Optional[Dict[str, Any]]:
+        offset = self.offsets.get(_key(doc_id))
+        if offset is None:
+            return None
+        self._f.seek(offset)
+        return json.loads(self._f.readline())
+
+    def many(self, doc_ids: List[Any]) -> List[Optional[Dict[str, Any]]]:
+        offsets = [self.offsets.get(_key(doc_id)) for doc_id in doc_ids]
+        docs: Dict[int, Dict[str, Any]] = {}
+        for offset in sorted({o for o in offsets if o is not None}):
+            self._f.seek(offset)
+            docs[offset] = json.loads(self._f.readline())
+        return [None if o is None else docs[o] for o in offsets]
+
+    def close(self) -> None:
+        self._f.close()
+
+
+class ColumnarLookup:
+    """Accès par id via le cache colonnaire (aucun décodage JSON des lignes)"""
+
+    def __init__(self, corpus: ColumnarCorpus):
+        self.corpus = corpus
+        self.positions = corpus.id_index()
+
+    def __call__(self, doc_id: Any) -> Optional[Dict[str, Any]]:
+        i = self.positions.get(_key(doc_id))
+        return None if i is None else self.corpus[i]
+
+    def many(self, doc_ids: List[Any], max_gap: int = 64) -> List[Optional[Dict[str, Any]]]:
+        """Reconstruit les documents par plages contiguës plutôt qu'un par un"""
+        positions = [self.positions.get(_key(doc_id)) for doc_id in doc_ids]
+        wanted = sorted({i for i in positions if i is not None})
+        docs: Dict[int, Dict[str, Any]] = {}
+        start = 0
+        while start < len(wanted):
+            end = start
+            while end + 1 < len(wanted) and wanted[end + 1] - wanted[end] <= max_gap:
+                end += 1
+            lo = wanted[start]
+            chunk = self.corpus.documents(lo, wanted[end] + 1)
+            for i in wanted[start:end + 1]:
+                docs[i] = chunk[i - lo]
+            start = end + 1
+        return [None if i is None else docs[i] for i in positions]
+
+    def close(self) -> None:
+        self.corpus.close()
+
+
+def iter_latest_columnar(corpus: ColumnarCorpus) -> Iterator[Dict[str, Any]]:
+    """Équivalent de iter_latest_jsonl sur un cache colonnaire"""
+    latest = set(corpus.id_index().values())
+    for i, doc in enumerate(corpus):
+        if i in latest:
+            yield doc
+
+
+def evaluate_files(auto_path: str, gold: Iterable[Dict[str, Any]],
+                   prepare: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+                   batch_size: int = BATCH_SIZE, use_cache: bool = False) -> Dict[str, Any]:
+    corpus = open_columnar(auto_path) if use_cache else None
+    lookup = ColumnarLookup(corpus) if corpus is not None else JsonlLookup(auto_path)
+    try:
+        return Evaluator(batch_size=batch_size).run(gold, lookup, prepare)
+    finally:
+        lookup.close()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Évaluation cues/scopes automatiques vs validés")
+    ap.add_argument("--auto", required=True, help="JSONL produit par prompts.runner (ou avec scopes)")
+    ap.add_argument("--gold", required=True, help="JSONL des annotations validées")
+    ap.add_argument("--output", help="Rapport JSON complet (sinon résumé seulement)")
+    ap.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    ap.add_argument("--no-cache", action="store_true", help="Lire les JSONL sans cache colonnaire (.cols)")
+    ap.add_argument("--log", default="INFO")
+    args = ap.parse_args()
+    logging.basicConfig(level=getattr(logging, args.log.upper(), logging.INFO))
+
+    gold_corpus = None if args.no_cache else open_columnar(args.gold)
+    gold = iter_latest_columnar(gold_corpus) if gold_corpus is not None else iter_latest_jsonl(args.gold)
+    try:
+        report = evaluate_files(args.auto, gold, batch_size=args.batch_size, use_cache=not args.no_cache)
+    finally:
+        if gold_corpus is not None:
+            gold_corpus.close()
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    for title, section in (("cues/groupe", report["cues"]["by_group"]), ("scopes/règle", report["scopes"]["by_rule"])):
+        overall = section["overall"]
+        log.info("%s — exact F1=%.4f overlap F1=%.4f (%d prédits, %d validés)", title,
+                 overall["exact"]["f1"], overall["overlap"]["f1"], overall["predicted"], overall["gold"])
+    log.info("%d documents joints, %d sans annotation automatique", report["documents"], report["missing_auto"])
+
+
+if __name__ == "__main__":
+    main()
+
+__all__ = ["Evaluator", "JsonlLookup", "ColumnarLookup", "iter_latest_columnar", "evaluate_files", "iter_latest_jsonl", "index_jsonl_ids"]
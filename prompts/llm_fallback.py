@@ -0,0 +1,368 @@
+"""Repli LLM pour les portées que les règles 20_scopes n'ont pas résolues.
+
+`process_annotations.py` marque ces portées `LLM_FALLBACK_SCOPE` ; seules
+celles-ci sont envoyées au LLM (endpoint compatible OpenAI, le même que
+`orchestrator.js`). Les cues sont regroupés en prompts par lots, les requêtes
+partent en parallèle sous un sémaphore asyncio (urllib dans des threads, sans
+dépendance supplémentaire) et sont rejouées avec un backoff exponentiel sur
+les erreurs transitoires (429, 5xx, délai dépassé, réponse illisible).
+
+Chaque réponse valide est mise en cache sur disque (JSONL en ajout seul) sous
+la clé (empreinte du gabarit de prompt et du modèle, phrase, cue) : une
+nouvelle exécution ne repaie jamais une portée déjà obtenue. Une portée
+absente ou introuvable dans la phrase n'est pas mise en cache et reste
+`LLM_FALLBACK_SCOPE`.
+
+Usage:
+    python -m prompts.llm_fallback --input data/annotations_with_scopes.jsonl \
+        --output data/annotations_llm_scopes.jsonl --base-url http://localhost:4141/v1
+    python -m prompts.llm_stub --port 4141   # serveur de test local
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import threading
+import time
+import urllib.error
+import urllib.request
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .compressed_io import open_text
+from .metrics import REGISTRY
+
+log = logging.getLogger("prompts.llm_fallback")
+
+FALLBACK_ID = "LLM_FALLBACK_SCOPE"
+LLM_SCOPE_ID = "LLM_SCOPE"
+DEFAULT_BASE_URL = "http://localhost:4141/v1"
+DEFAULT_MODEL = "gpt-4.1"
+DEFAULT_CACHE = Path("data/.cache/llm_scopes.jsonl")
+ITEMS_MARKER = "ÉLÉMENTS :"
+RETRY_STATUSES = (408, 409, 425, 429, 500, 502, 503, 504)
+
+SYSTEM_PROMPT = (
+    "Tu annotes la portée des marqueurs de négation dans des phrases médicales en français. "
+    "Pour chaque élément, donne la portée du marqueur : la sous-chaîne exacte de la phrase sur "
+    "laquelle porte la négation (sans le marqueur lui-même). Chaîne vide si la négation n'a pas de portée. "
+    'Réponds uniquement en JSON : {"results": [{"i": <numéro>, "scope": "<sous-chaîne exacte>"}]}'
+)
+USER_TEMPLATE = ITEMS_MARKER + "\n{items}"
+
+REQUESTS = REGISTRY.counter("annotator_llm_requests_total", "Appels HTTP au LLM par issue", ["outcome"])
+CACHE_LOOKUPS = REGISTRY.counter("annotator_llm_cache_lookups_total", "Portées demandées au cache LLM", ["result"])
+
+
+def template_hash(model: str) -> str:
+    """Empreinte du gabarit de prompt (et du modèle) : la changer invalide le cache"""
+    return hashlib.sha1(f"{SYSTEM_PROMPT}\n{USER_TEMPLATE}\n{model}".encode("utf-8")).hexdigest()[:16]
+
+
+@dataclass
+class FallbackItem:
+    """Un cue sans portée déterministe : (document, index du cue) → portée à demander"""
+    doc_index: int
+    cue_index: int
+    scope_index: int  # Portée LLM_FALLBACK_SCOPE à remplacer dans annotation["scopes"]
+    sentence: str
+    cue_label: str
+    cue_start: int
+    cue_end: int
+    group: str
+
+    def cache_key(self, template: str) -> str:
+        raw = json.dumps([template, self.sentence, self.cue_label, self.cue_start, self.cue_end], ensure_ascii=False)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def _cue_bounds(cue: Dict[str, Any]) -> Tuple[int, int]:
+    """(début, fin) d'un cue, au format `positions` (runner) ou `start`/`end`"""
+    positions = cue.get("positions")
+    if positions:
+        return positions[0][0], positions[-1][1]
+    return cue.get("start", 0), cue.get("end", 0)
+
+
+def collect_items(annotations: List[Dict[str, Any]]) -> List[FallbackItem]:
+    """Cues dont la portée est marquée LLM_FALLBACK_SCOPE (rattachés par `cue_index`)"""
+    items = []
+    for d, annotation in enumerate(annotations):
+        cues = annotation.get("cues", [])
+        for s, scope in enumerate(annotation.get("scopes", [])):
+            if scope.get("id") != FALLBACK_ID:
+                continue
+            c = scope.get("cue_index", s)  # Sans cue_index : une portée par cue, dans l'ordre
+            if not 0 <= c < len(cues):
+                continue
+            cue = cues[c]
+            start, end = _cue_bounds(cue)
+            items.append(FallbackItem(d, c, s, annotation.get("text", ""), cue.get("cue_label", ""),
+                                      start, end, cue.get("group", "unknown")))
+    return items
+
+
+def scope_positions(item: FallbackItem, scope: str) -> Optional[Tuple[int, int]]:
+    """Position de la portée dans la phrase (après le cue de préférence) ; None si absente"""
+    if not scope:
+        return None
+    position = item.sentence.find(scope, item.cue_end)
+    if position < 0:
+        position = item.sentence.find(scope)
+    return (position, position + len(scope)) if position >= 0 else None
+
+
+class ScopeCache:
+    """Cache persistant clé → portée (JSONL en ajout seul, relu à l'ouverture)"""
+
+    def __init__(self, path: Optional[Path]):
+        self.path = path
+        self._values: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        if path is not None and path.exists():
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        self._values[entry["key"]] = entry["value"]
+                    except (ValueError, KeyError, TypeError):
+                        continue  # Ligne tronquée par une interruption : ignorée
+
+    def __len__(self) -> int:
+        return len(self._values)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self._values.get(key)
+
+    def put_many(self, entries: Dict[str, Dict[str, Any]]) -> None:
+        if not entries:
+            return
+        with self._lock:
+            self._values.update(entries)
+            if self.path is None:
+                return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            data = "".join(json.dumps({"key": k, "value": v}, ensure_ascii=False) + "\n" for k, v in entries.items())
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(data)  # Une écriture par lot : pas de lignes entrelacées entre processus
+
+
+class TransientError(Exception):
+    """Erreur qui mérite un nouvel essai (réseau, 429/5xx, réponse illisible)"""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LLMFallbackClient:
+    def __init__(self, base_url: str = DEFAULT_BASE_URL, model: str = DEFAULT_MODEL, api_key: str = "dummy",
+                 batch_size: int = 8, concurrency: int = 4, max_retries: int = 4, backoff: float = 0.5,
+                 max_backoff: float = 30.0, timeout: float = 60.0, cache: Optional[ScopeCache] = None):
+        self.url = base_url.rstrip("/") + "/chat/completions"
+        self.model = model
+        self.api_key = api_key
+        self.batch_size = max(1, batch_size)
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.cache = cache if cache is not None else ScopeCache(None)
+        self.template = template_hash(model)
+        self.stats = {"items": 0, "cached": 0, "requested": 0, "resolved": 0, "unresolved": 0,
+                      "requests": 0, "retries": 0, "failed_batches": 0}
+
+    # ------------------------------------------------------------------
+    # HTTP (bloquant, exécuté dans un thread)
+    # ------------------------------------------------------------------
+    def build_messages(self, items: List[FallbackItem]) -> List[Dict[str, str]]:
+        payload = [{"i": i, "sentence": it.sentence, "cue": it.cue_label, "cue_start": it.cue_start,
+                    "cue_end": it.cue_end, "group": it.group} for i, it in enumerate(items)]
+        return [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": USER_TEMPLATE.format(items=json.dumps(payload, ensure_ascii=False))},
+        ]
+
+    def _post(self, messages: List[Dict[str, str]]) -> str:
+        body = json.dumps({"model": self.model, "messages": messages, "temperature": 0}).encode("utf-8")
+        req = urllib.request.Request(self.url, data=body, method="POST", headers={
+            "Content-Type": "application/json", "Authorization": f"Bearer {self.api_key}"})
+        try:
+            with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                data = json.loads(resp.read().decode("utf-8"))
+        except urllib.error.HTTPError as e:
+            if e.code in RETRY_STATUSES:
+                retry_after = e.headers.get("Retry-After") if e.headers else None
+                raise TransientError(f"HTTP {e.code}",
+                                     float(retry_after) if retry_after and retry_after.isdigit() else None)
+            raise
+        except (urllib.error.URLError, TimeoutError, ConnectionError) as e:
+            raise TransientError(f"{type(e).__name__}: {e}")
+        except ValueError as e:
+            raise TransientError(f"Réponse HTTP illisible: {e}")
+        try:
+            return data["choices"][0]["message"]["content"] or ""
+        except (KeyError, IndexError, TypeError):
+            raise TransientError("Réponse sans choices[0].message.content")
+
+    @staticmethod
+    def parse_results(content: str) -> Dict[int, str]:
+        """{"results": [{"i", "scope"}]} ; tolère un bloc ```json ou du texte autour"""
+        start, end = content.find("{"), content.rfind("}")
+        if start < 0 or end < start:
+            raise TransientError("Pas d'objet JSON dans la réponse")
+        try:
+            data = json.loads(content[start:end + 1])
+        except ValueError as e:
+            raise TransientError(f"JSON invalide dans la réponse: {e}")
+        results = {}
+        for entry in data.get("results", []) if isinstance(data, dict) else []:
+            if isinstance(entry, dict) and isinstance(entry.get("i"), int) and isinstance(entry.get("scope"), str):
+                results[entry["i"]] = entry["scope"]
+        return results
+
+    # ------------------------------------------------------------------
+    # Orchestration asynchrone
+    # ------------------------------------------------------------------
+    async def _request_batch(self, items: List[FallbackItem], semaphore: asyncio.Semaphore) -> Dict[str, Dict[str, Any]]:
+        messages = self.build_messages(items)
+        for attempt in range(self.max_retries + 1):
+            async with semaphore:
+                self.stats["requests"] += 1
+                try:
+                    content = await asyncio.to_thread(self._post, messages)
+                    results = self.parse_results(content)
+                    REQUESTS.inc(1, ("ok",))
+                    break
+                except TransientError as e:
+                    REQUESTS.inc(1, ("retry" if attempt < self.max_retries else "failed",))
+                    if attempt >= self.max_retries:
+                        log.warning("Lot de %d cue(s) abandonné après %d essais : %s", len(items), attempt + 1, e)
+                        self.stats["failed_batches"] += 1
+                        return {}
+                    delay = e.retry_after if e.retry_after is not None else \
+                        min(self.max_backoff, self.backoff * 2 ** attempt) * (0.5 + random.random())
+                    log.info("Erreur transitoire (%s), nouvel essai dans %.2f s", e, delay)
+                except urllib.error.HTTPError as e:
+                    REQUESTS.inc(1, ("failed",))
+                    log.warning("Lot de %d cue(s) refusé : HTTP %d", len(items), e.code)
+                    self.stats["failed_batches"] += 1
+                    return {}
+            self.stats["retries"] += 1
+            await asyncio.sleep(delay)  # Hors du sémaphore : l'attente ne bloque pas les autres lots
+
+        resolved = {}
+        for i, item in enumerate(items):
+            scope = results.get(i)
+            if scope is None:
+                continue
+            scope = scope.strip()
+            bounds = scope_positions(item, scope)
+            if scope and bounds is None:
+                log.debug("Portée hors phrase ignorée pour %r : %r", item.cue_label, scope)
+                continue
+            resolved[item.cache_key(self.template)] = {"scope": scope, "start": bounds[0] if bounds else None,
+                                                       "end": bounds[1] if bounds else None}
+        self.cache.put_many(resolved)
+        return resolved
+
+    async def resolve(self, items: List[FallbackItem]) -> Dict[str, Dict[str, Any]]:
+        """Portées des items (clé de cache → {scope, start, end}) ; cache d'abord, LLM ensuite"""
+        self.stats["items"] += len(items)
+        found: Dict[str, Dict[str, Any]] = {}
+        pending: Dict[str, FallbackItem] = {}  # Dédoublonné : un même (phrase, cue) n'est demandé qu'une fois
+        hits = 0
+        for item in items:
+            key = item.cache_key(self.template)
+            cached = self.cache.get(key)
+            if cached is not None:
+                found[key] = cached
+                hits += 1
+            else:
+                pending.setdefault(key, item)
+        self.stats["cached"] += hits
+        CACHE_LOOKUPS.inc_many({("hit",): hits, ("miss",): len(items) - hits})
+        todo = list(pending.values())
+        self.stats["requested"] += len(todo)
+        if todo:
+            semaphore = asyncio.Semaphore(self.concurrency)
+            batches = [todo[i:i + self.batch_size] for i in range(0, len(todo), self.batch_size)]
+            for resolved in await asyncio.gather(*(self._request_batch(b, semaphore) for b in batches)):
+                found.update(resolved)
+        self.stats["resolved"] += sum(1 for key in pending if key in found)
+        self.stats["unresolved"] += sum(1 for key in pending if key not in found)
+        return found
+
+    def resolve_sync(self, items: List[FallbackItem]) -> Dict[str, Dict[str, Any]]:
+        return asyncio.run(self.resolve(items))
+
+
+def apply_fallback(annotations: List[Dict[str, Any]], client: LLMFallbackClient) -> int:
+    """Remplacer les portées LLM_FALLBACK_SCOPE résolues ; renvoie le nombre de portées remplacées"""
+    items = collect_items(annotations)
+    resolved = client.resolve_sync(items)
+    replaced = 0
+    for item in items:
+        result = resolved.get(item.cache_key(client.template))
+        if result is None:
+            continue
+        scope = annotations[item.doc_index]["scopes"][item.scope_index]
+        scope.update(id=LLM_SCOPE_ID, scope_label=result["scope"], start=result["start"],
+                     end=result["end"], source="llm")
+        replaced += 1
+    return replaced
+
+
+def _read_jsonl(path: str) -> Iterable[Dict[str, Any]]:
+    with open_text(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Portées par LLM pour les cues non résolus par les règles (LLM_FALLBACK_SCOPE)")
+    ap.add_argument("--input", required=True, help="JSONL avec portées (sortie de process_annotations.py)")
+    ap.add_argument("--output", required=True, help="JSONL de sortie (.jsonl.gz... pour compresser)")
+    ap.add_argument("--base-url", default=os.environ.get("AUTO_ANNOTATOR_LLM_URL", DEFAULT_BASE_URL),
+                    help="Endpoint compatible OpenAI")
+    ap.add_argument("--model", default=DEFAULT_MODEL)
+    ap.add_argument("--api-key", default=os.environ.get("AUTO_ANNOTATOR_LLM_KEY", "dummy"))
+    ap.add_argument("--batch-size", type=int, default=8, help="Cues par prompt")
+    ap.add_argument("--concurrency", type=int, default=4, help="Requêtes simultanées au plus")
+    ap.add_argument("--max-retries", type=int, default=4)
+    ap.add_argument("--timeout", type=float, default=60.0, help="Délai par requête (s)")
+    ap.add_argument("--cache", default=str(DEFAULT_CACHE), help="Cache persistant des portées (JSONL)")
+    ap.add_argument("--no-cache", action="store_true", help="Ni lecture ni écriture du cache")
+    ap.add_argument("--log", default="INFO")
+    args = ap.parse_args()
+    logging.basicConfig(level=getattr(logging, args.log.upper(), logging.INFO), format="%(message)s")
+
+    cache = ScopeCache(None if args.no_cache else Path(args.cache))
+    client = LLMFallbackClient(args.base_url, args.model, args.api_key, batch_size=args.batch_size,
+                               concurrency=args.concurrency, max_retries=args.max_retries,
+                               timeout=args.timeout, cache=cache)
+    annotations = list(_read_jsonl(args.input))
+    started = time.perf_counter()
+    replaced = apply_fallback(annotations, client)
+    with open_text(args.output, "w") as f:
+        for annotation in annotations:
+            f.write(json.dumps(annotation, ensure_ascii=False) + "\n")
+    s = client.stats
+    log.info("%d portée(s) de repli : %d en cache, %d demandée(s) au LLM (%d résolue(s), %d non résolue(s)) ; "
+             "%d requête(s), %d nouvel(s) essai(s), %d lot(s) en échec ; %d remplacée(s) en %.2f s → %s",
+             s["items"], s["cached"], s["requested"], s["resolved"], s["unresolved"], s["requests"],
+             s["retries"], s["failed_batches"], replaced, time.perf_counter() - started, args.output)
+
+
+if __name__ == "__main__":
+    main()
+
+__all__ = ["FallbackItem", "ScopeCache", "LLMFallbackClient", "collect_items", "apply_fallback", "template_hash"]
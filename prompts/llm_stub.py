@@ -0,0 +1,136 @@
+"""Serveur local imitant /v1/chat/completions pour tester `prompts.llm_fallback`.
+
+Répond de façon déterministe aux prompts du repli LLM : la portée d'un cue est
+le texte qui le suit jusqu'à la ponctuation suivante. `--latency-ms` simule la
+durée d'un appel, `--fail-rate` renvoie des 503 (pour exercer les nouveaux
+essais). GET /stats donne le nombre de requêtes, d'éléments et la concurrence
+maximale observée.
+
+Usage:
+    python -m prompts.llm_stub --port 4141 --latency-ms 200 --fail-rate 0.1
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import logging
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+from .llm_fallback import ITEMS_MARKER
+
+log = logging.getLogger("prompts.llm_stub")
+
+_SCOPE_END_RE = re.compile(r"[.;:,!?]")
+
+
+def stub_scope(item: Dict[str, Any]) -> str:
+    """Texte après le cue jusqu'à la ponctuation suivante"""
+    rest = item["sentence"][item["cue_end"]:]
+    m = _SCOPE_END_RE.search(rest)
+    return (rest[:m.start()] if m else rest).strip()
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency: float = 0.0, fail_rate: float = 0.0, seed: Optional[int] = None):
+        super().__init__(address, _Handler)
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "failures": 0, "items": 0, "in_flight": 0, "max_in_flight": 0}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: StubServer
+
+    def log_message(self, format, *args) -> None:
+        log.debug(format, *args)
+
+    def _send(self, status: int, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/") != "/stats":
+            return self._send(404, {"error": "not found"})
+        with self.server.lock:
+            self._send(200, dict(self.server.stats))
+
+    def do_POST(self) -> None:
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            return self._send(404, {"error": "not found"})
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        server = self.server
+        with server.lock:
+            server.stats["requests"] += 1
+            server.stats["in_flight"] += 1
+            server.stats["max_in_flight"] = max(server.stats["max_in_flight"], server.stats["in_flight"])
+            fail = server.random.random() < server.fail_rate
+        try:
+            time.sleep(server.latency)
+            if fail:
+                with server.lock:
+                    server.stats["failures"] += 1
+                return self._send(503, {"error": "surcharge simulée"})
+            items = self._items(request.get("messages", []))
+            with server.lock:
+                server.stats["items"] += len(items)
+            content = json.dumps({"results": [{"i": it["i"], "scope": stub_scope(it)} for it in items]},
+                                 ensure_ascii=False)
+            self._send(200, {"id": "stub", "object": "chat.completion", "model": request.get("model"),
+                             "choices": [{"index": 0, "finish_reason": "stop",
+                                          "message": {"role": "assistant", "content": content}}]})
+        finally:
+            with server.lock:
+                server.stats["in_flight"] -= 1
+
+    @staticmethod
+    def _items(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        for message in reversed(messages):
+            content = message.get("content") or ""
+            if message.get("role") == "user" and ITEMS_MARKER in content:
+                return json.loads(content.split(ITEMS_MARKER, 1)[1])
+        return []
+
+
+def serve(host: str = "127.0.0.1", port: int = 4141, latency: float = 0.0, fail_rate: float = 0.0,
+          seed: Optional[int] = None) -> StubServer:
+    """Démarrer le serveur dans un thread (port 0 : port libre, voir server.server_address)"""
+    server = StubServer((host, port), latency, fail_rate, seed)
+    threading.Thread(target=server.serve_forever, name="llm-stub", daemon=True).start()
+    return server
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Serveur LLM factice (compatible /v1/chat/completions) pour les tests")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=4141)
+    ap.add_argument("--latency-ms", type=float, default=0.0, help="Durée simulée de chaque appel")
+    ap.add_argument("--fail-rate", type=float, default=0.0, help="Part des appels répondus en 503")
+    ap.add_argument("--seed", type=int, default=None)
+    ap.add_argument("--log", default="INFO")
+    args = ap.parse_args()
+    logging.basicConfig(level=getattr(logging, args.log.upper(), logging.INFO), format="%(message)s")
+    server = StubServer((args.host, args.port), args.latency_ms / 1000, args.fail_rate, args.seed)
+    log.info("Serveur LLM factice sur http://%s:%d/v1", args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
+
+__all__ = ["StubServer", "serve", "stub_scope"]
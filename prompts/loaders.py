@@ -7,6 +7,7 @@ import regex as reg
 import logging
 log = logging.getLogger("prompts.loaders")
 from .debug_print import debug_print
+from .regex_safety import analyze_rule, is_batch_safe
 
 def _iter_yaml_files(folder: Path) -> List[Path]: # Parcourt le dossier donné et retourne une liste de tous les fichiers YAML valides (Path objects)
     return sorted([  
@@ -35,46 +36,71 @@ def infer_group_from_filename(name: str) -> str:
         return "adversative"
     return "autres_marqueurs"
 
-def load_markers(rules_dir: Path):
+def load_marker_file(f: Path, default_timeout_ms: float | None = None) -> List[Dict[str, Any]]:
+    """Règles compilées d'un fichier YAML de 10_markers (voir load_markers pour les champs ajoutés)"""
+    rules: List[Dict[str, Any]] = []
+    # debug_print(f"Traitement du fichier YAML : {f.name}")  # <-- ajout
+    items = yaml.safe_load(f.read_text(encoding="utf-8")) # Lit le fichier YAML et convertit son contenu en objets Python (ici, une liste où chaque élément est une règle) 
+    # debug_print(f"Fichier {f.name} chargé", f"type={type(items).__name__}", f"nombre d'éléments={len(items) if isinstance(items, list) else 'N/A'}")
+
+    # debug_print(f"Chargé {len(items) if isinstance(items, list) else 0} items depuis le fichier : {f.name}")
+    if not isinstance(items, list):
+        return rules
+    for rule in items:
+        rule["_file"] = str(f) # Dans la liste on va charger chaque règle et ajouter le chemin du fichier pour traçabilité
+        # debug_print(f"Règle chargée depuis {f.name} : {rule}")
+        gid = rule.get("group") or infer_group_from_filename(f.name)
+        # debug_print(f"Assignation du groupe gid='{gid}' pour la règle: id='{rule.get('id', 'N/A')}'")
+        rule["group"] = gid
+        pat = rule.get("when_pattern")                                # Récupère le motif regex brut défini dans la règle
+        if pat:                                                       # Si un motif regex est présent
+            clean_pattern = pat.replace('\n', ' ')                    # Remplace les sauts de ligne par des espaces
+            clean_pattern = reg.sub(r'#[^|]+(?=\|)', '', clean_pattern)  # Supprime les commentaires avant un "|"
+            clean_pattern = reg.sub(r'#[^)]+(?=\))', '', clean_pattern)  # Supprime les commentaires avant une ")"
+            clean_pattern = reg.sub(r'\s+', ' ', clean_pattern).strip()  # Réduit tous les espaces multiples et supprime les espaces de début/fin
+            clean_pattern = reg.sub(r'\s*\|\s*', '|', clean_pattern)     # Nettoie les séparateurs "|" en supprimant les espaces autour
+            clean_pattern = reg.sub(r'\(\s+', '(', clean_pattern)         # Supprime l'espace après "("
+            clean_pattern = reg.sub(r'\s+\)', ')', clean_pattern)         # Supprime l'espace avant ")"
+            clean_pattern = reg.sub(r'>\s+', '>', clean_pattern)          # Supprime l'espace après ">"
+            flags = reg.IGNORECASE if rule.get("options", {}).get("case_insensitive") else 0  # Ignore la casse si demandé
+            flags |= reg.VERBOSE                                         # Permet les commentaires et espaces dans la regex
+            rule["_compiled"] = reg.compile(pat, flags)                  # Compile le motif original et l'ajoute à la règle
+            rule["_clean_pattern"] = clean_pattern                       # Stocke le motif nettoyé pour affichage ou debug
+            risks = analyze_rule(rule)                                   # Constructions à retour arrière catastrophique
+            if risks:
+                rule["_risks"] = risks
+                log.warning("Règle %s (%s) : motif à risque — %s", rule.get("id", "UNK_RULE"), f.name,
+                            "; ".join(f"{r['code']} ({r['severity']})" for r in risks))
+            rule["_batchable"] = is_batch_safe(pat, ignore_case=bool(flags & reg.IGNORECASE))  # Matching sur tampon concaténé possible
+            budget = (rule.get("options") or {}).get("timeout_ms", default_timeout_ms)  # Budget de temps par texte (ms)
+            rule["_timeout"] = float(budget) / 1000 if budget else None  # En secondes pour `timeout=` de regex
+
+        comp_guards = []                                                # Liste des regex de garde négatives compilées
+        for g in rule.get("negative_guards", []) or []:                 # Parcourt les gardes éventuelles
+            gp = g.get("pattern") if isinstance(g, dict) else g         # Récupère le motif brut si c'est un dict ou la valeur directement
+            if gp:
+                comp_guards.append(reg.compile(gp, reg.IGNORECASE))     # Compile chaque garde avec insensibilité à la casse
+        if comp_guards:
+            rule["_guards"] = comp_guards                                # Ajoute les gardes compilées à la règle
+        rules.append(rule)
+    return rules
+
+def load_markers(rules_dir: Path, default_timeout_ms: float | None = None,
+                 file_cache: Dict[str, Tuple[Tuple[int, int], List[Dict[str, Any]]]] | None = None):
     d = rules_dir / "10_markers"  # dossier contenant les fichiers YAML de règles
     grouped = {}  # dictionnaire des règles regroupées par type
     for f in _iter_yaml_files(d):  # itère sur chaque fichier YAML valide
-        # debug_print(f"Traitement du fichier YAML : {f.name}")  # <-- ajout
-        items = yaml.safe_load(f.read_text(encoding="utf-8")) # Lit le fichier YAML et convertit son contenu en objets Python (ici, une liste où chaque élément est une règle) 
-        # debug_print(f"Fichier {f.name} chargé", f"type={type(items).__name__}", f"nombre d'éléments={len(items) if isinstance(items, list) else 'N/A'}")
-
-        # debug_print(f"Chargé {len(items) if isinstance(items, list) else 0} items depuis le fichier : {f.name}")
-        if not isinstance(items, list):
-            continue
-        for rule in items:
-            rule["_file"] = str(f) # Dans la liste on va charger chaque règle et ajouter le chemin du fichier pour traçabilité
-            # debug_print(f"Règle chargée depuis {f.name} : {rule}")
-            gid = rule.get("group") or infer_group_from_filename(f.name)
-            # debug_print(f"Assignation du groupe gid='{gid}' pour la règle: id='{rule.get('id', 'N/A')}'")
-            rule["group"] = gid
-            pat = rule.get("when_pattern")                                # Récupère le motif regex brut défini dans la règle
-            if pat:                                                       # Si un motif regex est présent
-                clean_pattern = pat.replace('\n', ' ')                    # Remplace les sauts de ligne par des espaces
-                clean_pattern = reg.sub(r'#[^|]+(?=\|)', '', clean_pattern)  # Supprime les commentaires avant un "|"
-                clean_pattern = reg.sub(r'#[^)]+(?=\))', '', clean_pattern)  # Supprime les commentaires avant une ")"
-                clean_pattern = reg.sub(r'\s+', ' ', clean_pattern).strip()  # Réduit tous les espaces multiples et supprime les espaces de début/fin
-                clean_pattern = reg.sub(r'\s*\|\s*', '|', clean_pattern)     # Nettoie les séparateurs "|" en supprimant les espaces autour
-                clean_pattern = reg.sub(r'\(\s+', '(', clean_pattern)         # Supprime l'espace après "("
-                clean_pattern = reg.sub(r'\s+\)', ')', clean_pattern)         # Supprime l'espace avant ")"
-                clean_pattern = reg.sub(r'>\s+', '>', clean_pattern)          # Supprime l'espace après ">"
-                flags = reg.IGNORECASE if rule.get("options", {}).get("case_insensitive") else 0  # Ignore la casse si demandé
-                flags |= reg.VERBOSE                                         # Permet les commentaires et espaces dans la regex
-                rule["_compiled"] = reg.compile(pat, flags)                  # Compile le motif original et l'ajoute à la règle
-                rule["_clean_pattern"] = clean_pattern                       # Stocke le motif nettoyé pour affichage ou debug
-
-            comp_guards = []                                                # Liste des regex de garde négatives compilées
-            for g in rule.get("negative_guards", []) or []:                 # Parcourt les gardes éventuelles
-                gp = g.get("pattern") if isinstance(g, dict) else g         # Récupère le motif brut si c'est un dict ou la valeur directement
-                if gp:
-                    comp_guards.append(reg.compile(gp, reg.IGNORECASE))     # Compile chaque garde avec insensibilité à la casse
-            if comp_guards:
-                rule["_guards"] = comp_guards                                # Ajoute les gardes compilées à la règle
-            grouped.setdefault(gid, []).append(rule)                        # Ajoute la règle dans son groupe correspondant
+        if file_cache is None:
+            rules = load_marker_file(f, default_timeout_ms)
+        else:  # Rechargement : seuls les fichiers modifiés (mtime, taille) sont recompilés
+            st = f.stat()
+            key = (st.st_mtime_ns, st.st_size)
+            cached = file_cache.get(str(f))
+            if cached is None or cached[0] != key:
+                cached = file_cache[str(f)] = (key, load_marker_file(f, default_timeout_ms))
+            rules = cached[1]
+        for rule in rules:
+            grouped.setdefault(rule["group"], []).append(rule)             # Ajoute la règle dans son groupe correspondant
     # for g, L in grouped.items():
         # debug_print(f"Markers '{g}': {len(L)} règles")
 
@@ -87,6 +113,9 @@ def load_markers(rules_dir: Path):
     #   - "_compiled" : motif regex compilé avec reg.compile (re.Pattern), si applicable
     #   - "_clean_pattern" : motif regex nettoyé (str), pour debug ou affichage
     #   - "_guards" : liste de regex compilées correspondant aux negative_guards, si présentes
+    #   - "_risks" : constructions à risque détectées par regex_safety, si présentes
+    #   - "_timeout" : budget de matching en secondes (options.timeout_ms ou défaut), ou None
+    #   - "_batchable" : motif sans lookaround ni ancre, utilisable par annotate_batch
     # Type du retour : Dict[str, List[Dict[str, Any]]]
     # for gid, rules in grouped.items():
         # debug_print(f"Groupe '{gid}' contient {len(rules)} règles", max_print=1)
@@ -96,4 +125,4 @@ def load_markers(rules_dir: Path):
                         # f"Type={type(rules[0]).__name__}", max_print=1)
     return grouped
 
-__all__ = ["_iter_yaml_files", "infer_group_from_filename", "load_markers"]
+__all__ = ["_iter_yaml_files", "infer_group_from_filename", "load_marker_file", "load_markers"]
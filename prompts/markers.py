@@ -67,21 +67,41 @@ def _find_cleaned_text_positions(original_text: str, cleaned_text: str, approx_s
     # print(f"[DEBUG _find_cleaned_text_positions] '{cleaned_text}' → {positions}")
     return positions
 
+# Motifs compilés une fois (appelés pour chaque match de chaque règle)
+_BIPARTITE_RE = re.compile(r"(?:\bne\b|n['’]).*?\b(pas|plus|jamais|rien|personne|guère|point|nul)\b", re.IGNORECASE)
+_PART1_RE = re.compile(r"(?:\bne\b|n['’])", re.IGNORECASE)
+_PART2_RE = re.compile(r"\b(pas|plus|jamais|rien|personne|guère|point|nul)\b", re.IGNORECASE)
+_ELIDED_NE_RE = re.compile(r"^n['’]", re.IGNORECASE)
+
+_SINGLE_NEG_RES = [re.compile(p, re.IGNORECASE) for p in (
+    r"(?:\bne\b|n['’])",
+    r"\b(pas)\b",
+    r"\b(plus)\b",
+    r"\b(jamais)\b",
+    r"\b(rien)\b",
+    r"\b(personne)\b",
+    r"\b(guère)\b",
+    r"\b(point)\b",
+    r"\b(nul)\b",
+    r"\b(aucun|aucune)\b",
+    r"\b(sans)\b",
+    r"\b(ni)\b",
+    r"\b(non)\b",
+    r"\b(absence)\b",
+)]
+
 def _extract_negation_markers_only(text: str, match, rule: Dict[str, Any]) -> Tuple[str, int, int]:
     match_text = match.group(0)
     match_start = match.start()
     match_end = match.end()
-    bipartite_pattern = r"(?:\bne\b|n['’]).*?\b(pas|plus|jamais|rien|personne|guère|point|nul)\b"
-    bipartite_match = re.search(bipartite_pattern, match_text, re.IGNORECASE)
+    bipartite_match = _BIPARTITE_RE.search(match_text)
     if bipartite_match:
-        part1_pattern = r"(?:\bne\b|n['’])"
-        part2_pattern = r"\b(pas|plus|jamais|rien|personne|guère|point|nul)\b"
-        part1_match = re.search(part1_pattern, match_text, re.IGNORECASE)
-        part2_match = re.search(part2_pattern, match_text, re.IGNORECASE)
+        part1_match = _PART1_RE.search(match_text)
+        part2_match = _PART2_RE.search(match_text)
         if part1_match and part2_match:
             part1_text = part1_match.group(0)
-            if re.match(r"^n['’]", part1_text, re.IGNORECASE):
-                part1_text = re.match(r"^n['’]", part1_text, re.IGNORECASE).group(0)
+            if _ELIDED_NE_RE.match(part1_text):
+                part1_text = _ELIDED_NE_RE.match(part1_text).group(0)
             part2_text = part2_match.group(0)
             cleaned_label = f"{part1_text} {part2_text}"
             p1_start = match_start + part1_match.start()
@@ -89,24 +109,8 @@ def _extract_negation_markers_only(text: str, match, rule: Dict[str, Any]) -> Tu
             p2_start = match_start + part2_match.start()
             p2_end = match_start + part2_match.end()
             return cleaned_label, p1_start, p2_end
-    single_neg_patterns = [
-        r"(?:\bne\b|n['’])",
-        r"\b(pas)\b",
-        r"\b(plus)\b",
-        r"\b(jamais)\b",
-        r"\b(rien)\b",
-        r"\b(personne)\b",
-        r"\b(guère)\b",
-        r"\b(point)\b",
-        r"\b(nul)\b",
-        r"\b(aucun|aucune)\b",
-        r"\b(sans)\b",
-        r"\b(ni)\b",
-        r"\b(non)\b",
-        r"\b(absence)\b",
-    ]
-    for pattern in single_neg_patterns:
-        single_match = re.search(pattern, match_text, re.IGNORECASE)
+    for pattern in _SINGLE_NEG_RES:
+        single_match = pattern.search(match_text)
         if single_match:
             particle_text = single_match.group(0)
             particle_start = match_start + single_match.start()
@@ -0,0 +1,430 @@
+"""Compteurs et histogrammes en mémoire, exposés au format texte Prometheus ou en JSON.
+
+Un registre par processus (`REGISTRY`) : chaque module déclare ses métriques au
+chargement (`REGISTRY.counter(...)`, `REGISTRY.histogram(...)`) puis les met à
+jour sur son chemin chaud (un verrou court par mise à jour). Les jauges
+`REGISTRY.gauge(name, help, fn)` sont évaluées à la lecture.
+
+`/api/metrics` sert `REGISTRY.render()` ; `prompts.runner --metrics-json`
+écrit périodiquement `REGISTRY.to_dict()` (avec le débit de chaque compteur
+depuis le dump précédent) via `JsonDumper`.
+
+Plusieurs processus derrière un même port (workers gunicorn) : `REGISTRY.share(dossier)`
+avant le fork, puis `REGISTRY.start_publishing()` dans chaque worker. Chaque processus
+écrit ses séries dans `dossier/metrics_<pid>_<démarrage>.json` (chaque seconde, et à
+chaque rendu) et `render()` somme les fichiers de tous les processus, y compris ceux
+des workers arrêtés (les totaux ne reculent pas quand gunicorn en relance un). Les
+jauges, instantanées, ne se somment pas : une série par worker vivant, label `pid`.
+"""
+
+from __future__ import annotations
+import bisect
+import glob
+import json
+import logging
+import math
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+log = logging.getLogger("prompts.metrics")
+
+LabelValues = Tuple[str, ...]
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric(ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Sequence[Any]) -> LabelValues:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"{self.name} : labels attendus {self.labelnames}, reçu {tuple(labels)}")
+        return tuple(str(v) for v in labels)
+
+    @abstractmethod
+    def series(self) -> List[Tuple[LabelValues, Any]]:
+        """(labels, valeur brute) triés : ce que publie un processus en mode partagé"""
+
+    @abstractmethod
+    def samples(self, series: Optional[List[Tuple[LabelValues, Any]]] = None) -> List[Tuple[str, str, float]]:
+        """(suffixe, labels formatés, valeur) au format d'exposition, de `series` si fourni"""
+
+    @abstractmethod
+    def to_dict(self) -> Any:
+        """Valeurs du processus, JSON-sérialisables"""
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, labels: Sequence[Any] = ()) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def inc_many(self, amounts: Mapping[LabelValues, float]) -> None:
+        """Plusieurs séries en une seule prise du verrou (ex. cues par groupe d'un lot)"""
+        keys = [(self._key(labels), amount) for labels, amount in amounts.items()]
+        with self._lock:
+            for key, amount in keys:
+                self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, labels: Sequence[Any] = ()) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def series(self) -> List[Tuple[LabelValues, Any]]:
+        with self._lock:
+            return sorted(self._values.items())
+
+    @staticmethod
+    def combine(a: float, b: float) -> float:
+        return a + b
+
+    def samples(self, series: Optional[List[Tuple[LabelValues, Any]]] = None) -> List[Tuple[str, str, float]]:
+        items = self.series() if series is None else series
+        return [("", _format_labels(self.labelnames, key), value) for key, value in items]
+
+    def to_dict(self) -> Any:
+        items = self.series()
+        if not self.labelnames:
+            return items[0][1] if items else 0.0
+        return {",".join(key): value for key, value in items}
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS,
+                 labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Par série : [comptes par bucket (non cumulés, dernier = +Inf), somme, nombre]
+        self._series: Dict[LabelValues, List[Any]] = {}
+
+    def observe(self, value: float, labels: Sequence[Any] = ()) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def series(self) -> List[Tuple[LabelValues, Any]]:
+        with self._lock:
+            return sorted((key, (list(s[0]), s[1], s[2])) for key, s in self._series.items())
+
+    @staticmethod
+    def combine(a: Sequence[Any], b: Sequence[Any]) -> Tuple[List[int], float, int]:
+        return [x + y for x, y in zip(a[0], b[0])], a[1] + b[1], a[2] + b[2]
+
+    def samples(self, series: Optional[List[Tuple[LabelValues, Any]]] = None) -> List[Tuple[str, str, float]]:
+        items = self.series() if series is None else series
+        out = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets + (math.inf,), counts):
+                cumulative += n
+                out.append(("_bucket", _format_labels(self.labelnames, key, ("le", _format_value(bound))), cumulative))
+            out.append(("_sum", _format_labels(self.labelnames, key), total))
+            out.append(("_count", _format_labels(self.labelnames, key), count))
+        return out
+
+    def to_dict(self) -> Any:
+        out = {}
+        for key, (counts, total, count) in self.series():
+            out[",".join(key)] = {
+                "count": count,
+                "sum": total,
+                "mean": total / count if count else None,
+                "p50": self._quantile(counts, count, 0.5),
+                "p95": self._quantile(counts, count, 0.95),
+                "p99": self._quantile(counts, count, 0.99),
+            }
+        return out if self.labelnames else out.get("", {"count": 0, "sum": 0.0})
+
+    def _quantile(self, counts: List[int], count: int, q: float) -> Optional[float]:
+        """Borne supérieure du bucket contenant le quantile (None au-delà du dernier bucket)"""
+        if not count:
+            return None
+        rank, cumulative = q * count, 0
+        for bound, n in zip(self.buckets, counts):
+            cumulative += n
+            if cumulative >= rank:
+                return bound
+        return None
+
+
+class Gauge(_Metric):
+    """Valeur calculée à la lecture : `fn()` renvoie un nombre, ou {labels: valeur} si labelnames"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Callable[[], Any], labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+
+    def series(self) -> List[Tuple[LabelValues, Any]]:
+        try:
+            value = self.fn()
+        except Exception as e:
+            log.warning("Jauge %s illisible : %s", self.name, e)
+            return []
+        if not self.labelnames:
+            return [((), float(value))]
+        return sorted((self._key(k if isinstance(k, tuple) else (k,)), float(v)) for k, v in value.items())
+
+    def samples(self, series: Optional[List[Tuple[LabelValues, Any]]] = None) -> List[Tuple[str, str, float]]:
+        items = self.series() if series is None else series
+        return [("", _format_labels(self.labelnames, key), value) for key, value in items]
+
+    def to_dict(self) -> Any:
+        values = self.series()
+        if not self.labelnames:
+            return values[0][1] if values else None
+        return {",".join(key): value for key, value in values}
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+        self._shared_dir: Optional[str] = None  # Mode partagé entre processus (voir share)
+        self._publish_interval = 1.0
+        self._publisher_pid: Optional[int] = None
+        self._identity: Optional[Tuple[int, int]] = None  # (pid, démarrage en ns) du fichier publié
+        self._publish_lock = threading.Lock()  # Thread de publication et rendus concurrents
+
+    def _register(self, metric: _Metric) -> _Metric:
+        # Même nom : métrique existante (module rechargé, plusieurs instances d'une classe)
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if existing.kind != metric.kind:
+                    raise ValueError(f"Métrique {metric.name} déjà déclarée comme {existing.kind}")
+                if isinstance(existing, Gauge):
+                    existing.fn = metric.fn
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = LATENCY_BUCKETS,
+                  labelnames: Sequence[str] = ()) -> Histogram:
+        return self._register(Histogram(name, help, buckets, labelnames))
+
+    def gauge(self, name: str, help: str, fn: Callable[[], Any], labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, help, fn, labelnames))
+
+    def metrics(self) -> Iterable[_Metric]:
+        with self._lock:
+            return list(self._metrics.values())
+
+    def share(self, directory: str, interval: float = 1.0) -> None:
+        """Agréger les métriques des processus qui publient dans `directory`.
+
+        À appeler une fois avant le fork des workers : vide les fichiers d'un lancement précédent.
+        """
+        os.makedirs(directory, exist_ok=True)
+        for path in glob.glob(os.path.join(directory, "metrics_*.json")):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._shared_dir = directory
+        self._publish_interval = interval
+
+    def start_publishing(self) -> None:
+        """Publier périodiquement les séries de ce processus (une fois par processus, sans effet hors mode partagé)"""
+        if self._shared_dir is None or self._publisher_pid == os.getpid():
+            return
+        self._publisher_pid = os.getpid()
+        threading.Thread(target=self._publish_loop, name="metrics-publish", daemon=True).start()
+
+    def _publish_loop(self) -> None:
+        while True:
+            time.sleep(self._publish_interval)
+            try:
+                self.publish()
+            except Exception as e:
+                log.warning("Publication des métriques impossible (%s) : %s", self._shared_dir, e)
+
+    def publish(self) -> None:
+        """Écrire les séries de ce processus dans le dossier partagé"""
+        if self._shared_dir is None:
+            return
+        if self._identity is None or self._identity[0] != os.getpid():  # Nouveau processus (fork)
+            self._identity = (os.getpid(), time.time_ns())
+            self._publish_lock = threading.Lock()
+        pid, started = self._identity
+        path = os.path.join(self._shared_dir, f"metrics_{pid}_{started}.json")
+        with self._publish_lock:
+            payload = {"pid": pid, "started": started,
+                       "metrics": {metric.name: metric.series() for metric in self.metrics()}}
+            tmp = f"{path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(payload, f, ensure_ascii=False)
+            os.replace(tmp, path)
+
+    def _collect(self) -> List[Tuple[Dict[str, Any], bool]]:
+        """(publication, processus vivant) de chaque processus du dossier partagé"""
+        published = []
+        for path in glob.glob(os.path.join(self._shared_dir, "metrics_*.json")):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    published.append(json.load(f))
+            except (OSError, ValueError) as e:
+                log.warning("Métriques illisibles (%s) : %s", path, e)
+        # Un pid réutilisé par un nouveau worker : seul le fichier le plus récent est vivant
+        latest: Dict[int, int] = {}
+        for payload in published:
+            latest[payload["pid"]] = max(payload["started"], latest.get(payload["pid"], 0))
+        return [(payload, payload["started"] == latest[payload["pid"]] and _pid_alive(payload["pid"]))
+                for payload in published]
+
+    def _merged_samples(self, metric: _Metric, published: List[Tuple[Dict[str, Any], bool]]) -> List[Tuple[str, str, float]]:
+        if isinstance(metric, Gauge):
+            # Valeur instantanée d'un processus : une série par worker vivant
+            names = metric.labelnames + ("pid",)
+            return [("", _format_labels(names, tuple(key) + (str(payload["pid"]),)), value)
+                    for payload, alive in published if alive
+                    for key, value in payload["metrics"].get(metric.name, ())]
+        totals: Dict[LabelValues, Any] = {}
+        for payload, _ in published:
+            for key, value in payload["metrics"].get(metric.name, ()):
+                key = tuple(key)
+                totals[key] = metric.combine(totals[key], value) if key in totals else value
+        return metric.samples(sorted(totals.items()))
+
+    def render(self) -> str:
+        """Format texte d'exposition Prometheus (version 0.0.4), tous processus confondus en mode partagé"""
+        published = None
+        if self._shared_dir is not None:
+            # Les séries de ce processus passent aussi par son fichier : chaque fichier ne fait
+            # que croître, donc les totaux rendus par des workers successifs ne reculent pas
+            self.publish()
+            published = self._collect()
+        lines = []
+        for metric in self.metrics():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            samples = metric.samples() if published is None else self._merged_samples(metric, published)
+            for suffix, labels, value in samples:
+                lines.append(f"{metric.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {metric.name: metric.to_dict() for metric in self.metrics()}
+
+
+REGISTRY = Registry()
+_STARTED_AT = time.time()
+REGISTRY.gauge("annotator_process_start_time_seconds", "Démarrage du processus (epoch)", lambda: _STARTED_AT)
+
+
+class JsonDumper:
+    """Écrit `registry.to_dict()` dans un fichier toutes les `interval` secondes (et à l'arrêt).
+
+    Chaque dump ajoute `rates` : accroissement par seconde de chaque compteur depuis le
+    dump précédent (ex. `annotator_detector_sentences_total` → phrases/s).
+    """
+
+    def __init__(self, path: str, interval: float = 10.0, registry: Registry = REGISTRY):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._previous: Optional[Tuple[float, Dict[str, Any]]] = None
+
+    def dump(self) -> Dict[str, Any]:
+        now = time.time()
+        metrics = self.registry.to_dict()
+        counters = {m.name: metrics[m.name] for m in self.registry.metrics() if isinstance(m, Counter)}
+        rates: Dict[str, Any] = {}
+        if self._previous is not None:
+            then, before = self._previous
+            elapsed = max(now - then, 1e-9)
+            for name, value in counters.items():
+                old = before.get(name, 0.0 if not isinstance(value, dict) else {})
+                if isinstance(value, dict):
+                    rates[name] = {k: (v - old.get(k, 0.0)) / elapsed for k, v in value.items()}
+                else:
+                    rates[name] = (value - old) / elapsed
+        self._previous = (now, counters)
+        payload = {"timestamp": now, "pid": os.getpid(), "metrics": metrics, "rates": rates}
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path)
+        return payload
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.dump()
+            except Exception as e:
+                log.warning("Dump des métriques impossible (%s) : %s", self.path, e)
+
+    def start(self) -> "JsonDumper":
+        self.dump()
+        self._thread = threading.Thread(target=self._run, name="metrics-dump", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.dump()
+
+
+__all__ = ["REGISTRY", "Registry", "Counter", "Histogram", "Gauge", "JsonDumper",
+           "LATENCY_BUCKETS", "SIZE_BUCKETS", "COUNT_BUCKETS"]
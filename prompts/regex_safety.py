@@ -0,0 +1,368 @@
+"""Analyse statique des motifs de règles et stress test du temps de matching.
+
+Analyse (appelée par `load_markers`) : le motif est décomposé par le parseur
+de `re` et parcouru pour repérer les constructions qui provoquent un retour
+arrière catastrophique :
+- nested_quantifier       : quantificateur non borné contenant un autre
+                            quantificateur non borné, ex. (a+)+  (\\s*\\w+)*
+- overlapping_alternation : alternative répétée dont des branches peuvent
+                            commencer par le même caractère, ex. (a|ab)*
+- unbounded_lazy_span     : .*? / .+? (ou classe large) non borné suivi d'un
+                            autre élément : essais en O(n) par position
+- unbounded_greedy_span   : .* / .+ non borné sur tout caractère
+Les motifs que le parseur de `re` ne comprend pas (syntaxe propre à `regex`)
+passent par des heuristiques textuelles.
+
+Stress (CLI) : chaque règle est rejouée sur des phrases synthétiques longues
+construites pour la faire échouer tard (mots du motif répétés, suites sans
+espace, particules sans fermeture) ; le pire temps est rapporté.
+
+Usage:
+    python -m prompts.regex_safety --rules rules --lengths 1000 10000 50000 --json stress.json
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import logging
+import re
+import time
+import unicodedata
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+try:  # Python 3.11+
+    import re._parser as sre_parse
+    from re._constants import MAXREPEAT
+except ImportError:  # pragma: no cover - Python < 3.11
+    import sre_parse  # type: ignore
+    from sre_constants import MAXREPEAT  # type: ignore
+
+log = logging.getLogger("prompts.regex_safety")
+
+# Caractères servant à approcher les ensembles de « premier caractère »
+_UNIVERSE = (
+    "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+    "àâäçéèêëîïôöùûüÿœæÀÂÇÉÈÊËÎÏÔÙÛÜŒ"
+    " \t\n'’\"-_.,;:!?()[]/%+*=<>"
+)
+_WIDE_CLASS = 0.5  # Une classe couvrant plus de la moitié de l'univers est « large »
+
+SEVERITY = {"nested_quantifier": "high", "overlapping_alternation": "high",
+            "unbounded_lazy_span": "medium", "unbounded_greedy_span": "medium"}
+_MESSAGES = {
+    "nested_quantifier": "quantificateur non borné imbriqué dans un autre",
+    "overlapping_alternation": "alternative répétée dont les branches se chevauchent",
+    "unbounded_lazy_span": "span paresseux non borné (.*?) suivi d'autres éléments",
+    "unbounded_greedy_span": "span gourmand non borné (.*) sur tout caractère",
+}
+
+
+def _finding(code: str, detail: str = "", heuristic: bool = False) -> Dict[str, Any]:
+    finding = {"code": code, "severity": SEVERITY[code], "message": _MESSAGES[code]}
+    if detail:
+        finding["detail"] = detail
+    if heuristic:
+        finding["heuristic"] = True
+    return finding
+
+
+# ----------------------------------------------------------------------
+# Ensembles de premiers caractères (approximés sur _UNIVERSE)
+# ----------------------------------------------------------------------
+def _category_chars(category) -> Set[str]:
+    name = str(category).upper()
+    tests = {
+        "DIGIT": str.isdigit,
+        "SPACE": str.isspace,
+        "WORD": lambda c: c.isalnum() or c == "_",
+    }
+    for key, test in tests.items():
+        if key in name:
+            chars = {c for c in _UNIVERSE if test(c)}
+            return set(_UNIVERSE) - chars if "NOT" in name else chars
+    return set(_UNIVERSE)
+
+
+def _in_chars(items, ignore_case: bool) -> Set[str]:
+    chars: Set[str] = set()
+    negate = False
+    for op, av in items:
+        name = str(op)
+        if name == "NEGATE":
+            negate = True
+        elif name == "LITERAL":
+            chars.add(chr(av))
+        elif name == "RANGE":
+            chars.update(c for c in _UNIVERSE if av[0] <= ord(c) <= av[1])
+        elif name == "CATEGORY":
+            chars |= _category_chars(av)
+        else:
+            chars |= set(_UNIVERSE)
+    if ignore_case:
+        chars |= {c.swapcase() for c in chars}
+    return set(_UNIVERSE) - chars if negate else chars
+
+
+def _first(items, ignore_case: bool) -> Tuple[Set[str], bool]:
+    """(premiers caractères possibles, la séquence peut-elle être vide ?)"""
+    first: Set[str] = set()
+    for op, av in items:
+        chars, nullable = _first_item(op, av, ignore_case)
+        first |= chars
+        if not nullable:
+            return first, False
+    return first, True
+
+
+def _first_item(op, av, ignore_case: bool) -> Tuple[Set[str], bool]:
+    name = str(op)
+    if name == "LITERAL":
+        c = chr(av)
+        return ({c, c.swapcase()} if ignore_case else {c}), False
+    if name == "NOT_LITERAL":
+        return set(_UNIVERSE) - {chr(av)}, False
+    if name == "ANY":
+        return set(_UNIVERSE) - {"\n"}, False
+    if name == "IN":
+        return _in_chars(av, ignore_case), False
+    if name in ("AT", "ASSERT", "ASSERT_NOT"):
+        return set(), True  # Largeur nulle
+    if name == "SUBPATTERN":
+        return _first(av[-1], ignore_case)
+    if name == "ATOMIC_GROUP":
+        return _first(av, ignore_case)
+    if name == "BRANCH":
+        chars: Set[str] = set()
+        nullable = False
+        for branch in av[1]:
+            c, n = _first(branch, ignore_case)
+            chars |= c
+            nullable = nullable or n
+        return chars, nullable
+    if name in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT"):
+        chars, nullable = _first(av[2], ignore_case)
+        return chars, nullable or av[0] == 0
+    return set(_UNIVERSE), True  # GROUPREF & co : inconnu
+
+
+# ----------------------------------------------------------------------
+# Parcours de l'arbre
+# ----------------------------------------------------------------------
+def _has_unbounded_repeat(items) -> bool:
+    for op, av in items:
+        name = str(op)
+        if name in ("MAX_REPEAT", "MIN_REPEAT"):
+            if av[1] == MAXREPEAT or _has_unbounded_repeat(av[2]):
+                return True
+        elif name == "SUBPATTERN" and _has_unbounded_repeat(av[-1]):
+            return True
+        elif name == "BRANCH" and any(_has_unbounded_repeat(b) for b in av[1]):
+            return True
+    return False
+
+
+def _is_wide(items, ignore_case: bool) -> bool:
+    if len(items) != 1:
+        return False
+    op, av = items[0]
+    if str(op) == "ANY":
+        return True
+    if str(op) == "IN":
+        return len(_in_chars(av, ignore_case)) > _WIDE_CLASS * len(_UNIVERSE)
+    return False
+
+
+def _walk(items, ignore_case: bool, in_repeat: bool, findings: List[Dict[str, Any]]) -> None:
+    for index, (op, av) in enumerate(items):
+        name = str(op)
+        if name in ("MAX_REPEAT", "MIN_REPEAT"):
+            lo, hi, body = av
+            unbounded = hi == MAXREPEAT
+            if unbounded and _has_unbounded_repeat(body):
+                findings.append(_finding("nested_quantifier"))
+            if unbounded and _is_wide(body, ignore_case):
+                if name == "MIN_REPEAT" and index < len(items) - 1:
+                    findings.append(_finding("unbounded_lazy_span"))
+                elif name == "MAX_REPEAT" and str(body[0][0]) == "ANY":
+                    findings.append(_finding("unbounded_greedy_span"))
+            _walk(body, ignore_case, in_repeat or hi > 1, findings)
+        elif name == "BRANCH":
+            if in_repeat:
+                firsts = [_first(branch, ignore_case)[0] for branch in av[1]]
+                for i in range(len(firsts)):
+                    shared = next((firsts[i] & firsts[j] for j in range(i + 1, len(firsts)) if firsts[i] & firsts[j]), None)
+                    if shared:
+                        findings.append(_finding("overlapping_alternation", "premiers caractères communs: "
+                                                 + "".join(sorted(shared))[:20]))
+                        break
+            for branch in av[1]:
+                _walk(branch, ignore_case, in_repeat, findings)
+        elif name == "SUBPATTERN":
+            _walk(av[-1], ignore_case, in_repeat, findings)
+        elif name in ("ASSERT", "ASSERT_NOT"):
+            _walk(av[1], ignore_case, in_repeat, findings)
+        elif name == "ATOMIC_GROUP":
+            _walk(av, ignore_case, False, findings)  # Pas de retour arrière dans un groupe atomique
+        elif name == "POSSESSIVE_REPEAT":
+            _walk(av[2], ignore_case, False, findings)
+
+
+_HEURISTICS = [
+    ("nested_quantifier", re.compile(r"\((?:[^()\\]|\\.)*[+*](?:[^()\\]|\\.)*\)[+*]")),
+    ("unbounded_lazy_span", re.compile(r"\.[*+]\?(?!\s*\)?\s*$)")),
+    ("unbounded_greedy_span", re.compile(r"\.[*+](?![?+])")),
+]
+
+
+def analyze_pattern(pattern: str, verbose: bool = True, ignore_case: bool = False) -> List[Dict[str, Any]]:
+    """Constructions à risque d'un motif (liste vide si rien à signaler)"""
+    flags = (re.VERBOSE if verbose else 0) | (re.IGNORECASE if ignore_case else 0)
+    try:
+        tree = sre_parse.parse(pattern, flags)
+    except (re.error, OverflowError, RecursionError):
+        findings = []
+        for code, rx in _HEURISTICS:
+            if rx.search(pattern):
+                findings.append(_finding(code, heuristic=True))
+        return findings
+    findings: List[Dict[str, Any]] = []
+    _walk(list(tree), ignore_case, False, findings)
+    # Une seule entrée par type de risque
+    unique: Dict[str, Dict[str, Any]] = {}
+    for finding in findings:
+        unique.setdefault(finding["code"], finding)
+    return list(unique.values())
+
+
+_LOCAL_AT = {"AT_BOUNDARY", "AT_NON_BOUNDARY", "AT_UNI_BOUNDARY", "AT_UNI_NON_BOUNDARY",
+             "AT_LOC_BOUNDARY", "AT_LOC_NON_BOUNDARY"}
+
+
+def _context_free(items) -> bool:
+    for op, av in items:
+        name = str(op)
+        if name in ("ASSERT", "ASSERT_NOT", "GROUPREF_EXISTS"):
+            return False
+        if name == "AT" and str(av) not in _LOCAL_AT:
+            return False
+        if name == "SUBPATTERN" and not _context_free(av[-1]):
+            return False
+        if name in ("MAX_REPEAT", "MIN_REPEAT", "POSSESSIVE_REPEAT") and not _context_free(av[2]):
+            return False
+        if name == "ATOMIC_GROUP" and not _context_free(av):
+            return False
+        if name == "BRANCH" and not all(_context_free(b) for b in av[1]):
+            return False
+    return True
+
+
+def is_batch_safe(pattern: str, verbose: bool = True, ignore_case: bool = False) -> bool:
+    """Le motif peut-il tourner sur des textes concaténés par un séparateur non-mot ?
+
+    Faux dès qu'il regarde au-delà de son match (lookaround) ou s'ancre au début/fin
+    de chaîne ou de ligne ; `\b`/`\B` restent valides, le séparateur étant non-mot
+    comme un bord de chaîne. Faux aussi si le parseur de `re` ne comprend pas le motif.
+    """
+    flags = (re.VERBOSE if verbose else 0) | (re.IGNORECASE if ignore_case else 0)
+    try:
+        return _context_free(list(sre_parse.parse(pattern, flags)))
+    except (re.error, OverflowError, RecursionError):
+        return False
+
+
+def analyze_rule(rule: Dict[str, Any]) -> List[Dict[str, Any]]:
+    pattern = rule.get("when_pattern")
+    if not pattern:
+        return []
+    ignore_case = bool((rule.get("options") or {}).get("case_insensitive"))
+    return analyze_pattern(pattern, verbose=True, ignore_case=ignore_case)
+
+
+# ----------------------------------------------------------------------
+# Stress test
+# ----------------------------------------------------------------------
+def _literal_words(pattern: str) -> List[str]:
+    """Mots littéraux du motif (déclencheurs probables), dans l'ordre d'apparition"""
+    words: List[str] = []
+    for word in re.findall(r"(?<![\\{])\b[^\W\d_]{2,}(?:['’][^\W\d_]*)?", pattern):
+        word = unicodedata.normalize("NFC", word)
+        if word.lower() not in words and not re.fullmatch(r"[sSwWdDbB]|[a-z]{1,2}", word):
+            words.append(word.lower())
+    return words[:8]
+
+
+def adversarial_inputs(rule: Dict[str, Any], length: int) -> Iterable[Tuple[str, str]]:
+    """(nom du générateur, texte) : textes longs qui font échouer le motif le plus tard possible"""
+    words = _literal_words(rule.get("when_pattern") or "")
+    yield "word_run", "a" * length + "!"
+    yield "space_run", "a" + " " * length + "!"
+    yield "particles", ("n' " * (length // 3 + 1))[:length] + "?"
+    for word in words[:4]:
+        yield f"repeat:{word}", ((word + " ") * (length // (len(word) + 1) + 1))[:length] + "!"
+    if len(words) > 1:
+        phrase = " ".join(words) + " x "
+        yield "mixed_literals", (phrase * (length // len(phrase) + 1))[:length] + "!"
+        # Ouvrants répétés sans le dernier mot (qui fermerait le motif)
+        opener = " ".join(words[:-1]) + " "
+        yield "openers_only", (opener * (length // len(opener) + 1))[:length] + "!"
+
+
+def stress_rule(rule: Dict[str, Any], lengths: Iterable[int] = (1000, 10000), timeout: float = 2.0) -> Dict[str, Any]:
+    """Pire temps de `finditer` de la règle sur les textes adverses"""
+    pat = rule.get("_compiled")
+    worst = {"rule": rule.get("id", "UNK_RULE"), "seconds": 0.0, "generator": None, "length": 0,
+             "timed_out": False, "risks": [r["code"] for r in rule.get("_risks", [])]}
+    if pat is None:
+        return worst
+    for length in lengths:
+        for generator, text in adversarial_inputs(rule, length):
+            start = time.perf_counter()
+            timed_out = False
+            try:
+                for _ in pat.finditer(text, timeout=timeout):
+                    pass
+            except TimeoutError:
+                timed_out = True
+            elapsed = time.perf_counter() - start
+            if elapsed > worst["seconds"]:
+                worst.update(seconds=elapsed, generator=generator, length=length, timed_out=timed_out)
+    worst["seconds"] = round(worst["seconds"], 6)
+    return worst
+
+
+def main() -> None:
+    from .loaders import load_markers
+
+    ap = argparse.ArgumentParser(description="Analyse des motifs et stress test du temps de matching")
+    ap.add_argument("--rules", required=True, help="Chemin dossier rules/")
+    ap.add_argument("--lengths", type=int, nargs="+", default=[1000, 10000, 50000],
+                    help="Longueurs (caractères) des phrases synthétiques")
+    ap.add_argument("--timeout-ms", type=float, default=2000, help="Plafond par essai")
+    ap.add_argument("--only", nargs="*", help="Ids de règles à tester")
+    ap.add_argument("--json", help="Rapport JSON complet")
+    ap.add_argument("--log", default="INFO")
+    args = ap.parse_args()
+    logging.basicConfig(level=getattr(logging, args.log.upper(), logging.INFO))
+
+    markers_by_group = load_markers(Path(args.rules))
+    results = []
+    for rules in markers_by_group.values():
+        for rule in rules:
+            if args.only and rule.get("id") not in args.only:
+                continue
+            results.append(stress_rule(rule, args.lengths, args.timeout_ms / 1000))
+    results.sort(key=lambda r: r["seconds"], reverse=True)
+    for r in results:
+        log.info("%-32s %9.2f ms%s  %-20s n=%-6d %s", r["rule"], r["seconds"] * 1000,
+                 " (timeout)" if r["timed_out"] else "", r["generator"] or "-", r["length"],
+                 ",".join(r["risks"]) or "")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
+
+__all__ = ["analyze_pattern", "analyze_rule", "is_batch_safe", "adversarial_inputs", "stress_rule"]
@@ -0,0 +1,315 @@
+"""Exécution des `examples` des règles YAML comme tests de régression.
+
+Chaque exemple « phrase → cue1, cue2 » de rules/10_markers devient un cas :
+la phrase est annotée avec toute la base de règles (les cues attendus peuvent
+venir d'autres règles, ex. « sans, ne ») et les libellés obtenus sont comparés
+aux libellés attendus (multiensemble, casse et apostrophes normalisées). Un
+exemple sans « → » sous une règle `action: SKIP` attend zéro cue ; les autres
+exemples sans attente ne sont pas vérifiés.
+
+Cache : le résultat d'une règle seule sur une phrase (`rule_candidates`) ne
+dépend que de la règle et du texte. Il est stocké sous l'empreinte de la règle
+(champs YAML hors examples/notes + code du détecteur) ; après modification
+d'une règle, seule celle-ci est rejouée, puis les cues de chaque phrase sont
+recomposés dans l'ordre de chargement (`merge_candidates`), à l'identique de
+`annotate_sentence`.
+
+Les exemples de rules/20_scopes sont lus et comptés mais pas exécutés : aucun
+moteur de portées n'est encore branché sur ces règles.
+
+Usage:
+    python -m prompts.regression --rules rules [--jobs 4] [--only PREP_NEG_INF] [--json report.json]
+"""
+
+from __future__ import annotations
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import yaml
+
+from .detector import merge_candidates, rule_candidates
+from .loaders import _iter_yaml_files, load_markers
+
+log = logging.getLogger("prompts.regression")
+
+CACHE_VERSION = 1
+_ARROW_RE = re.compile(r"\s*(?:→|->)\s*")
+_REMARK_RE = re.compile(r"\([^)]*\)")
+_PREFIX_RE = re.compile(r"^\s*(?:cues?|scopes?)\s*:\s*", re.IGNORECASE)
+_CODE_FILES = ("detector.py", "markers.py", "loaders.py", "types.py")
+_IGNORED_FIELDS = {"examples", "notes"}
+
+_worker_rules: Optional[List[Dict[str, Any]]] = None  # Base de règles d'un processus de travail
+
+
+# ----------------------------------------------------------------------
+# Cas de test
+# ----------------------------------------------------------------------
+def normalize_label(label: str) -> str:
+    label = label.strip().strip("'\"").lower().replace("’", "'")
+    label = re.sub(r"'\s+", "'", label)
+    return re.sub(r"\s+", " ", label).strip()
+
+
+def parse_example(example: str) -> Tuple[str, Optional[List[str]]]:
+    """(phrase, libellés attendus) ; None si l'exemple ne porte pas d'attente"""
+    parts = _ARROW_RE.split(example, maxsplit=1)
+    sentence = parts[0].strip()
+    if len(parts) == 1:
+        return sentence, None
+    rhs = _PREFIX_RE.sub("", _REMARK_RE.sub("", parts[1])).strip()
+    return sentence, [lab for lab in (normalize_label(x) for x in rhs.split(",")) if lab]
+
+
+def _rule_items(path: Path) -> List[Dict[str, Any]]:
+    items = yaml.safe_load(path.read_text(encoding="utf-8"))
+    if isinstance(items, dict):  # 20_scopes : {rules: [...]}
+        items = items.get("rules")
+    return [r for r in items or [] if isinstance(r, dict)]
+
+
+def collect_cases(rules_dir: Path) -> Tuple[List[Dict[str, Any]], int]:
+    """Cas exécutables (10_markers) et nombre d'exemples de portée non exécutés"""
+    cases: List[Dict[str, Any]] = []
+    for f in _iter_yaml_files(rules_dir / "10_markers"):
+        for rule in _rule_items(f):
+            for example in rule.get("examples") or []:
+                if not isinstance(example, str):
+                    continue
+                sentence, expected = parse_example(example)
+                if expected is None and str(rule.get("action", "")).upper() == "SKIP":
+                    expected = []
+                cases.append({"rule": rule.get("id", "UNK_RULE"), "file": f.name,
+                              "sentence": sentence, "expected": expected})
+    scope_examples = sum(len(r.get("examples") or []) for f in _iter_yaml_files(rules_dir / "20_scopes")
+                         for r in _rule_items(f))
+    return cases, scope_examples
+
+
+# ----------------------------------------------------------------------
+# Empreintes et cache
+# ----------------------------------------------------------------------
+def code_fingerprint() -> str:
+    h = hashlib.sha1()
+    for name in _CODE_FILES:
+        h.update((Path(__file__).parent / name).read_bytes())
+    return h.hexdigest()
+
+
+def rule_fingerprint(rule: Dict[str, Any], code: str) -> str:
+    public = {k: v for k, v in rule.items() if not k.startswith("_") and k not in _IGNORED_FIELDS}
+    payload = json.dumps(public, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1((code + payload).encode("utf-8")).hexdigest()
+
+
+def default_cache_path(rules_dir: Path) -> Path:
+    return rules_dir.resolve().parent / "data" / ".cache" / "rule_regression.json"
+
+
+def _load_cache(path: Optional[Path]) -> Dict[str, Dict[str, Any]]:
+    if path is None or not path.exists():
+        return {}
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        log.warning("Cache illisible (%s), ignoré : %s", path, e)
+        return {}
+    return data.get("rules", {}) if data.get("version") == CACHE_VERSION else {}
+
+
+def _save_cache(path: Path, entries: Dict[str, Dict[str, Any]]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": CACHE_VERSION, "rules": entries}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+# ----------------------------------------------------------------------
+# Exécution
+# ----------------------------------------------------------------------
+def _flatten(markers_by_group: Dict[str, List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    return [rule for rules in markers_by_group.values() for rule in rules]  # Ordre de annotate_sentence
+
+
+def _init_worker(rules_dir: str, default_timeout_ms: Optional[float]) -> None:
+    global _worker_rules
+    if _worker_rules is None:  # Déjà hérité par fork
+        _worker_rules = _flatten(load_markers(Path(rules_dir), default_timeout_ms))
+
+
+def _run_tasks(tasks: List[Tuple[str, List[int]]], rules: Optional[List[Dict[str, Any]]] = None) -> List[tuple]:
+    """(phrase, indice de règle, candidats ou None, erreur ou None) pour chaque paire demandée"""
+    rules = rules if rules is not None else _worker_rules
+    results = []
+    for sentence, indices in tasks:
+        for index in indices:
+            try:
+                candidates = rule_candidates(rules[index], sentence)
+                error = None if candidates is not None else "budget de temps dépassé"
+                if candidates is not None:  # Forme JSON pour le cache
+                    candidates = [(s, e, cue.to_dict() if cue is not None else None) for s, e, cue in candidates]
+            except Exception as e:
+                candidates, error = None, f"{type(e).__name__}: {e}"
+            results.append((sentence, index, candidates, error))
+    return results
+
+
+def _chunks(tasks: List[Any], n: int) -> List[List[Any]]:
+    size = max(1, -(-len(tasks) // n))
+    return [tasks[i:i + size] for i in range(0, len(tasks), size)]
+
+
+class RegressionRunner:
+    """Rejoue les exemples des règles ; `run()` retourne le rapport"""
+
+    def __init__(self, rules_dir: Path, jobs: Optional[int] = None, cache_path: Optional[Path] = None,
+                 use_cache: bool = True, default_timeout_ms: Optional[float] = 1000):
+        self.rules_dir = Path(rules_dir)
+        self.jobs = jobs or os.cpu_count() or 1
+        self.cache_path = (cache_path or default_cache_path(self.rules_dir)) if use_cache else None
+        self.default_timeout_ms = default_timeout_ms
+
+    def run(self, only: Optional[List[str]] = None) -> Dict[str, Any]:
+        global _worker_rules
+        started = time.perf_counter()
+        rules = _flatten(load_markers(self.rules_dir, self.default_timeout_ms))
+        code = code_fingerprint()
+        fingerprints = [rule_fingerprint(rule, code) for rule in rules]
+        cases, scope_examples = collect_cases(self.rules_dir)
+        if only:
+            cases = [c for c in cases if c["rule"] in only]
+
+        cache = _load_cache(self.cache_path)
+        entries = {fp: cache.get(fp, {}) for fp in set(fingerprints)}  # Empreintes disparues : purgées
+        sentences = sorted({c["sentence"] for c in cases})
+        tasks = []
+        for sentence in sentences:
+            missing = [i for i, fp in enumerate(fingerprints) if sentence not in entries[fp]]
+            if missing:
+                tasks.append((sentence, missing))
+        pairs = sum(len(m) for _, m in tasks)
+
+        errors: Dict[Tuple[str, int], str] = {}
+        if tasks:
+            if self.jobs <= 1 or len(tasks) < 2:
+                results = _run_tasks(tasks, rules)
+            else:
+                _worker_rules = rules  # Hérité par les processus en fork, rechargé sinon
+                try:
+                    with ProcessPoolExecutor(max_workers=self.jobs, initializer=_init_worker,
+                                             initargs=(str(self.rules_dir), self.default_timeout_ms)) as pool:
+                        results = [r for chunk in pool.map(_run_tasks, _chunks(tasks, self.jobs * 4)) for r in chunk]
+                finally:
+                    _worker_rules = None
+            for sentence, index, candidates, error in results:
+                if error is None:
+                    entries[fingerprints[index]][sentence] = candidates
+                else:
+                    errors[(sentence, index)] = error
+
+        report_cases = [self._check(case, rules, fingerprints, entries, errors) for case in cases]
+        if self.cache_path is not None:
+            _save_cache(self.cache_path, entries)
+        status = Counter(c["status"] for c in report_cases)
+        return {
+            "cases": len(report_cases),
+            "passed": status["passed"],
+            "failed": status["failed"],
+            "errors": status["error"],
+            "unchecked": status["unchecked"],
+            "scope_examples_skipped": scope_examples,
+            "rule_runs": pairs,
+            "rule_runs_cached": len(sentences) * len(rules) - pairs,
+            "seconds": round(time.perf_counter() - started, 3),
+            "results": [c for c in report_cases if c["status"] in ("failed", "error")],
+        }
+
+    @staticmethod
+    def _check(case, rules, fingerprints, entries, errors) -> Dict[str, Any]:
+        sentence = case["sentence"]
+        result = dict(case)
+        failed_rules = [f"{rules[i].get('id')}: {errors[(sentence, i)]}"
+                        for i in range(len(rules)) if (sentence, i) in errors]
+        if failed_rules:
+            result.update(status="error", error="; ".join(failed_rules))
+            return result
+        seen: List[Tuple[int, int]] = []
+        cues = []
+        for fp in fingerprints:
+            cues.extend(merge_candidates([tuple(c) for c in entries[fp][sentence]], seen))
+        got = [normalize_label(str(c.get("cue_label", ""))) for c in cues]
+        result["got"] = got
+        if case["expected"] is None:
+            result["status"] = "unchecked"
+            return result
+        expected, obtained = Counter(case["expected"]), Counter(got)
+        missing = list((expected - obtained).elements())
+        extra = list((obtained - expected).elements())
+        result["status"] = "failed" if missing or extra else "passed"
+        if missing or extra:
+            result["missing"] = missing
+            surplus = Counter(extra)
+            result["extra"] = []
+            for cue, label in zip(cues, got):  # Attribuer chaque libellé en trop à la règle qui l'a produit
+                if surplus[label] > 0:
+                    surplus[label] -= 1
+                    result["extra"].append(f"{label} ({cue['id']})")
+        return result
+
+
+def format_failure(result: Dict[str, Any]) -> str:
+    head = f"{result['status'].upper()} {result['rule']} ({result['file']}) : « {result['sentence']} »"
+    if result["status"] == "error":
+        return f"{head}\n    erreur  : {result['error']}"
+    lines = [head,
+             f"    attendu : {', '.join(result['expected']) or '(aucun cue)'}",
+             f"    obtenu  : {', '.join(result['got']) or '(aucun cue)'}"]
+    lines += [f"    - {lab}" for lab in result.get("missing", [])]
+    lines += [f"    + {lab}" for lab in result.get("extra", [])]
+    return "\n".join(lines)
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Tests de régression à partir des exemples des règles YAML")
+    ap.add_argument("--rules", required=True, help="Chemin dossier rules/")
+    ap.add_argument("--jobs", type=int, default=None, help="Processus en parallèle (défaut: nombre de CPU)")
+    ap.add_argument("--only", nargs="*", help="Ids des règles dont les exemples sont rejoués")
+    ap.add_argument("--timeout-ms", type=float, default=1000, help="Budget de matching par règle et par phrase")
+    ap.add_argument("--cache", help="Fichier de cache (défaut: data/.cache/rule_regression.json)")
+    ap.add_argument("--no-cache", action="store_true", help="Tout rejouer sans lire ni écrire le cache")
+    ap.add_argument("--json", help="Rapport JSON")
+    ap.add_argument("--log", default="INFO")
+    args = ap.parse_args()
+    logging.basicConfig(level=getattr(logging, args.log.upper(), logging.INFO), format="%(message)s")
+
+    runner = RegressionRunner(Path(args.rules), jobs=args.jobs, cache_path=Path(args.cache) if args.cache else None,
+                              use_cache=not args.no_cache, default_timeout_ms=args.timeout_ms)
+    report = runner.run(args.only)
+    for result in report["results"]:
+        log.info("%s", format_failure(result))
+    log.info("%d cas : %d ok, %d échecs, %d erreurs, %d sans attente ; %d exemples de portée non exécutés ; "
+             "%d exécutions de règle (%d en cache) en %.2f s",
+             report["cases"], report["passed"], report["failed"], report["errors"], report["unchecked"],
+             report["scope_examples_skipped"], report["rule_runs"], report["rule_runs_cached"], report["seconds"])
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    raise SystemExit(1 if report["failed"] or report["errors"] else 0)
+
+
+if __name__ == "__main__":
+    main()
+
+__all__ = ["RegressionRunner", "collect_cases", "parse_example", "normalize_label", "rule_fingerprint",
+           "code_fingerprint", "format_failure"]
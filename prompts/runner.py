@@ -9,38 +9,93 @@ import json
 import logging
 from pathlib import Path
 
-from .detector import load_markers, annotate_sentence
+from .compressed_io import open_text
+from .detector import load_markers, annotate_sentence, annotate_threaded
+from .metrics import JsonDumper
+from .shards import SHARD_MODES, ShardReader, parse_shard, write_manifest
+from .types import cues_to_dicts
 
 
 def make_logger(level: str = "INFO") -> logging.Logger:
     logging.basicConfig(level=getattr(logging, level.upper(), logging.INFO))
     return logging.getLogger("prompts.runner")
 
+def to_record(obj: dict) -> dict:
+    """Enregistrement JSONL minimal d'une phrase annotée"""
+    minimal = {"id": obj.get("id"), "text": obj.get("text"), "cues": cues_to_dicts(obj.get("cues", []))}
+    if obj.get("rule_timeouts"):
+        minimal["rule_timeouts"] = obj["rule_timeouts"]
+    return minimal
+
 def main() -> None:
     ap = argparse.ArgumentParser(description="Runner permissif v3 (no-NLP, pipeline renforcé)")
     ap.add_argument("--rules", required=True, help="Chemin dossier rules/")
-    ap.add_argument("--input", required=True, help="Fichier texte (1 phrase/ligne)")
-    ap.add_argument("--output", required=True, help="Sortie JSONL")
+    ap.add_argument("--input", required=True, help="Fichier texte (1 phrase/ligne), éventuellement compressé")
+    ap.add_argument("--output", required=True, help="Sortie JSONL (.jsonl.gz, .jsonl.zst... pour compresser)")
+    ap.add_argument("--compress-level", type=int, default=None, help="Niveau de compression de la sortie")
+    ap.add_argument("--timeout-ms", type=float, default=None,
+                    help="Budget de matching par règle et par phrase (ms) ; options.timeout_ms prime")
+    ap.add_argument("--batch-size", type=int, default=1000,
+                    help="Phrases concaténées par passe de chaque règle (0 : phrase par phrase)")
+    ap.add_argument("--threads", type=int, default=1,
+                    help="Threads de détection par lot (matching regex hors GIL, règles partagées)")
+    ap.add_argument("--metrics-json", default=None,
+                    help="Fichier JSON réécrit périodiquement avec les métriques (phrases/s, cues par groupe...)")
+    ap.add_argument("--metrics-interval", type=float, default=10.0, help="Période du dump des métriques (s)")
+    ap.add_argument("--shard", default=None,
+                    help="Ne traiter que la part i/N du corpus (ids = numéros de ligne d'origine)")
+    ap.add_argument("--shard-mode", choices=SHARD_MODES, default="range",
+                    help="range : tranche d'octets contiguë (entrée non compressée) ; hash : crc32 de la ligne")
     ap.add_argument("--log", default="INFO")
     args = ap.parse_args()
 
     log = make_logger(args.log)
+    shard = parse_shard(args.shard) if args.shard else None
+    reader = ShardReader(args.input, shard, args.shard_mode)
 
     rules_dir = Path(args.rules)
-    markers_by_group = load_markers(rules_dir)
+    markers_by_group = load_markers(rules_dir, default_timeout_ms=args.timeout_ms)
+
+    def write(obj) -> None:
+        fout.write(json.dumps(to_record(obj), ensure_ascii=False) + "\n")
+
+    dumper = JsonDumper(args.metrics_json, args.metrics_interval).start() if args.metrics_json else None
+
+    count = 0
+    pending = []  # (numéro de ligne, phrase) en attente du prochain lot
+
+    def flush() -> None:
+        # annotate_threaded numérote à la suite ; l'id reste le numéro de ligne d'origine
+        texts = [t for _, t in pending]
+        for (lineno, _), obj in zip(pending, annotate_threaded(texts, pending[0][0], markers_by_group, args.threads)):
+            obj["id"] = lineno
+            write(obj)
+        pending.clear()
 
-    sid = 0
-    with open(args.input, "r", encoding="utf-8") as fin, open(args.output, "w", encoding="utf-8") as fout:
-        for line in fin:
-            text = line.strip()
-            if not text:
+    with open_text(args.output, "w", level=args.compress_level) as fout:
+        for lineno, text in reader:
+            count += 1
+            if args.batch_size > 0:
+                pending.append((lineno, text))
+                if len(pending) >= args.batch_size:
+                    flush()
                 continue
-            sid += 1
             seen_intervals = []  # ← réinitialisation ici
-            obj = annotate_sentence(text, sid, markers_by_group, seen_intervals)
-            minimal = {"id": obj.get("id"), "text": obj.get("text"), "cues": obj.get("cues", [])}
-            fout.write(json.dumps(minimal, ensure_ascii=False) + "\n")
-    log.info("Terminé: %d phrases → %s", sid, args.output)
+            write(annotate_sentence(text, lineno, markers_by_group, seen_intervals))
+        if pending:
+            flush()
+    if shard is not None:
+        write_manifest(args.output, reader.manifest())  # Après la sortie complète : shard terminé
+    if dumper is not None:
+        dumper.stop()  # Dernier dump : totaux de l'exécution complète
+    log.info("Terminé: %d phrases%s → %s", count,
+             f" (shard {shard[0]}/{shard[1]}, lignes {reader.first_line}-{reader.last_line})" if shard else "",
+             args.output)
+    for rules in markers_by_group.values():
+        for rule in rules:
+            if rule.get("_overruns"):
+                log.warning("Règle %s : %d phrase(s) ignorée(s) pour dépassement de budget",
+                            rule.get("id", "UNK_RULE"), rule["_overruns"])
 
 if __name__ == "__main__":
     main()
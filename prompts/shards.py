@@ -0,0 +1,362 @@
+"""Partitionnement déterministe d'un corpus et fusion ordonnée des sorties de shards.
+
+`python -m prompts.runner --shard i/N` ne traite que sa part du corpus et garde
+comme id le numéro de ligne d'origine (1-based), quel que soit le shard :
+
+- `range` (défaut) : le shard i prend les lignes dont le premier octet tombe
+  dans la i-ème tranche d'octets du fichier. Chaque nœud ne lit que sa tranche ;
+  le numéro de sa première ligne vient de l'index de lignes (`index`, un compte
+  de sauts de ligne par bloc) s'il est à jour, sinon d'un comptage du préfixe.
+  Fichier non compressé uniquement.
+- `hash` : le shard d'une ligne est crc32(numéro de ligne) mod N (stable d'une
+  machine à l'autre, équilibré même si le corpus répète des phrases) ; chaque
+  nœud lit tout le fichier, compressé ou non.
+
+Chaque shard écrit à côté de sa sortie un manifeste (`<sortie>.manifest.json`)
+décrivant l'entrée et les lignes couvertes. `merge` fusionne les sorties en
+flux (k-way merge par id), vérifie qu'il ne manque ni ne double aucun id
+(manifestes, comptes, et l'entrée elle-même si `--input` est donné) et ne
+publie le résultat que si tout est cohérent.
+
+Usage:
+    python -m prompts.shards index corpus.txt
+    python -m prompts.runner --rules rules --input corpus.txt --output out.2of4.jsonl --shard 2/4
+    python -m prompts.shards merge --output annotations.jsonl out.*of4.jsonl [--input corpus.txt]
+"""
+
+from __future__ import annotations
+import argparse
+import heapq
+import json
+import logging
+import os
+import re
+import time
+import zlib
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .compressed_io import codec_from_name, detect_codec, open_binary, open_text
+
+log = logging.getLogger("prompts.shards")
+
+SHARD_MODES = ("range", "hash")
+LINE_INDEX_BLOCK = 64 << 20   # Octets par bloc de l'index de lignes
+_READ_SIZE = 1 << 20
+_SHARD_RE = re.compile(r"^\s*(\d+)\s*/\s*(\d+)\s*$")
+_LEADING_ID_RE = re.compile(rb'\{\s*"id"\s*:\s*(-?\d+)\s*[,}]')
+
+
+def parse_shard(spec: str) -> Tuple[int, int]:
+    """"i/N" (1 ≤ i ≤ N) → (i, N)"""
+    m = _SHARD_RE.match(spec or "")
+    if not m or not 1 <= int(m.group(1)) <= int(m.group(2)):
+        raise ValueError(f"Shard invalide {spec!r} : attendu i/N avec 1 ≤ i ≤ N")
+    return int(m.group(1)), int(m.group(2))
+
+
+def hash_shard(lineno: int, count: int) -> int:
+    """Shard (1-based) d'une ligne en mode hash"""
+    return zlib.crc32(str(lineno).encode("ascii")) % count + 1
+
+
+def input_fingerprint(path: str) -> Dict[str, Any]:
+    st = os.stat(path)
+    return {"path": os.path.abspath(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+# ----------------------------------------------------------------------
+# Index de lignes (sauts de ligne par bloc)
+# ----------------------------------------------------------------------
+def line_index_path(path: str) -> str:
+    return path + ".lines.json"
+
+
+def build_line_index(path: str, block_size: int = LINE_INDEX_BLOCK) -> Dict[str, Any]:
+    """Compter les sauts de ligne de chaque bloc (une lecture du fichier, partagée par tous les nœuds)"""
+    counts = []
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            counts.append(block.count(b"\n"))
+    index = {"input": input_fingerprint(path), "block_size": block_size, "newlines": counts}
+    tmp = f"{line_index_path(path)}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(index, f)
+    os.replace(tmp, line_index_path(path))
+    return index
+
+
+def _load_line_index(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(line_index_path(path), encoding="utf-8") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    fingerprint = input_fingerprint(path)
+    if {k: index.get("input", {}).get(k) for k in ("size", "mtime_ns")} != \
+            {k: fingerprint[k] for k in ("size", "mtime_ns")}:
+        log.warning("Index de lignes périmé pour %s : comptage direct", path)
+        return None
+    return index
+
+
+def newlines_before(path: str, position: int) -> int:
+    """Nombre de sauts de ligne dans les `position` premiers octets"""
+    count, start = 0, 0
+    index = _load_line_index(path)
+    if index is not None:
+        full = position // index["block_size"]
+        count = sum(index["newlines"][:full])
+        start = full * index["block_size"]
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = position - start
+        while remaining > 0:
+            block = f.read(min(_READ_SIZE, remaining))
+            if not block:
+                break
+            count += block.count(b"\n")
+            remaining -= len(block)
+    return count
+
+
+# ----------------------------------------------------------------------
+# Lecture d'un shard
+# ----------------------------------------------------------------------
+class ShardReader:
+    """(numéro de ligne, texte) des lignes non vides d'un shard, dans l'ordre du fichier.
+
+    Après itération : `first_line`/`last_line` (lignes couvertes, vides comprises),
+    `lines` (lignes parcourues) et `records` (lignes non vides produites).
+    """
+
+    def __init__(self, path: str, shard: Optional[Tuple[int, int]] = None, mode: str = "range"):
+        if mode not in SHARD_MODES:
+            raise ValueError(f"Mode de partitionnement inconnu : {mode}")
+        if shard is not None and mode == "range" and detect_codec(path) is not None:
+            raise ValueError("--shard-mode range exige une entrée non compressée (utiliser --shard-mode hash)")
+        self.path = path
+        self.shard = shard
+        self.mode = mode
+        self.first_line: Optional[int] = None
+        self.last_line = 0
+        self.lines = 0
+        self.records = 0
+
+    def __iter__(self) -> Iterator[Tuple[int, str]]:
+        if self.shard is not None and self.mode == "range":
+            yield from self._iter_range()
+            return
+        index, count = self.shard if self.shard is not None else (1, 1)
+        with open_binary(self.path) as f:
+            for lineno, raw in enumerate(f, 1):
+                self.lines = self.last_line = lineno
+                if self.first_line is None:
+                    self.first_line = lineno
+                text = raw.decode("utf-8").strip()
+                if text and (count == 1 or hash_shard(lineno, count) == index):
+                    self.records += 1
+                    yield lineno, text
+
+    def _iter_range(self) -> Iterator[Tuple[int, str]]:
+        index, count = self.shard
+        size = os.path.getsize(self.path)
+        start, end = size * (index - 1) // count, size * index // count
+        with open(self.path, "rb") as f:
+            if start > 0:
+                f.seek(start - 1)
+                if f.read(1) != b"\n":
+                    f.readline()  # Ligne commencée dans la tranche précédente : pas à nous
+            position = f.tell()
+            lineno = newlines_before(self.path, position) + 1
+            self.first_line = lineno
+            self.last_line = lineno - 1
+            while position < end:
+                raw = f.readline()
+                if not raw:
+                    break
+                position += len(raw)
+                self.lines += 1
+                self.last_line = lineno
+                text = raw.decode("utf-8").strip()
+                if text:
+                    self.records += 1
+                    yield lineno, text
+                lineno += 1
+
+    def manifest(self) -> Dict[str, Any]:
+        index, count = self.shard if self.shard is not None else (1, 1)
+        return {
+            "input": input_fingerprint(self.path),
+            "shard": index,
+            "of": count,
+            "mode": self.mode,
+            "first_line": self.first_line if self.first_line is not None else self.last_line + 1,
+            "last_line": self.last_line,
+            "lines": self.lines,
+            "records": self.records,
+            "finished_at": time.time(),
+        }
+
+
+def manifest_path(output: str) -> str:
+    return output + ".manifest.json"
+
+
+def write_manifest(output: str, manifest: Dict[str, Any]) -> None:
+    """Écrit en dernier, une fois la sortie complète : sa présence vaut shard terminé"""
+    manifest = dict(manifest, output=os.path.abspath(output))
+    tmp = f"{manifest_path(output)}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, manifest_path(output))
+
+
+# ----------------------------------------------------------------------
+# Fusion
+# ----------------------------------------------------------------------
+def _record_id(raw: bytes) -> int:
+    m = _LEADING_ID_RE.match(raw)
+    if m:
+        return int(m.group(1))
+    return int(json.loads(raw)["id"])
+
+
+def _iter_records(path: str, position: int, counts: List[int]) -> Iterator[Tuple[int, int, bytes]]:
+    with open_binary(path) as f:
+        for raw in f:
+            if raw.strip():
+                counts[position] += 1
+                yield _record_id(raw), position, raw if raw.endswith(b"\n") else raw + b"\n"
+
+
+def check_manifests(manifests: List[Dict[str, Any]]) -> List[str]:
+    """Incohérences entre manifestes : entrée, mode, shards manquants ou en double, couverture"""
+    problems = []
+    if not manifests:
+        return ["Aucun manifeste"]
+    first = manifests[0]
+    count, mode = first["of"], first["mode"]
+    for m in manifests:
+        if m["of"] != count or m["mode"] != mode:
+            problems.append(f"{m['output']} : shard {m['shard']}/{m['of']} ({m['mode']}), "
+                            f"attendu …/{count} ({mode})")
+        if {k: m["input"][k] for k in ("size", "mtime_ns")} != {k: first["input"][k] for k in ("size", "mtime_ns")}:
+            problems.append(f"{m['output']} : entrée différente ({m['input']['path']})")
+    shards = sorted(m["shard"] for m in manifests)
+    missing = sorted(set(range(1, count + 1)) - set(shards))
+    if missing:
+        problems.append(f"Shards manquants : {', '.join(map(str, missing))} (sur {count})")
+    duplicates = sorted({s for s in shards if shards.count(s) > 1})
+    if duplicates:
+        problems.append(f"Shards en double : {', '.join(map(str, duplicates))}")
+    if mode == "range" and not missing and not duplicates:
+        expected = 1
+        for m in sorted(manifests, key=lambda m: m["shard"]):
+            if m["first_line"] != expected:
+                problems.append(f"Shard {m['shard']} : commence ligne {m['first_line']}, attendu {expected}")
+            expected = m["last_line"] + 1
+    elif mode == "hash" and len({m["lines"] for m in manifests}) > 1:
+        problems.append("Shards hash n'ayant pas lu le même nombre de lignes")
+    return problems
+
+
+def merge_shards(outputs: List[str], merged: str, input_path: Optional[str] = None,
+                 keep_partial: bool = False, compress_level: Optional[int] = None) -> Dict[str, Any]:
+    """Fusion ordonnée par id (en flux) avec vérification ; renvoie un rapport"""
+    started = time.perf_counter()
+    manifests, problems = [], []
+    for path in outputs:
+        try:
+            with open(manifest_path(path), encoding="utf-8") as f:
+                manifests.append(json.load(f))
+        except (OSError, ValueError):
+            problems.append(f"{path} : manifeste absent ou illisible (shard non terminé ?)")
+    if len(manifests) == len(outputs):
+        problems.extend(check_manifests(manifests))
+
+    counts = [0] * len(outputs)
+    streams = [_iter_records(path, i, counts) for i, path in enumerate(outputs)]
+    expected_ids = ShardReader(input_path) if input_path else None
+    expected_iter = iter(expected_ids) if expected_ids is not None else None
+    duplicates, unordered, missing, unexpected = [], [], [], []
+    previous = None
+    written = 0
+    tmp = f"{merged}.{os.getpid()}.tmp"
+    with open_text(tmp, "w", level=compress_level, codec=codec_from_name(merged)) as out:
+        for doc_id, _, raw in heapq.merge(*streams):
+            if previous is not None and doc_id == previous:
+                duplicates.append(doc_id)
+                continue  # Première occurrence gardée
+            if previous is not None and doc_id < previous:
+                unordered.append(doc_id)  # Sortie de shard non triée
+            previous = doc_id
+            if expected_iter is not None:
+                # Avancer dans l'entrée jusqu'à cet id : les lignes sautées manquent
+                for lineno, _ in expected_iter:
+                    if lineno == doc_id:
+                        break
+                    missing.append(lineno)
+                else:
+                    unexpected.append(doc_id)
+            out.write(raw.decode("utf-8"))
+            written += 1
+        if expected_iter is not None:
+            missing.extend(lineno for lineno, _ in expected_iter)
+
+    if len(manifests) == len(outputs):
+        for path, count, manifest in zip(outputs, counts, manifests):
+            if count != manifest["records"]:
+                problems.append(f"{path} : {count} enregistrement(s), "
+                                f"{manifest['records']} annoncé(s) par le manifeste")
+    for label, ids in (("ids en double", duplicates), ("ids hors ordre", unordered),
+                       ("ids manquants", missing), ("ids absents de l'entrée", unexpected)):
+        if ids:
+            problems.append(f"{len(ids)} {label} : {', '.join(map(str, ids[:10]))}{' …' if len(ids) > 10 else ''}")
+
+    ok = not problems
+    if ok or keep_partial:
+        os.replace(tmp, merged)
+    else:
+        os.remove(tmp)
+    return {"ok": ok, "problems": problems, "shards": len(outputs), "records": written,
+            "output": merged if ok or keep_partial else None, "seconds": round(time.perf_counter() - started, 3)}
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Index de lignes et fusion des sorties de runs partitionnés (--shard)")
+    sub = ap.add_subparsers(dest="command", required=True)
+    p_index = sub.add_parser("index", help="Construire l'index de lignes d'un corpus (mode range sans relire le préfixe)")
+    p_index.add_argument("inputs", nargs="+", help="Corpus texte (non compressés)")
+    p_merge = sub.add_parser("merge", help="Fusionner les sorties des shards dans l'ordre des ids")
+    p_merge.add_argument("shards", nargs="+", help="Sorties JSONL des shards (avec leur .manifest.json)")
+    p_merge.add_argument("--output", required=True, help="JSONL fusionné (.jsonl.gz... pour compresser)")
+    p_merge.add_argument("--input", help="Corpus d'origine : vérifier chaque id contre ses lignes non vides")
+    p_merge.add_argument("--compress-level", type=int, default=None)
+    p_merge.add_argument("--keep-partial", action="store_true", help="Publier la fusion même si la vérification échoue")
+    ap.add_argument("--log", default="INFO")
+    args = ap.parse_args()
+    logging.basicConfig(level=getattr(logging, args.log.upper(), logging.INFO), format="%(message)s")
+
+    if args.command == "index":
+        for path in args.inputs:
+            index = build_line_index(path)
+            log.info("%s : %d ligne(s), %d bloc(s) → %s", path, sum(index["newlines"]), len(index["newlines"]),
+                     line_index_path(path))
+        return
+
+    report = merge_shards(args.shards, args.output, args.input, args.keep_partial, args.compress_level)
+    for problem in report["problems"]:
+        log.error("%s", problem)
+    log.info("%d shard(s), %d enregistrement(s) fusionné(s) en %.2f s%s", report["shards"], report["records"],
+             report["seconds"], f" → {report['output']}" if report["output"] else " ; fusion non publiée")
+    raise SystemExit(0 if report["ok"] else 1)
+
+
+if __name__ == "__main__":
+    main()
+
+__all__ = ["SHARD_MODES", "ShardReader", "parse_shard", "hash_shard", "build_line_index", "newlines_before",
+           "write_manifest", "manifest_path", "check_manifests", "merge_shards"]
@@ -1,5 +1,6 @@
 from __future__ import annotations
-from typing import TypedDict, Optional, Dict, Any
+import sys
+from typing import TypedDict, Optional, Dict, Any, Iterable, List, Tuple
 
 
 class Token(TypedDict):
@@ -28,6 +29,57 @@ class Rule(TypedDict, total=False):
     _guards: Any
 
 
+class CueRecord:
+    """Cue interne du détecteur : slots, chaînes internées, positions à plat.
+
+    Un dict par cue répète ses clés et une liste de tuples par intervalle ; ici
+    `_spans` vaut (s0, e0, s1, e1, ...) et id/groupe/libellé sont partagés entre
+    toutes les instances. Lecture compatible avec l'ancien dict (`c["group"]`,
+    `c.get(...)`) ; `to_dict()` donne la forme JSON à la sérialisation.
+    """
+    __slots__ = ("id", "group", "cue_label", "_spans")
+    _FIELDS = ("id", "cue_label", "positions", "group")
+
+    def __init__(self, id: str, group: str, cue_label: str, positions: Iterable[Tuple[int, int]]):
+        self.id = sys.intern(id)
+        self.group = sys.intern(group)
+        self.cue_label = sys.intern(cue_label) if isinstance(cue_label, str) else cue_label
+        self._spans = tuple(x for span in positions for x in span)
+
+    @property
+    def positions(self) -> List[Tuple[int, int]]:
+        s = self._spans
+        return list(zip(s[::2], s[1::2]))
+
+    def __getitem__(self, key: str):
+        if key not in self._FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key: str, default=None):
+        return getattr(self, key) if key in self._FIELDS else default
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, CueRecord):
+            return (self.id, self.group, self.cue_label, self._spans) == (other.id, other.group, other.cue_label, other._spans)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"CueRecord({self.id!r}, {self.group!r}, {self.cue_label!r}, {self.positions!r})"
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"id": self.id, "cue_label": self.cue_label, "positions": self.positions, "group": self.group}
+
+    @classmethod
+    def from_dict(cls, d: Dict[str, Any]) -> "CueRecord":
+        return cls(d.get("id", "UNK_RULE"), d.get("group", "unknown"), d.get("cue_label"), d.get("positions") or [])
+
+
+def cues_to_dicts(cues: Iterable[Any]) -> List[Dict[str, Any]]:
+    """Forme JSON d'une liste de cues (records ou dicts déjà sérialisés)"""
+    return [c.to_dict() if isinstance(c, CueRecord) else c for c in cues]
+
+
 class Strategy(TypedDict, total=False):
     id: str
     scope_strategy: str
@@ -35,4 +87,4 @@ class Strategy(TypedDict, total=False):
     guards: Any
 
 
-__all__ = ["Token", "Cue", "Rule", "Strategy"]
+__all__ = ["Token", "Cue", "Rule", "Strategy", "CueRecord", "cues_to_dicts"]
@@ -0,0 +1,368 @@
+"""Annotation continue d'un dossier de corpus bruts (mode surveillance).
+
+Le dossier d'entrée (`data/corpus_raw/` par défaut) est relu toutes les
+`--interval` secondes (listdir + stat : coût quasi nul au repos). Un manifeste
+(`<sortie>/.watch_manifest.json`) garde pour chaque fichier sa taille, son
+mtime, l'empreinte SHA-1 des octets déjà annotés et l'empreinte de la base de
+règles (contenu des YAML de 10_markers + code du détecteur) :
+
+- fichier nouveau, réécrit ou annoté avec une autre base → annotation complète ;
+- fichier qui a grandi et dont le début est inchangé → seules les lignes
+  ajoutées sont annotées et ajoutées à la sortie ;
+- stat inchangé → rien (pas de relecture).
+
+Seules les lignes complètes sont traitées ; une dernière ligne sans saut de
+ligne attend que le fichier soit stable depuis `--settle` secondes. Les ids
+sont les numéros de ligne d'origine, comme pour `prompts.runner`. Chaque
+sortie est écrite à côté puis publiée par `os.replace`, et le manifeste
+seulement ensuite : un arrêt brutal refait au pire le dernier fichier.
+
+Usage:
+    python -m prompts.watch --rules rules [--input-dir data/corpus_raw] [--output-dir data/corpus_annotated]
+    python -m prompts.watch --rules rules --once      # une passe puis sortie
+"""
+
+from __future__ import annotations
+import argparse
+import fnmatch
+import hashlib
+import itertools
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .compressed_io import CODECS, codec_from_name, detect_codec, open_text
+from .detector import annotate_batch
+from .loaders import _iter_yaml_files, load_markers
+from .metrics import REGISTRY, JsonDumper
+from .regression import code_fingerprint
+from .runner import to_record
+from .shards import ShardReader
+
+log = logging.getLogger("prompts.watch")
+
+MANIFEST_VERSION = 1
+MANIFEST_NAME = ".watch_manifest.json"
+_READ_SIZE = 1 << 20
+
+FILES = REGISTRY.counter("annotator_watch_files_total", "Fichiers traités par le mode surveillance", ["action"])
+
+
+def output_name(name: str, suffix: str = ".jsonl") -> str:
+    """corpus.txt.gz → corpus.jsonl"""
+    codec = codec_from_name(name)
+    if codec is not None:
+        name = name[:-len(CODECS[codec][0])]
+    return os.path.splitext(name)[0] + suffix
+
+
+class Watcher:
+    def __init__(self, rules_dir: str, input_dir: str, output_dir: str, manifest_path: Optional[str] = None,
+                 pattern: str = "*.txt*", batch_size: int = 1000, timeout_ms: Optional[float] = None,
+                 settle: float = 2.0, output_suffix: str = ".jsonl", compress_level: Optional[int] = None):
+        self.rules_dir = Path(rules_dir)
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.manifest_path = manifest_path or os.path.join(output_dir, MANIFEST_NAME)
+        self.pattern = pattern
+        self.batch_size = max(batch_size, 1)
+        self.timeout_ms = timeout_ms
+        self.settle = settle
+        self.output_suffix = output_suffix
+        self.compress_level = compress_level
+        self.manifest = self._load_manifest()
+        self._rules_stat: Optional[Tuple] = None
+        self._rules_fp: Optional[str] = None
+        self._markers: Optional[Dict[str, List[Dict[str, Any]]]] = None
+        self._markers_fp: Optional[str] = None
+        self._failed: Dict[str, Tuple[int, int]] = {}  # Fichiers en erreur : réessayés quand leur stat change
+        self._stop = threading.Event()
+
+    # ------------------------------------------------------------------
+    # Manifeste
+    # ------------------------------------------------------------------
+    def _load_manifest(self) -> Dict[str, Any]:
+        try:
+            with open(self.manifest_path, encoding="utf-8") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return {"version": MANIFEST_VERSION, "files": {}}
+        except (OSError, ValueError) as e:
+            log.warning("Manifeste illisible (%s), tout sera réannoté : %s", self.manifest_path, e)
+            return {"version": MANIFEST_VERSION, "files": {}}
+        if manifest.get("version") != MANIFEST_VERSION:
+            return {"version": MANIFEST_VERSION, "files": {}}
+        return manifest
+
+    def _save_manifest(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.manifest_path)), exist_ok=True)
+        tmp = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.manifest_path)
+
+    # ------------------------------------------------------------------
+    # Base de règles
+    # ------------------------------------------------------------------
+    def rules_fingerprint(self) -> str:
+        """SHA-1 du code du détecteur et du contenu des YAML (recalculé seulement si leur stat change)"""
+        files = _iter_yaml_files(self.rules_dir / "10_markers")
+        stat = tuple((str(p), p.stat().st_mtime_ns, p.stat().st_size) for p in files)
+        if stat != self._rules_stat:
+            h = hashlib.sha1(code_fingerprint().encode("ascii"))
+            h.update(repr(self.timeout_ms).encode("ascii"))
+            for p in files:
+                h.update(p.name.encode("utf-8") + b"\0" + p.read_bytes() + b"\0")
+            self._rules_stat, self._rules_fp = stat, h.hexdigest()
+        return self._rules_fp
+
+    def markers(self, fingerprint: str) -> Dict[str, List[Dict[str, Any]]]:
+        if self._markers is None or self._markers_fp != fingerprint:
+            self._markers = load_markers(self.rules_dir, default_timeout_ms=self.timeout_ms)
+            if self._markers_fp is not None:
+                log.info("Base de règles modifiée : les fichiers seront réannotés")
+            self._markers_fp = fingerprint
+        return self._markers
+
+    # ------------------------------------------------------------------
+    # Passe de surveillance
+    # ------------------------------------------------------------------
+    def scan(self) -> Dict[str, os.stat_result]:
+        found = {}
+        try:
+            names = sorted(os.listdir(self.input_dir))
+        except FileNotFoundError:
+            return found
+        for name in names:
+            if name.startswith(".") or not fnmatch.fnmatch(name, self.pattern):
+                continue
+            try:
+                st = os.stat(os.path.join(self.input_dir, name))
+            except OSError:
+                continue
+            if os.path.isfile(os.path.join(self.input_dir, name)):
+                found[name] = st
+        return found
+
+    def poll_once(self) -> Dict[str, List[str]]:
+        """Traiter les fichiers nouveaux ou modifiés ; renvoie les noms par action"""
+        summary: Dict[str, List[str]] = {"annotated": [], "appended": [], "removed": [], "failed": []}
+        fingerprint = self.rules_fingerprint()
+        files = self.scan()
+        entries = self.manifest["files"]
+        for name in [n for n in entries if n not in files]:
+            log.info("%s retiré du dossier : sortie conservée, entrée du manifeste supprimée", name)
+            del entries[name]
+            summary["removed"].append(name)
+        for name, st in files.items():
+            entry = entries.get(name)
+            key = (st.st_size, st.st_mtime_ns)
+            if entry is not None and entry["rules"] == fingerprint and (entry["size"], entry["mtime_ns"]) == key \
+                    and not entry.get("tail") and os.path.exists(os.path.join(self.output_dir, entry["output"])):
+                continue
+            if entry is not None and entry.get("tail") and (entry["size"], entry["mtime_ns"]) == key \
+                    and time.time() - st.st_mtime < self.settle:
+                continue  # Dernière ligne encore incomplète : attendre que le fichier soit stable
+            if self._failed.get(name) == key:
+                continue
+            try:
+                action = self._process(name, st, entry, fingerprint)
+            except Exception as e:
+                log.error("Erreur sur %s (nouvel essai quand le fichier changera) : %s: %s",
+                          name, type(e).__name__, e)
+                self._failed[name] = key
+                summary["failed"].append(name)
+                FILES.inc(1, ("failed",))
+                continue
+            self._failed.pop(name, None)
+            if action is not None:
+                summary[action].append(name)
+                FILES.inc(1, (action,))
+        if summary["removed"]:
+            self._save_manifest()
+        return summary
+
+    def _process(self, name: str, st: os.stat_result, entry: Optional[Dict[str, Any]],
+                 fingerprint: str) -> Optional[str]:
+        path = os.path.join(self.input_dir, name)
+        output = entry["output"] if entry is not None else output_name(name, self.output_suffix)
+        output_path = os.path.join(self.output_dir, output)
+        stable = time.time() - st.st_mtime >= self.settle
+        if detect_codec(path) is not None:
+            if not stable:
+                return None  # Archive en cours d'écriture
+            return self._annotate_compressed(name, path, st, output, output_path, fingerprint)
+
+        # Reprise possible si la base est la même, la sortie présente et le début du fichier inchangé
+        resume = (entry is not None and entry["rules"] == fingerprint and not entry.get("partial")
+                  and entry.get("offset", 0) <= st.st_size and os.path.exists(output_path))
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            if resume:
+                remaining = entry["offset"]
+                while remaining > 0:
+                    block = f.read(min(_READ_SIZE, remaining))
+                    if not block:
+                        break
+                    h.update(block)
+                    remaining -= len(block)
+                resume = remaining == 0 and h.hexdigest() == entry["sha1"]
+                if not resume:
+                    log.info("%s modifié en amont de la partie annotée : réannotation complète", name)
+                    f.seek(0)
+                    h = hashlib.sha1()
+            offset, lineno, records = (entry["offset"], entry["lines"], entry["records"]) if resume else (0, 0, 0)
+            lines = _complete_lines(f, h, lineno + 1, include_partial=stable)
+            first = next(lines, None)
+            if resume and first is None:
+                # Rien de nouveau (touch, ou ligne incomplète en cours d'écriture) : sortie intacte
+                action, new_records, consumed, partial = None, 0, 0, False
+            else:
+                action = "appended" if resume else "annotated"
+                lines = itertools.chain([first] if first is not None else [], lines)
+                new_records, lineno, consumed, partial = self._write(lines, lineno, output_path, resume,
+                                                                     fingerprint)
+        self.manifest["files"][name] = {
+            "size": st.st_size, "mtime_ns": st.st_mtime_ns, "rules": fingerprint, "output": output,
+            "offset": offset + consumed, "sha1": h.hexdigest(), "lines": lineno, "records": records + new_records,
+            "partial": partial, "updated_at": time.time(),
+            # Ligne incomplète laissée de côté : à reprendre même si le stat ne change plus
+            "tail": offset + consumed < st.st_size,
+        }
+        self._save_manifest()
+        if action is not None:
+            log.info("%s : %d phrase(s) %s → %s", name, new_records,
+                     "ajoutée(s)" if resume else "annotée(s)", output_path)
+        return action
+
+    def _annotate_compressed(self, name: str, path: str, st: os.stat_result, output: str, output_path: str,
+                             fingerprint: str) -> str:
+        reader = ShardReader(path)
+        new_records, _, _, _ = self._write(((lineno, text, 0, True) for lineno, text in reader), 0, output_path,
+                                           False, fingerprint)
+        self.manifest["files"][name] = {
+            "size": st.st_size, "mtime_ns": st.st_mtime_ns, "rules": fingerprint, "output": output,
+            "lines": reader.lines, "records": new_records, "partial": True, "updated_at": time.time(),
+        }
+        self._save_manifest()
+        log.info("%s : %d phrase(s) annotée(s) → %s", name, new_records, output_path)
+        return "annotated"
+
+    def _write(self, lines: Iterator[Tuple[int, str, int, bool]], lineno: int, output_path: str, append: bool,
+               fingerprint: str) -> Tuple[int, int, int, bool]:
+        """Annoter (numéro, texte, octets, terminée) et publier la sortie.
+
+        Renvoie (phrases, dernière ligne, octets consommés, dernière ligne sans saut de ligne).
+        """
+        markers_by_group = self.markers(fingerprint)
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        tmp = f"{output_path}.{os.getpid()}.tmp"
+        codec = codec_from_name(output_path)
+        if append:
+            shutil.copyfile(output_path, tmp)  # Copie sans réannotation ; l'original reste lisible jusqu'au replace
+        records = consumed = 0
+        partial = False
+        pending: List[Tuple[int, str]] = []
+
+        def flush() -> None:
+            for (number, _), obj in zip(pending, annotate_batch([t for _, t in pending], pending[0][0],
+                                                                markers_by_group)):
+                obj["id"] = number
+                fout.write(json.dumps(to_record(obj), ensure_ascii=False) + "\n")
+            pending.clear()
+
+        try:
+            with open_text(tmp, "a" if append else "w", level=self.compress_level, codec=codec) as fout:
+                for lineno, text, size, terminated in lines:
+                    consumed += size
+                    partial = not terminated
+                    if text:
+                        records += 1
+                        pending.append((lineno, text))
+                        if len(pending) >= self.batch_size:
+                            flush()
+                if pending:
+                    flush()
+            os.replace(tmp, output_path)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        return records, lineno, consumed, partial
+
+    # ------------------------------------------------------------------
+    # Boucle
+    # ------------------------------------------------------------------
+    def run(self, interval: float = 2.0) -> None:
+        log.info("Surveillance de %s (toutes les %.1f s) → %s", self.input_dir, interval, self.output_dir)
+        while True:
+            self.poll_once()
+            if self._stop.wait(interval):
+                return
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def _complete_lines(f, h, first_line: int, include_partial: bool) -> Iterator[Tuple[int, str, int, bool]]:
+    """(numéro, texte, octets, terminée) des lignes de `f` à partir de sa position.
+
+    `h` reçoit les octets consommés. Une dernière ligne sans saut de ligne n'est
+    produite que si `include_partial` ; sinon elle est laissée pour la passe suivante.
+    """
+    for number, raw in enumerate(f, first_line):
+        terminated = raw.endswith(b"\n")
+        if not terminated and not include_partial:
+            return
+        h.update(raw)
+        yield number, raw.decode("utf-8").strip(), len(raw), terminated
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Annotation continue des fichiers nouveaux ou modifiés d'un dossier")
+    ap.add_argument("--rules", required=True, help="Chemin dossier rules/")
+    ap.add_argument("--input-dir", default="data/corpus_raw", help="Dossier surveillé (1 phrase/ligne par fichier)")
+    ap.add_argument("--output-dir", default="data/corpus_annotated", help="Dossier des sorties JSONL")
+    ap.add_argument("--manifest", default=None, help=f"Manifeste (défaut : <output-dir>/{MANIFEST_NAME})")
+    ap.add_argument("--pattern", default="*.txt*", help="Motif des fichiers surveillés (compressés acceptés)")
+    ap.add_argument("--output-suffix", default=".jsonl", help="Suffixe des sorties (.jsonl.gz... pour compresser)")
+    ap.add_argument("--compress-level", type=int, default=None)
+    ap.add_argument("--interval", type=float, default=2.0, help="Période de scrutation du dossier (s)")
+    ap.add_argument("--settle", type=float, default=2.0,
+                    help="Ancienneté minimale (s) avant de traiter une dernière ligne sans saut de ligne ou une archive")
+    ap.add_argument("--once", action="store_true", help="Une seule passe puis sortie")
+    ap.add_argument("--batch-size", type=int, default=1000, help="Phrases par lot du détecteur")
+    ap.add_argument("--timeout-ms", type=float, default=None, help="Budget de matching par règle et par phrase (ms)")
+    ap.add_argument("--metrics-json", default=None, help="Fichier JSON réécrit périodiquement avec les métriques")
+    ap.add_argument("--metrics-interval", type=float, default=10.0)
+    ap.add_argument("--log", default="INFO")
+    args = ap.parse_args()
+    logging.basicConfig(level=getattr(logging, args.log.upper(), logging.INFO), format="%(message)s")
+
+    watcher = Watcher(args.rules, args.input_dir, args.output_dir, args.manifest, args.pattern, args.batch_size,
+                      args.timeout_ms, args.settle, args.output_suffix, args.compress_level)
+    dumper = JsonDumper(args.metrics_json, args.metrics_interval).start() if args.metrics_json else None
+    try:
+        if args.once:
+            summary = watcher.poll_once()
+            log.info("%s", ", ".join(f"{len(v)} {k}" for k, v in summary.items()))
+        else:
+            watcher.run(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if dumper is not None:
+            dumper.stop()
+
+
+if __name__ == "__main__":
+    main()
+
+__all__ = ["Watcher", "output_name", "MANIFEST_NAME"]
@@ -3,13 +3,36 @@
  * Logique métier pour la gestion des annotations
  */
 
+/**
+ * Empreinte courte d'une valeur JSON (FNV-1a 32 bits et longueur)
+ */
+function fieldHash(value) {
+  const json = JSON.stringify(value) ?? '';
+  let hash = 0x811c9dc5;
+  for (let i = 0; i < json.length; i++) {
+    hash ^= json.charCodeAt(i);
+    hash = Math.imul(hash, 0x01000193);
+  }
+  return `${json.length}:${hash >>> 0}`;
+}
+
 class AnnotationManager {
   constructor() {
     this.annotations = [];
+    this.loadedHashes = []; // Empreinte de chaque champ tel que reçu du serveur (base des différences)
     this.currentIndex = 0;
     this.editedAnnotations = new Map();
     this.availableFiles = [];
     this.currentFile = null;
+    // Sauvegardes regroupées en lots (champs modifiés seulement), persistées dans le navigateur
+    this.saveQueue = new SaveQueue({
+      onSaved: (result, entries) => this.handleSaved(result, entries),
+      onRejected: (reports) => this.handleRejected(reports),
+      onError: (error, delay) => window.ui?.showFeedback(
+        `Sauvegarde différée (${this.saveQueue.size} en attente), nouvel essai dans ${Math.round(delay / 1000)} s`,
+        'warning'
+      )
+    });
   }
 
   /**
@@ -23,6 +46,7 @@ class AnnotationManager {
       }
       
       this.availableFiles = await response.json();
+      this.currentFile ??= this.availableFiles.find(file => file.is_current)?.filename ?? null;
       return this.availableFiles;
     } catch (error) {
       console.error('Erreur lors du chargement des fichiers:', error);
@@ -31,6 +55,22 @@ class AnnotationManager {
     }
   }
 
+  /**
+   * Demander au serveur de préparer un fichier avant le changement effectif
+   */
+  async prefetchFile(filename) {
+    if (!filename || filename === this.currentFile) return;
+    try {
+      await fetch('/api/prefetch', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ filename: filename })
+      });
+    } catch (error) {
+      console.warn('Préchargement impossible:', error); // Le changement fonctionnera quand même
+    }
+  }
+
   /**
    * Changer le fichier de données actuel
    */
@@ -77,45 +117,52 @@ class AnnotationManager {
   }
 
   /**
-   * Charger les annotations depuis l'API
+   * Charger les annotations depuis l'API (NDJSON lu au fil de l'eau)
+   * onProgress(annotations) est appelé dès les premiers documents reçus, puis à chaque bloc
    */
-  async loadAnnotations() {
+  async loadAnnotations(onProgress = null) {
     try {
       console.log('loadAnnotations: Début du chargement depuis l\'API');
       
-      const response = await fetch('/api/annotations');
+      const response = await fetch('/api/annotations?format=ndjson');
       if (!response.ok) {
         throw new Error(`Erreur HTTP: ${response.status}`);
       }
       
-      const rawData = await response.json();
-      console.log('loadAnnotations: Données brutes reçues:', rawData);
-      console.log('loadAnnotations: Nombre d\'annotations:', rawData.length);
-      
-      if (rawData.length > 0) {
-        console.log('loadAnnotations: Première annotation:', rawData[0]);
-        console.log('loadAnnotations: Premier text existe:', !!rawData[0].text);
-        console.log('loadAnnotations: Premier text content:', rawData[0].text ? rawData[0].text.substring(0, 100) : 'UNDEFINED');
-      }
-      
-      this.annotations = rawData;
-      
-      // Assurer la compatibilité des portées et calculer les positions
-      this.annotations.forEach((annotation, index) => {
-        console.log(`loadAnnotations: Traitement annotation ${index + 1}:`, annotation.id);
-        console.log(`loadAnnotations: Text existe avant traitement:`, !!annotation.text);
-        
+      this.annotations = [];
+      this.loadedHashes = [];
+      const addLine = (line) => {
+        if (!line.trim()) return;
+        const annotation = JSON.parse(line);
+        this.loadedHashes.push(this.fieldHashes(annotation)); // Avant tout recalcul côté navigateur
+        // Assurer la compatibilité des portées et calculer les positions
         if (!annotation.scopes) {
           annotation.scopes = [];
         } else {
-          // Calculer les positions des portées si elles n'existent pas
           annotation.scopes = this.calculateScopePositions(annotation.text, annotation.scopes);
         }
-        
-        console.log(`loadAnnotations: Text existe après traitement:`, !!annotation.text);
-      });
+        this.annotations.push(annotation);
+      };
+
+      if (response.body && response.body.getReader) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let pending = '';
+        while (true) {
+          const { done, value } = await reader.read();
+          if (done) break;
+          pending += decoder.decode(value, { stream: true });
+          const lines = pending.split('\n');
+          pending = lines.pop(); // Dernière ligne éventuellement incomplète
+          lines.forEach(addLine);
+          if (onProgress && lines.length) onProgress(this.annotations);
+        }
+        addLine(pending + decoder.decode());
+      } else {
+        (await response.text()).split('\n').forEach(addLine);
+      }
       
-      console.log('loadAnnotations: Annotations finales:', this.annotations);
+      console.log('loadAnnotations: Nombre d\'annotations:', this.annotations.length);
       
       window.ui?.showFeedback('Annotations chargées', 'success');
       return this.annotations;
@@ -143,6 +190,26 @@ class AnnotationManager {
     }
   }
 
+  /**
+   * Rechercher côté serveur (ex: 'rule:PREP_SANS_CORE', 'group:bipartite label:"ne plus"')
+   * Chaque résultat porte `_position`, l'index du document dans le fichier courant
+   */
+  async search(query, offset = 0, limit = 50) {
+    try {
+      const params = new URLSearchParams({ q: query, offset, limit });
+      const response = await fetch(`/api/search?${params}`);
+      const result = await response.json();
+      if (!response.ok) {
+        throw new Error(result.message || `Erreur HTTP: ${response.status}`);
+      }
+      return result;
+    } catch (error) {
+      console.error('Erreur lors de la recherche:', error);
+      window.ui?.showFeedback(`Recherche: ${error.message}`, 'error');
+      return { total: 0, offset, limit, results: [] };
+    }
+  }
+
   /**
    * Obtenir l'annotation actuelle (éditée ou originale)
    */
@@ -267,7 +334,68 @@ class AnnotationManager {
   }
 
   /**
-   * Sauvegarder l'annotation actuelle
+   * Relancer les règles (base chargée côté serveur) sur le document actuel :
+   * les cues sont remplacés, les portées conservées
+   */
+  async reannotateCurrent() {
+    const annotation = this.getCurrentAnnotation();
+    if (!annotation) return false;
+    try {
+      const response = await fetch('/api/annotate', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ id: annotation.id, text: annotation.text })
+      });
+      const result = await response.json();
+      if (!response.ok || result.status !== 'success') {
+        throw new Error(result.message || `Erreur HTTP: ${response.status}`);
+      }
+      annotation.cues = result.annotations[0].cues;
+      this.markAsEdited(annotation);
+      window.ui?.showFeedback(
+        `${annotation.cues.length} cue(s) — règles v${result.rules_version} (${result.elapsed_ms} ms)`,
+        'success'
+      );
+      return true;
+    } catch (error) {
+      console.error('Erreur lors de la ré-annotation:', error);
+      window.ui?.showFeedback(`Ré-annotation: ${error.message}`, 'error');
+      return false;
+    }
+  }
+
+  /**
+   * Empreintes des champs d'un document (id et validated_at exclus)
+   */
+  fieldHashes(annotation) {
+    const hashes = {};
+    for (const [field, value] of Object.entries(annotation)) {
+      if (field !== 'id' && field !== 'validated_at') hashes[field] = fieldHash(value);
+    }
+    return hashes;
+  }
+
+  /**
+   * Champs modifiés par rapport au document reçu du serveur
+   */
+  changedFields(index, annotation) {
+    const loaded = this.loadedHashes[index] || {};
+    const changes = {};
+    for (const [field, hash] of Object.entries(this.fieldHashes(annotation))) {
+      if (loaded[field] !== hash) changes[field] = annotation[field];
+    }
+    return changes;
+  }
+
+  /**
+   * Mettre un document en file de sauvegarde
+   */
+  queueAnnotation(index, annotation) {
+    this.saveQueue.enqueue(this.currentFile, annotation.id, index, this.changedFields(index, annotation));
+  }
+
+  /**
+   * Sauvegarder l'annotation actuelle (envoyée avec le prochain lot)
    */
   async saveCurrentAnnotation() {
     const annotation = this.getCurrentAnnotation();
@@ -276,62 +404,59 @@ class AnnotationManager {
       return false;
     }
 
-    return await this.saveAnnotations([annotation]);
+    this.queueAnnotation(this.currentIndex, annotation);
+    window.ui?.showFeedback(`Annotation mise en file (${this.saveQueue.size} en attente)`, 'info', 1500);
+    return true;
   }
 
   /**
-   * Sauvegarder toutes les annotations éditées
+   * Sauvegarder toutes les annotations éditées (envoi immédiat de toute la file)
    */
   async saveAllEdited() {
-    const editedList = Array.from(this.editedAnnotations.values());
-    
-    if (editedList.length === 0) {
+    if (this.editedAnnotations.size === 0 && this.saveQueue.size === 0) {
       window.ui?.showFeedback('Aucune modification à sauvegarder', 'warning');
       return false;
     }
 
-    return await this.saveAnnotations(editedList);
+    for (const [index, annotation] of this.editedAnnotations) {
+      this.queueAnnotation(index, annotation);
+    }
+    const outcome = await this.saveQueue.flush();
+    return !outcome.failed && outcome.rejected === 0;
   }
 
   /**
-   * Sauvegarder des annotations via l'API
+   * Lot enregistré : les éditions envoyées deviennent la version affichée
    */
-  async saveAnnotations(annotations) {
-    try {
-      const response = await fetch('/api/save', {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify(annotations)
-      });
-
-      if (!response.ok) {
-        throw new Error(`Erreur HTTP: ${response.status}`);
-      }
-
-      const result = await response.json();
-      
-      if (result.status === 'success') {
-        window.ui?.showFeedback(
-          `${result.saved_count} annotation(s) sauvegardée(s). Total validé: ${result.total_validated}`,
-          'success'
-        );
-        
-        // Nettoyer les éditions sauvegardées si c'était toutes les éditions
-        if (annotations.length === this.editedAnnotations.size) {
-          this.editedAnnotations.clear();
-        }
-        
-        return true;
-      } else {
-        throw new Error(result.message || 'Erreur de sauvegarde');
-      }
-    } catch (error) {
-      console.error('Erreur lors de la sauvegarde:', error);
-      window.ui?.showFeedback(`Erreur: ${error.message}`, 'error');
-      return false;
+  handleSaved(result, entries) {
+    for (const entry of entries) {
+      if (entry.file !== this.currentFile) continue;
+      const edited = this.editedAnnotations.get(entry.position);
+      // Édition modifiée depuis l'envoi : elle reste à sauvegarder
+      if (!edited || edited.id !== entry.id) continue;
+      if (fieldHash(this.changedFields(entry.position, edited)) !== fieldHash(entry.changes)) continue;
+      this.annotations[entry.position] = edited;
+      this.editedAnnotations.delete(entry.position);
     }
+    if (!result.rejected?.length) {
+      window.ui?.showFeedback(
+        `${result.saved_count} annotation(s) sauvegardée(s). Total validé: ${result.total_validated}`,
+        'success'
+      );
+    }
+    window.dispatchEvent(new CustomEvent('annotations:saved', { detail: result }));
+  }
+
+  /**
+   * Documents refusés par la validation serveur : les éditions restent en place pour correction
+   */
+  handleRejected(reports) {
+    const first = reports[0];
+    console.error('Annotations refusées:', reports);
+    window.ui?.showFeedback(
+      `${reports.length} annotation(s) refusée(s) (doc ${first.id} : ${first.errors[0].message})`,
+      'warning'
+    );
   }
 
   /**
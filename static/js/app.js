@@ -19,16 +19,22 @@ class AutoAnnotatorApp {
       const files = await window.annotations.loadAvailableFiles();
       window.ui.updateFileList(files);
       
-      // Charger les données du fichier actuel
-      const annotations = await window.annotations.loadAnnotations();
+      // Charger les données du fichier actuel : le premier document s'affiche dès sa réception
+      let shown = false;
+      const annotations = await window.annotations.loadAnnotations((partial) => {
+        if (!shown && partial.length > 0) {
+          shown = true;
+          this.showDocument(0);
+        }
+      });
       
       // Vérifier que les annotations sont bien chargées
       if (annotations && annotations.length > 0) {
         // Mettre à jour la liste des documents dans la sidebar
-        window.ui.renderDocumentList(annotations, 0);
+        window.ui.renderDocumentList(annotations, window.annotations.currentIndex);
         
-        // Afficher le premier document
-        this.showDocument(0);
+        // Afficher le premier document (compteur et liste complets)
+        this.showDocument(window.annotations.currentIndex);
       } else {
         console.warn('Aucune annotation chargée');
         window.ui.showFeedback('Aucune annotation trouvée', 'warning');
@@ -288,29 +294,26 @@ class AutoAnnotatorApp {
   }
 
   /**
-   * Sauvegarder l'annotation actuelle
+   * Sauvegarder l'annotation actuelle (mise en file, envoyée avec le prochain lot)
    */
   async saveCurrentAnnotation() {
-    const success = await window.annotations.saveCurrentAnnotation();
-    if (success) {
-      // Rafraîchir les statistiques
-      const stats = await window.annotations.loadStats();
-      window.ui.updateStats(stats);
-    }
-    return success;
+    return await window.annotations.saveCurrentAnnotation();
   }
 
   /**
    * Sauvegarder toutes les annotations éditées
    */
   async saveAllEdited() {
-    const success = await window.annotations.saveAllEdited();
-    if (success) {
-      // Rafraîchir les statistiques
-      const stats = await window.annotations.loadStats();
-      window.ui.updateStats(stats);
-    }
-    return success;
+    return await window.annotations.saveAllEdited();
+  }
+
+  /**
+   * Lot enregistré par la file de sauvegarde : statistiques et liste à jour
+   */
+  async handleSaved() {
+    const stats = await window.annotations.loadStats();
+    window.ui.updateStats(stats);
+    this.refreshCurrentDocument();
   }
 
   /**
@@ -328,6 +331,8 @@ class AutoAnnotatorApp {
    * Attacher les événements
    */
   attachEventListeners() {
+    window.addEventListener('annotations:saved', () => this.handleSaved());
+
     // Sélection de fichier - Version avec délai pour être sûr que le DOM est prêt
     setTimeout(() => {
       const loadFileBtn = document.getElementById('load-file');
@@ -443,6 +448,18 @@ class AutoAnnotatorApp {
       });
     }
 
+    // Ré-annotation avec les règles courantes du serveur
+    const reannotateBtn = document.getElementById('reannotate-current');
+    if (reannotateBtn) {
+      reannotateBtn.addEventListener('click', async () => {
+        reannotateBtn.disabled = true;
+        if (await window.annotations.reannotateCurrent()) {
+          this.refreshCurrentDocument();
+        }
+        reannotateBtn.disabled = false;
+      });
+    }
+
     // Raccourcis clavier globaux
     document.addEventListener('keydown', (e) => {
       // Navigation avec Ctrl + flèches
@@ -0,0 +1,214 @@
+/**
+ * Auto Annotator v1.1 - File de sauvegarde
+ * Les documents validés sont mis en file puis envoyés par lots à /api/save/bulk
+ * (champs modifiés seulement) : dès maxBatch documents, sinon debounceMs après la
+ * dernière mise en file et au plus tard maxWaitMs après la première.
+ * La file est conservée dans localStorage : une page fermée ou hors ligne la
+ * renvoie au prochain chargement. Échec réseau ou serveur : nouvel essai avec
+ * délai exponentiel, et dès le retour en ligne.
+ */
+
+class SaveQueue {
+  constructor(options = {}) {
+    this.endpoint = options.endpoint || '/api/save/bulk';
+    this.storageKey = options.storageKey || 'autoAnnotator.saveQueue';
+    this.maxBatch = options.maxBatch || 50;
+    this.debounceMs = options.debounceMs ?? 2000;
+    this.maxWaitMs = options.maxWaitMs ?? 10000;
+    this.retryBaseMs = options.retryBaseMs ?? 1000;
+    this.retryMaxMs = options.retryMaxMs ?? 60000;
+    this.onSaved = options.onSaved || null;       // (résultat, entrées enregistrées)
+    this.onRejected = options.onRejected || null; // (rapports de validation, entrées refusées)
+    this.onError = options.onError || null;       // (erreur, délai avant nouvel essai)
+
+    this.pending = new Map(); // [fichier, id] -> { file, id, position, changes, version }
+    this.version = 0;
+    this.timer = null;
+    this.firstQueuedAt = null;
+    this.retryDelay = 0;       // Délai du dernier essai (doublé à chaque échec)
+    this.waitingRetry = false; // Nouvel essai programmé : pas d'envoi anticipé par le debounce
+    this.inFlight = null;
+    this.failedBatch = null; // { id, signature } : un lot réessayé à l'identique garde son identifiant
+
+    this.restore();
+    window.addEventListener('online', () => this.flush());
+    document.addEventListener('visibilitychange', () => {
+      if (document.visibilityState === 'hidden') this.flush({ keepalive: true });
+    });
+  }
+
+  get size() {
+    return this.pending.size;
+  }
+
+  static key(file, id) {
+    return JSON.stringify([file, id]); // Distingue 1 et "1"
+  }
+
+  /**
+   * Mettre un document en file (remplace une version encore en attente)
+   */
+  enqueue(file, id, position, changes) {
+    this.pending.set(SaveQueue.key(file, id), { file, id, position, changes, version: ++this.version });
+    if (this.firstQueuedAt === null) this.firstQueuedAt = Date.now();
+    this.persist();
+    this.schedule();
+  }
+
+  schedule() {
+    if (!this.pending.size || this.waitingRetry) return;
+    if (this.pending.size >= this.maxBatch) {
+      this.flush();
+      return;
+    }
+    clearTimeout(this.timer);
+    const deadline = (this.firstQueuedAt ?? Date.now()) + this.maxWaitMs;
+    const delay = Math.max(0, Math.min(this.debounceMs, deadline - Date.now()));
+    this.timer = setTimeout(() => this.flush(), delay);
+  }
+
+  /**
+   * Envoyer la file par lots jusqu'à la vider ou au premier échec
+   * Retourne { saved, rejected, failed }
+   */
+  async flush(options = {}) {
+    if (this.inFlight) {
+      await this.inFlight.catch(() => {});
+      if (this.inFlight) return this.inFlight;
+    }
+    clearTimeout(this.timer);
+    this.timer = null;
+    this.inFlight = this.drain(options);
+    try {
+      return await this.inFlight;
+    } finally {
+      this.inFlight = null;
+      this.schedule(); // Documents mis en file pendant l'envoi
+    }
+  }
+
+  async drain(options) {
+    const total = { saved: 0, rejected: 0, failed: false };
+    while (this.pending.size) {
+      const outcome = await this.sendBatch(this.nextBatch(), options);
+      total.saved += outcome.saved;
+      total.rejected += outcome.rejected;
+      if (outcome.failed) {
+        total.failed = true;
+        break;
+      }
+    }
+    if (!this.pending.size) this.firstQueuedAt = null;
+    return total;
+  }
+
+  nextBatch() {
+    // Un lot ne concerne qu'un fichier : celui du plus ancien document en attente
+    const entries = [];
+    let file;
+    for (const entry of this.pending.values()) {
+      if (!entries.length) file = entry.file;
+      if (entry.file !== file) continue;
+      entries.push(entry);
+      if (entries.length >= this.maxBatch) break;
+    }
+    const signature = entries.map(e => `${SaveQueue.key(e.file, e.id)}@${e.version}`).join('|');
+    const id = this.failedBatch?.signature === signature
+      ? this.failedBatch.id
+      : (window.crypto?.randomUUID?.() || `${Date.now()}-${Math.random().toString(36).slice(2)}`);
+    return { id, signature, file, entries };
+  }
+
+  async sendBatch(batch, options) {
+    const body = JSON.stringify({
+      batch: batch.id,
+      file: batch.file,
+      documents: batch.entries.map(e => ({ id: e.id, position: e.position, changes: e.changes }))
+    });
+    let response, result;
+    try {
+      response = await fetch(this.endpoint, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: body,
+        // Page masquée ou fermée : la requête survit à la page (corps limité à 64 Ko)
+        keepalive: Boolean(options.keepalive) && body.length < 60000
+      });
+      result = await response.json().catch(() => ({}));
+    } catch (error) {
+      return this.retryLater(batch, error);
+    }
+    if (response.status >= 500 || response.status === 408 || response.status === 429) {
+      return this.retryLater(batch, new Error(result.message || `Erreur HTTP: ${response.status}`));
+    }
+    this.failedBatch = null;
+    this.retryDelay = 0;
+    this.waitingRetry = false;
+
+    // Réponse définitive : les entrées envoyées quittent la file (sauf version plus récente depuis)
+    const rejectedIndexes = new Set((result.rejected || []).map(report => report.index));
+    const saved = [], rejected = [];
+    batch.entries.forEach((entry, i) => {
+      const key = SaveQueue.key(entry.file, entry.id);
+      if (this.pending.get(key)?.version === entry.version) this.pending.delete(key);
+      if (response.ok && !rejectedIndexes.has(i)) saved.push(entry);
+      else rejected.push(entry);
+    });
+    this.persist();
+
+    if (rejected.length) {
+      const reports = result.rejected?.length
+        ? result.rejected
+        : rejected.map(entry => ({ id: entry.id, errors: [{ message: result.message || `Erreur HTTP: ${response.status}` }] }));
+      this.onRejected?.(reports, rejected);
+    }
+    if (saved.length) this.onSaved?.(result, saved);
+    return { saved: saved.length, rejected: rejected.length, failed: false };
+  }
+
+  retryLater(batch, error) {
+    this.failedBatch = { id: batch.id, signature: batch.signature };
+    this.retryDelay = Math.min(this.retryMaxMs, Math.max(this.retryBaseMs, this.retryDelay * 2));
+    const delay = this.retryDelay * (0.8 + Math.random() * 0.4); // Gigue : les onglets ne réessaient pas ensemble
+    this.waitingRetry = true;
+    clearTimeout(this.timer);
+    this.timer = setTimeout(() => {
+      this.waitingRetry = false;
+      this.flush();
+    }, delay);
+    console.warn(`Sauvegarde différée (${this.pending.size} en attente), nouvel essai dans ${Math.round(delay / 1000)} s:`, error);
+    this.onError?.(error, delay);
+    return { saved: 0, rejected: 0, failed: true };
+  }
+
+  /**
+   * Conserver la file dans le navigateur (survit à la fermeture de la page)
+   */
+  persist() {
+    try {
+      if (this.pending.size) {
+        localStorage.setItem(this.storageKey, JSON.stringify([...this.pending.values()]));
+      } else {
+        localStorage.removeItem(this.storageKey);
+      }
+    } catch (error) {
+      console.warn('File de sauvegarde non persistée:', error); // Navigation privée, quota...
+    }
+  }
+
+  restore() {
+    let entries = [];
+    try {
+      entries = JSON.parse(localStorage.getItem(this.storageKey) || '[]');
+    } catch (error) {
+      console.warn('File de sauvegarde illisible, ignorée:', error);
+    }
+    if (!Array.isArray(entries) || !entries.length) return;
+    entries.forEach(entry => {
+      this.pending.set(SaveQueue.key(entry.file, entry.id), { ...entry, version: ++this.version });
+    });
+    console.log(`File de sauvegarde restaurée: ${this.pending.size} document(s) en attente`);
+    this.firstQueuedAt = Date.now();
+    this.schedule();
+  }
+}
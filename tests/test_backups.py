@@ -0,0 +1,47 @@
+"""
+Journal partagé par deux processus : une base créée par l'un ne doit pas faire
+perdre les ajouts de l'autre (python -m pytest tests/test_backups.py)
+"""
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.backups import JournalBackup  # noqa: E402
+
+
+def _ids(backup):
+    return sorted(record['id'] for record in backup.iter_state_at())
+
+
+def test_append_after_compaction_by_other_instance():
+    with tempfile.TemporaryDirectory() as backup_dir:
+        a = JournalBackup(backup_dir)
+        b = JournalBackup(backup_dir)
+        a.create_base([{'id': 0}])
+        a.append([{'id': 1}])
+        b.append([{'id': 2}])
+        b.compact()
+        a.append([{'id': 3}])  # a écrivait dans un segment antérieur à la nouvelle base
+        assert _ids(a) == [0, 1, 2, 3]
+        assert a._records_since_base == 1
+        assert not a.needs_compaction()
+
+
+def test_compaction_counter_follows_other_instance():
+    with tempfile.TemporaryDirectory() as backup_dir:
+        a = JournalBackup(backup_dir, compact_after_records=2)
+        b = JournalBackup(backup_dir, compact_after_records=2)
+        a.create_base([])
+        a.append([{'id': 1}, {'id': 2}])
+        assert a.needs_compaction()
+        b.compact()
+        assert not a.needs_compaction()
+        assert _ids(b) == [1, 2]
+
+
+if __name__ == '__main__':
+    test_append_after_compaction_by_other_instance()
+    test_compaction_counter_follows_other_instance()
+    print('ok')
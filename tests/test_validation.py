@@ -0,0 +1,131 @@
+"""
+Contrôles vectorisés des intervalles d'un lot : bornes, chevauchements de portées
+et portées recouvrant un cue (python -m pytest tests/test_validation.py)
+"""
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.validation import CUE, SCOPE, _check_intervals, validate_batch  # noqa: E402
+
+
+def _check(rows, lengths):
+    """Problèmes relevés par _check_intervals : (document, code, item, autre item)"""
+    found = []
+
+    def error(doc, code, message, **where):
+        found.append((doc, code, where.get('item'), where.get('other')))
+
+    _check_intervals(np.array(rows, dtype=np.int64), np.array(lengths, dtype=np.int64), error)
+    return sorted(found)
+
+
+def _document(doc_id, text, cues=(), scopes=()):
+    return {'id': doc_id, 'text': text,
+            'cues': [{'cue_label': text[s:e], 'positions': [[s, e]]} for s, e in cues],
+            'scopes': [{'scope': text[s:e], 'positions': [[s, e]]} for s, e in scopes]}
+
+
+def _codes(issues):
+    return [issue['code'] for issue in issues]
+
+
+def test_overlapping_scopes():
+    # (doc, type, élément, partie, début, fin)
+    rows = [(0, SCOPE, 0, 0, 0, 10), (0, SCOPE, 1, 0, 5, 15), (0, SCOPE, 2, 0, 15, 20)]
+    assert _check(rows, [20]) == [(0, 'scope_overlap', 1, 0)]
+
+
+def test_documents_do_not_overlap_each_other():
+    # Mêmes positions dans deux documents, et fin d'un document au-delà du début du suivant
+    rows = [(0, SCOPE, 0, 0, 0, 30), (1, SCOPE, 0, 0, 0, 5),
+            (1, CUE, 0, 0, 6, 8), (2, SCOPE, 0, 0, 5, 9), (2, CUE, 0, 0, 20, 25)]
+    assert _check(rows, [30, 10, 25]) == []
+
+
+def test_overlap_found_in_second_document_only():
+    rows = [(0, SCOPE, 0, 0, 0, 5), (0, SCOPE, 1, 0, 6, 9),
+            (1, SCOPE, 0, 0, 0, 5), (1, SCOPE, 1, 0, 4, 9)]
+    assert _check(rows, [9, 9]) == [(1, 'scope_overlap', 1, 0)]
+
+
+def test_parts_of_same_scope_are_not_an_overlap():
+    # Portée en plusieurs parties : la fin maximale courante appartient au même élément
+    rows = [(0, SCOPE, 0, 0, 0, 10), (0, SCOPE, 0, 1, 8, 12), (0, SCOPE, 0, 2, 11, 14)]
+    assert _check(rows, [20]) == []
+
+
+def test_multi_part_scope_overlapping_another_scope():
+    rows = [(0, SCOPE, 0, 0, 0, 4), (0, SCOPE, 0, 1, 10, 14), (0, SCOPE, 1, 0, 12, 18)]
+    assert _check(rows, [20]) == [(0, 'scope_overlap', 1, 0)]
+
+
+def test_scope_covering_cue():
+    rows = [(0, CUE, 0, 0, 3, 6), (0, SCOPE, 0, 0, 0, 10), (0, CUE, 1, 0, 12, 15), (0, SCOPE, 1, 0, 15, 20)]
+    assert _check(rows, [20]) == [(0, 'scope_covers_cue', 0, 0)]
+
+
+def test_bounds():
+    rows = [(0, CUE, 0, 0, -1, 3), (0, CUE, 1, 0, 5, 5), (0, SCOPE, 0, 0, 8, 11), (0, SCOPE, 1, 0, 0, 10)]
+    found = _check(rows, [10])
+    assert found == [(0, 'bounds', 0, None), (0, 'bounds', 0, None), (0, 'bounds', 1, None)]
+
+
+def test_out_of_bounds_intervals_are_not_swept():
+    # Une portée hors bornes ne produit pas en plus un chevauchement
+    rows = [(0, SCOPE, 0, 0, 0, 50), (0, SCOPE, 1, 0, 2, 6), (0, CUE, 0, 0, 3, 4)]
+    assert _check(rows, [10]) == [(0, 'bounds', 0, None), (0, 'scope_covers_cue', 1, 0)]
+
+
+def test_malformed_positions():
+    doc = _document(1, 'il ne vient pas')
+    doc['cues'] = [{'cue_label': 'ne', 'positions': [[3, 'x']]}, 'pas']
+    report, = validate_batch([doc])
+    assert not report['valid']
+    assert _codes(report['errors']) == ['malformed', 'malformed']
+
+
+def test_text_mismatch():
+    doc = _document(1, 'il ne vient pas', cues=[(3, 5)])
+    doc['cues'][0]['cue_label'] = 'pas'
+    report, = validate_batch([doc])
+    assert _codes(report['errors']) == ['text_mismatch']
+    # Comparaison normalisée : casse et apostrophes typographiques
+    ok = _document(2, "L'absence", scopes=[(0, 9)])
+    ok['scopes'][0]['scope'] = 'l’ABSENCE'
+    assert validate_batch([ok])[0]['valid']
+
+
+def test_overlaps_are_warnings_unless_strict():
+    text = 'il ne vient pas du tout'
+    docs = [_document(1, text, cues=[(3, 5)], scopes=[(0, 11), (6, 15)]), _document(2, text, scopes=[(6, 11)])]
+    lenient = validate_batch(docs)
+    assert [report['valid'] for report in lenient] == [True, True]
+    assert sorted(_codes(lenient[0]['warnings'])) == ['scope_covers_cue', 'scope_overlap']
+    assert lenient[1]['warnings'] == []
+
+    strict = validate_batch(docs, strict=True)
+    assert [report['valid'] for report in strict] == [False, True]
+    assert sorted(_codes(strict[0]['errors'])) == ['scope_covers_cue', 'scope_overlap']
+    assert strict[0]['warnings'] == []
+
+
+def test_errors_stay_with_their_document():
+    docs = [_document(1, 'court', scopes=[(0, 5)]), _document(2, 'il ne vient pas', cues=[(3, 5)]),
+            {'id': 3, 'text': 'sans cues'}]
+    docs[0]['scopes'][0]['positions'] = [[0, 12]]
+    reports = validate_batch(docs)
+    assert [report['index'] for report in reports] == [0, 1, 2]
+    assert _codes(reports[0]['errors']) == ['bounds']
+    assert reports[1]['valid'] and reports[1]['errors'] == []
+    assert _codes(reports[2]['errors']) == ['missing_field']
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+    print('ok')